@@ -1,10 +1,13 @@
 import uvicorn
-from rag.api.server import fastapi_server
-import threading
-from rag.vector.vector_database import create_vector_database_instance
+from dotenv import load_dotenv
 import yaml
 import signal
+import subprocess
 import sys
+import os
+
+# 加载环境变量
+load_dotenv()
 
 config = None
 
@@ -13,13 +16,41 @@ def load_config():
         config = yaml.load(f, Loader=yaml.FullLoader)  # 添加Loader参数以避免TypeError
     return config
 
-def start_server(host = "0.0.0.0", port = 8000):
-    """start the fastapi server"""
+def start_server(host = "0.0.0.0", port = 8000, workers = 1):
+    """start the fastapi server
+
+    向量库、嵌入模型与LLM客户端池由应用的 lifespan 在启动阶段初始化，服务就绪后才开始接受请求；
+    workers > 1 时以导入字符串启动多个worker进程，每个worker各自加载应用与向量库（只读快照，见 resolve_ingestion_mode）；
+    会话状态需要通过 SESSION_BACKEND 配置为进程间共享的后端（sqlite:/// 或 redis://）
+    """
+    if workers > 1:
+        if not os.getenv("SESSION_BACKEND", "").startswith(("sqlite:///", "redis://", "rediss://", "unix://")):
+            print("警告: 多worker模式未配置共享的 SESSION_BACKEND，会话只在创建它的worker中可见")
+        uvicorn.run("rag.api.server:fastapi_server", host=host, port=port, workers=workers)
+        return
+
+    from rag.api.server import fastapi_server
     uvicorn.run(fastapi_server, host=host, port=port)
 
-def start_vector_database(path = "/rag/data/vector_db"):
-    """start the vector database"""
-    create_vector_database_instance(path=path)
+def resolve_ingestion_mode(workers: int) -> str:
+    """确定入库方式并写回环境变量，由 worker 进程与入库进程继承
+
+    inline 模式下每个进程各自入库并写索引文件，进程之间没有锁；
+    workers > 1 时改为 worker 模式：API进程只加载快照，由唯一的入库进程写索引
+    """
+    mode = os.getenv("INGESTION_MODE", "inline")
+    if workers > 1 and mode != "worker":
+        print(f"多worker模式（{workers} 个）不支持 INGESTION_MODE={mode}，改用 INGESTION_MODE=worker")
+        mode = "worker"
+    os.environ["INGESTION_MODE"] = mode
+    return mode
+
+def start_ingestion_worker():
+    """INGESTION_MODE=worker 时启动独立的入库进程，API进程只加载其发布的索引快照"""
+    if os.getenv("INGESTION_MODE", "inline") != "worker":
+        return None
+    print("启动独立的入库进程...")
+    return subprocess.Popen([sys.executable, "-m", "rag.vector.ingestion_worker"])
 
 def start_rag_service():
     """start the rag service"""
@@ -36,14 +67,14 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, signal_handler)
     
     config = load_config()
+    workers = int(os.getenv("API_WORKERS", config["fastapi_server"].get("workers", 1)))
+    resolve_ingestion_mode(workers)
     
-    # 将向量数据库线程设置为守护线程，这样主进程结束时它会自动终止
-    thread = threading.Thread(
-        target=start_vector_database, 
-        args=(config["vector_database"]["path"],),
-        daemon=True  # 设置为守护线程
-    )
-    thread.start()
-    
-    # 启动服务器（主线程）
-    start_server(host=config["fastapi_server"]["host"], port=config["fastapi_server"]["port"])
+    ingestion_worker = start_ingestion_worker()
+    try:
+        # 启动服务器（主线程）
+        start_server(host=config["fastapi_server"]["host"], port=config["fastapi_server"]["port"], workers=workers)
+    finally:
+        if ingestion_worker is not None:
+            ingestion_worker.terminate()
+            ingestion_worker.wait(timeout=30)
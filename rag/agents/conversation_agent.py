@@ -1,23 +1,34 @@
-from langchain.agents import AgentType, initialize_agent, Tool
+from langchain.agents import AgentType, AgentExecutor, initialize_agent, create_tool_calling_agent, Tool
 from langchain.memory import ConversationBufferMemory, ChatMessageHistory
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
-from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.base import AsyncCallbackHandler
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain_core.runnables import RunnablePassthrough
-from langchain_core.prompts import ChatPromptTemplate
-from typing import Dict, Any, AsyncGenerator, List, Optional, Union, Callable
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.messages import HumanMessage, SystemMessage
+from typing import Dict, Any, AsyncGenerator, Awaitable, List, Optional, Union, Callable
+from contextlib import nullcontext
 from rag.vector.vector_database import VectorDatabase
+from rag.chains.llm_pool import LLMClientPool, get_llm_pool
+from rag.chains.title_generator import TitleGenerator
+from rag.chains.conversation_store import ConversationStore
+from rag.chains.cancellation import DisconnectWatcher, record_cancellation
 from langchain_core.documents import Document
 import os
 import sys
 import uuid
+import asyncio
 import json
+import logging
 from rag.structs.conversation import ConversationSchema
 
-class StreamingAgentCallbackHandler(BaseCallbackHandler):
-    """自定义流式回调处理器，用于捕获和处理LLM生成的内容"""
+logger = logging.getLogger(__name__)
+
+class StreamingAgentCallbackHandler(AsyncCallbackHandler):
+    """自定义异步流式回调处理器，用于捕获和处理LLM生成的内容
+    
+    回调在事件循环中执行，stream_func 通常为 asyncio.Queue.put_nowait
+    """
     
     def __init__(self, stream_func: Callable[[str], None]):
         """初始化回调处理器
@@ -30,7 +41,7 @@ class StreamingAgentCallbackHandler(BaseCallbackHandler):
         self.tokens = []
         self.current_response = ""
         
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
         """处理LLM生成的新token
         
         Args:
@@ -41,7 +52,7 @@ class StreamingAgentCallbackHandler(BaseCallbackHandler):
         self.current_response += token
         self.stream_func(token)
     
-    def on_llm_end(self, response, **kwargs) -> None:
+    async def on_llm_end(self, response, **kwargs) -> None:
         """LLM生成结束时的回调
         
         Args:
@@ -50,7 +61,7 @@ class StreamingAgentCallbackHandler(BaseCallbackHandler):
         """
         pass
     
-    def on_llm_error(self, error, **kwargs) -> None:
+    async def on_llm_error(self, error, **kwargs) -> None:
         """LLM生成错误时的回调
         
         Args:
@@ -59,7 +70,7 @@ class StreamingAgentCallbackHandler(BaseCallbackHandler):
         """
         self.stream_func(f"\n生成过程中出错: {str(error)}")
 
-    def on_chain_end(self, outputs, **kwargs) -> None:
+    async def on_chain_end(self, outputs, **kwargs) -> None:
         """链执行结束时的回调
         
         Args:
@@ -68,7 +79,7 @@ class StreamingAgentCallbackHandler(BaseCallbackHandler):
         """
         pass
         
-    def on_tool_end(self, output, **kwargs) -> None:
+    async def on_tool_end(self, output, **kwargs) -> None:
         """工具执行结束时的回调
         
         Args:
@@ -77,7 +88,7 @@ class StreamingAgentCallbackHandler(BaseCallbackHandler):
         """
         pass
         
-    def on_agent_action(self, action, **kwargs) -> None:
+    async def on_agent_action(self, action, **kwargs) -> None:
         """代理执行动作时的回调
         
         Args:
@@ -86,7 +97,7 @@ class StreamingAgentCallbackHandler(BaseCallbackHandler):
         """
         pass
 
-    def on_agent_finish(self, finish, **kwargs) -> None:
+    async def on_agent_finish(self, finish, **kwargs) -> None:
         """代理执行完成时的回调
         
         Args:
@@ -113,7 +124,12 @@ class StreamingConversationalAgent:
         verbose: bool = False,
         use_rag: bool = False,
         vector_database: Optional[VectorDatabase] = None,
-        use_ollama: bool = False
+        use_ollama: bool = False,
+        agent_mode: str = "react",
+        llm_pool: Optional[LLMClientPool] = None,
+        title_mode: str = "llm",
+        title_topic_overlap: float = 0.0,
+        conversation_store: Optional[ConversationStore] = None
     ):
         """初始化流式会话代理
         
@@ -127,6 +143,13 @@ class StreamingConversationalAgent:
             use_rag: 是否使用RAG
             vector_database: 向量数据库
             use_ollama: 是否使用ollama
+            agent_mode: Agent类型，react 为对话式ReAct代理，tool_calling 为原生工具调用代理，
+                        后者在一步中返回的多个独立工具调用会被并发执行
+            llm_pool: LLM客户端池，默认使用全局共享的客户端池
+            title_mode: 会话标题生成方式，llm 为调用LLM生成，heuristic 为本地关键词提取
+            title_topic_overlap: 新问题与标题关键词重叠比例低于该值时视为话题切换并重新生成标题，0 表示不重新生成
+            conversation_store: 会话存储，记忆由AgentExecutor读写，memory_factory 需创建以 input 为输入键的记忆；
+                                summary 模式的摘要只用于会话链，Agent按 window 模式裁剪
         """
         self.model_name = model_name
         self.api_base = api_base 
@@ -136,10 +159,18 @@ class StreamingConversationalAgent:
         self.verbose = verbose
         
         # 会话存储
-        self.conversations = {}
+        self.conversation_store = conversation_store or ConversationStore(memory_factory=self._new_memory)
         self.is_use_rag = use_rag
         self.vector_database = vector_database
         self.use_ollama = use_ollama
+        self.agent_mode = agent_mode
+        self.llm_pool = llm_pool or get_llm_pool()
+        self.title_generator = TitleGenerator(
+            mode=title_mode,
+            llm_factory=lambda: self._create_llm(streaming=False, temperature=0.3, max_tokens=50),
+            topic_overlap_threshold=title_topic_overlap
+        )
+        self.conversation_store.add_evict_listener(self.title_generator.discard)
 
     def _query_vector_database(self, query: str)->List[Document]:
         """使用向量数据库查询
@@ -147,11 +178,9 @@ class StreamingConversationalAgent:
         Args:
             query: 查询文本
         """
-        print(f"使用向量数据库查询: {query}")
+        logger.debug("使用向量数据库查询: %s", query)
         recall_docs = self.vector_database.query_vector_database(query)
-        print(f"向量数据库召回文档数: {len(recall_docs)}")
-        # if len(recall_docs) > 0:
-        #     print(f"向量数据库召回文档: {recall_docs[0].page_content}")
+        logger.debug("向量数据库召回文档数: %d", len(recall_docs))
         return recall_docs
     
     def _get_memory(self, conversation_id: str) -> ConversationBufferMemory:
@@ -163,87 +192,76 @@ class StreamingConversationalAgent:
         Returns:
             ConversationBufferMemory: 会话记忆
         """
-        if conversation_id not in self.conversations:
-            # 直接创建ConversationBufferMemory实例
-            self.conversations[conversation_id] = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="output"
-            )
-        return self.conversations[conversation_id]
+        return self.conversation_store.get_or_create(conversation_id).memory
+    
+    @staticmethod
+    def _new_memory() -> ConversationBufferMemory:
+        """创建Agent使用的会话记忆"""
+        return ConversationBufferMemory(
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="output"
+        )
     
 
-    def _create_llm(self, callback_handler):
-        """创建LLM实例
+    def _create_llm(self, streaming: bool = True, temperature: Optional[float] = None, max_tokens: Optional[int] = None):
+        """从客户端池获取LLM实例
+        
+        流式回调不在构造时绑定，而是在调用Agent时通过运行时config传入
         
         Args:
-            callback_handler: 回调处理器
+            streaming: 是否流式输出
+            temperature: 温度参数，默认使用代理配置
+            max_tokens: 最大token数，默认使用代理配置
         """
-        if self.use_ollama:
-            return ChatOllama(
-                model=self.model_name,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                streaming=True,  # 启用流式输出
-                callbacks=[callback_handler],  # 设置回调处理器
-            )
-        else:
-            return ChatOpenAI(
-                model=self.model_name,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                streaming=True,  # 启用流式输出
-                callbacks=[callback_handler],  # 设置回调处理器
-                openai_api_base=self.api_base,
-                openai_api_key=self.api_key
-            )
+        return self.llm_pool.get_llm(
+            provider="ollama" if self.use_ollama else "openai",
+            model=self.model_name,
+            api_base=self.api_base,
+            api_key=self.api_key,
+            temperature=self.temperature if temperature is None else temperature,
+            max_tokens=self.max_tokens if max_tokens is None else max_tokens,
+            streaming=streaming
+        )
         
 
-    def _create_agent(self, conversation_id: str, callback_handler) -> Any:
+    def _create_agent(self, conversation_id: str, memory: Optional[ConversationBufferMemory] = None) -> Any:
         """创建Agent实例
         
         Args:
             conversation_id: 会话ID
-            callback_handler: 回调处理器
+            memory: Agent读写的会话记忆，默认直接使用会话存储中的记忆
             
         Returns:
             Agent: Agent实例
         """
         # 创建LLM实例
-        llm = self._create_llm(callback_handler)
+        llm = self._create_llm()
         
         # 获取记忆
-        memory = self._get_memory(conversation_id)
+        if memory is None:
+            memory = self._get_memory(conversation_id)
                 
-        # 创建工具函数，确保上下文信息被传递
-        def conversation_function(input_dict):
+        def parse_tool_input(input_dict) -> str:
             # 简化输入处理
-            user_input = ""
             if isinstance(input_dict, str):
-                user_input = input_dict
+                return input_dict
             elif isinstance(input_dict, dict) and "input" in input_dict:
-                user_input = input_dict["input"]
-            else:
-                user_input = str(input_dict)
-            
-            # 检索增强
-            recall_docs = []
-            if self.is_use_rag:
-                recall_docs = self._query_vector_database(user_input)
-            
-            rag_contxt = ""
-            if recall_docs:
-                rag_contxt = "以下是相关文档信息：\n\n"
-                for i, doc in enumerate(recall_docs, 1):
-                    source = doc.metadata.get('source', '未知来源')
-                    rag_contxt += f"[文档{i}] 来源: {source}\n内容: {doc.page_content}\n\n"
-            else:   
-                rag_contxt = "没有找到相关文档。"
-            
+                return input_dict["input"]
+            return str(input_dict)
+
+        def build_rag_context(recall_docs: List[Document]) -> str:
+            if not recall_docs:
+                return "没有找到相关文档。"
+            rag_contxt = "以下是相关文档信息：\n\n"
+            for i, doc in enumerate(recall_docs, 1):
+                source = doc.metadata.get('source', '未知来源')
+                rag_contxt += f"[文档{i}] 来源: {source}\n内容: {doc.page_content}\n\n"
+            return rag_contxt
+
+        def build_messages(user_input: str, rag_contxt: str):
             # 直接使用messages格式调用LLM
-            from langchain_core.messages import HumanMessage, SystemMessage
-            
-            messages = [
+            return [
                 SystemMessage(content="""你是一个专业的AI助手。请根据历史对话和检索到的信息回答用户问题。
                 遵循以下原则：
                 1. 如果检索内容中包含问题的答案，请基于这些内容回答
@@ -260,13 +278,64 @@ class StreamingConversationalAgent:
                 我的问题: {user_input}
                 """)
             ]
-            
-            return llm.invoke(messages)
-        
+
+        # 创建工具函数，确保上下文信息被传递
+        # callbacks 参数由工具自动传入，使工具内部的LLM调用也能流式输出到本次请求的处理器
+        def conversation_function(input_dict, callbacks=None):
+            user_input = parse_tool_input(input_dict)
+            recall_docs = self._query_vector_database(user_input) if self.is_use_rag else []
+            return llm.invoke(
+                build_messages(user_input, build_rag_context(recall_docs)),
+                config={"callbacks": callbacks}
+            )
+
+        # 异步版本：检索放到线程中执行，LLM调用走异步接口，不占用执行器线程
+        async def aconversation_function(input_dict, callbacks=None):
+            user_input = parse_tool_input(input_dict)
+            recall_docs = []
+            if self.is_use_rag:
+                recall_docs = await asyncio.to_thread(self._query_vector_database, user_input)
+            return await llm.ainvoke(
+                build_messages(user_input, build_rag_context(recall_docs)),
+                config={"callbacks": callbacks}
+            )
+
+        async def asearch_documents(query: str) -> str:
+            recall_docs = []
+            if self.is_use_rag:
+                recall_docs = await asyncio.to_thread(self._query_vector_database, query)
+            return build_rag_context(recall_docs)
+
+        if self.agent_mode == "tool_calling":
+            # 原生工具调用代理：模型可以在一步中发出多个检索调用，AgentExecutor会并发执行
+            search_tool = Tool(
+                name="search_documents",
+                func=lambda query: build_rag_context(
+                    self._query_vector_database(query) if self.is_use_rag else []
+                ),
+                coroutine=asearch_documents,
+                description="在威胁情报文档库中检索与查询相关的内容。多个互不相关的查询可以同时调用"
+            )
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", "你是一个专业的AI助手。需要资料时调用 search_documents 检索，"
+                           "引用内容时请明确指出信息来源。"),
+                MessagesPlaceholder("chat_history"),
+                ("human", "{input}"),
+                MessagesPlaceholder("agent_scratchpad"),
+            ])
+            return AgentExecutor(
+                agent=create_tool_calling_agent(llm, [search_tool], prompt),
+                tools=[search_tool],
+                memory=memory,
+                verbose=self.verbose,
+                handle_parsing_errors=True
+            )
+
         # 创建会话工具
         conversation_tool = Tool(
             name='对话',
             func=conversation_function,
+            coroutine=aconversation_function,
             description='基于历史对话和检索内容回答用户问题'
         )
         
@@ -279,69 +348,28 @@ class StreamingConversationalAgent:
             verbose=self.verbose,
             handle_parsing_errors=True
         )
-    async def get_title_from_conversation(self, conversation_id: str) -> str:
-        """从会话中生成标题
+    def schedule_title(self, conversation_id: str, message: str) -> Optional[asyncio.Task]:
+        """需要时在后台生成会话标题（新会话或话题切换），不阻塞回答生成
         
         Args:
             conversation_id: 会话ID
+            message: 用户消息
             
         Returns:
-            str: 生成的会话标题
+            Optional[asyncio.Task]: 标题生成任务，沿用已缓存标题时返回 None
         """
-        # 获取会话历史
-        if conversation_id not in self.conversations:
-            return conversation_id
-            
-        memory = self.conversations[conversation_id]
-        chat_history = memory.buffer
-        
-        if not chat_history:
-            return conversation_id
-            
-        # 创建LLM实例（非流式）
-        if self.use_ollama:
-            llm = ChatOllama(
-                model=self.model_name,
-                temperature=0.3,
-                max_tokens=50
-            )
-        else:
-            llm = ChatOpenAI(
-                model=self.model_name,
-                temperature=0.3,
-                max_tokens=50,
-                openai_api_base=self.api_base,
-                openai_api_key=self.api_key
-            )
-            
-        # 创建提示词
-        prompt = ChatPromptTemplate.from_template("""
-        根据以下对话历史，生成一个简短的会话标题（不超过10个字）。标题应该概括对话的主要内容。
-        请直接返回标题文本，不要包含任何其他内容。
-        
-        对话历史:
-        {chat_history}
-        
-        标题:
-        """)
+        return self.title_generator.schedule(conversation_id, message)
+    
+    async def get_title_from_conversation(self, conversation_id: str) -> str:
+        """获取会话标题
         
-        try:
-            # 调用LLM生成标题
-            response = llm.invoke(prompt.format(chat_history=chat_history))
-            title = response.content.strip()
+        Args:
+            conversation_id: 会话ID
             
-            # 尝试解析JSON格式（如果返回的是JSON）
-            try:
-                title_data = json.loads(title)
-                if isinstance(title_data, dict) and "title" in title_data:
-                    return title_data["title"]
-            except:
-                pass
-                
-            return title if title else conversation_id
-        except Exception as e:
-            print(f"生成标题时出错: {str(e)}")
-            return conversation_id
+        Returns:
+            str: 缓存的会话标题，尚未生成时返回会话ID
+        """
+        return self.title_generator.get(conversation_id) or conversation_id
         
     async def get_or_create_conversation(self, conversation_id: str) -> str:
         """获取或创建会话
@@ -349,81 +377,71 @@ class StreamingConversationalAgent:
         Args:
             conversation_id: 会话ID
         """
-        if conversation_id== None or conversation_id not in self.conversations:
-            new_conversation_id = str(uuid.uuid4())
-            self.conversations[new_conversation_id] = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="output"
-            )
-            return new_conversation_id
+        if not await self.conversation_store.acontains(conversation_id):
+            return (await self.conversation_store.acreate()).conversation_id
         return conversation_id
     
 
-    async def astream(self, message: str, conversation_id: str = None) -> AsyncGenerator[str, None]:
+    async def astream(
+        self,
+        message: str,
+        conversation_id: str = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> AsyncGenerator[str, None]:
         """异步流式生成响应
         
         Args:
             message: 用户消息
             conversation_id: 会话ID
+            is_disconnected: 返回客户端是否已断开的协程函数，断开后立即取消Agent任务
             
         Yields:
             str: 响应片段
         """
-        # 创建异步生成器
-        async def token_generator():
-            queue = []
-           
-            # 定义token处理函数
-            def handle_token(token):
-                queue.append(token)
-            
-            # 创建回调处理器
-            callback_handler = StreamingAgentCallbackHandler(handle_token)
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
 
-            
+        # 回调在事件循环中执行，token直接放入asyncio队列，无需轮询
+        callback_handler = StreamingAgentCallbackHandler(queue.put_nowait)
 
-            # 创建Agent
-            agent = self._create_agent(conversation_id, callback_handler)
-            
-            # 运行Agent
-            try:
-                # 非阻塞执行Agent
-                import asyncio
-                from concurrent.futures import ThreadPoolExecutor
-                
-                # 创建执行器
-                loop = asyncio.get_event_loop()
-                with ThreadPoolExecutor() as executor:
-                    # 在线程池中运行同步代码
-                    future = loop.run_in_executor(
-                        executor,
-                        lambda: agent.invoke({"input": message})
-                    )
-                    
-                    # 等待队列中有token
-                    while True:
-                        # 检查队列中是否有token
-                        if queue:
-                            token = queue.pop(0)
-                            yield token
-                        
-                        # 检查Agent是否已完成
-                        if future.done():
-                            # 确保所有剩余token都被处理
-                            while queue:
-                                yield queue.pop(0)
-                            break
-                        
-                        # 短暂等待
-                        await asyncio.sleep(0.01)
-                    
-                    # 确保future完成
-                    await future
-                    
-            except Exception as e:
-                yield f"\n生成过程中出错: {str(e)}"
-        
-        # 返回生成器
-        async for token in token_generator():
-            yield token
+        # Agent在会话记忆的副本上运行，本轮新增的消息结束后交给会话存储按版本号提交，
+        # 其他worker同时写入该会话时重新加载并追加，不会互相覆盖
+        state = await self.conversation_store.aget_or_create(conversation_id)
+        memory = self.conversation_store.memory_factory()
+        memory.chat_memory.messages = list(state.messages)
+        seeded = len(memory.chat_memory.messages)
+
+        # 创建Agent
+        agent = self._create_agent(conversation_id, memory)
+
+        # Agent的每一步（LLM推理与工具调用）都在事件循环中以协程执行，不占用执行器线程
+        task = asyncio.create_task(agent.ainvoke(
+            {"input": message},
+            config={"callbacks": [callback_handler]}
+        ))
+        task.add_done_callback(lambda _: queue.put_nowait(done))
+
+        tokens = 0
+        watcher = DisconnectWatcher(is_disconnected) if is_disconnected else nullcontext()
+        try:
+            async with watcher:
+                while True:
+                    token = await queue.get()
+                    if token is done:
+                        break
+                    tokens += 1
+                    yield token
+                await task
+                await self.conversation_store.asave_messages(
+                    conversation_id, memory.chat_memory.messages[seeded:], summary_as_window=True
+                )
+        except (asyncio.CancelledError, GeneratorExit):
+            record_cancellation(tokens, self.max_tokens)
+            raise
+        except Exception as e:
+            yield f"\n生成过程中出错: {str(e)}"
+        finally:
+            if not task.done():
+                task.cancel()
+                if is_disconnected is not None and watcher.disconnected:
+                    record_cancellation(tokens, self.max_tokens)
@@ -0,0 +1,239 @@
+"""对话请求准入控制
+
+1. 全局并发上限：同时进行的生成数不超过 max_concurrent
+2. 有界等待队列：超过并发上限的请求最多排队 queue_timeout 秒，队列已满或等待超时返回 429 与 Retry-After
+3. 按客户端的令牌桶：限制单个客户端的请求速率
+4. 按会话加锁：同一 conversation_id 的请求串行执行，避免并发写同一会话记忆
+
+排队深度、并发数与等待时间注册到运行时指标 REGISTRY。
+限制按进程生效，多worker部署时总并发为 worker 数 × max_concurrent。
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入
+
+    Args:
+        reason: 拒绝原因，rate_limited / queue_full / queue_timeout
+        retry_after: 建议客户端重试前等待的秒数
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"请求被拒绝: {reason}，请在 {retry_after} 秒后重试")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶
+
+    Args:
+        rate: 每秒补充的令牌数
+        capacity: 桶容量（允许的突发请求数）
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """尝试取出一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionTicket:
+    """准入凭证，生成结束后调用 release 归还并发槽位与会话锁（可重复调用）"""
+
+    def __init__(self, controller: "AdmissionController", conversation_id: Optional[str], wait_seconds: float):
+        self.controller = controller
+        self.conversation_id = conversation_id
+        self.wait_seconds = wait_seconds
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+
+
+class AdmissionController:
+    """准入控制器
+
+    Args:
+        max_concurrent: 全局最大并发生成数
+        max_queue: 最大排队请求数
+        queue_timeout: 排队的最长时间（秒）
+        client_rate: 每个客户端每秒允许的请求数，0 表示不限速
+        client_burst: 每个客户端允许的突发请求数
+        max_clients: 保留令牌桶的客户端数上限，超出时淘汰最久未访问的客户端
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        max_queue: int = 64,
+        queue_timeout: float = 30.0,
+        client_rate: float = 1.0,
+        client_burst: int = 10,
+        max_clients: int = 10000,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # 会话锁与引用计数，没有请求持有或等待时删除
+        self._conversation_locks: Dict[str, list] = {}
+        self._service_seconds = 1.0
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.total_wait_seconds = 0.0
+        self.rejected: Dict[str, int] = {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+        self._active_gauge = REGISTRY.gauge("chat_active_generations", "进行中的生成数")
+        self._queue_gauge = REGISTRY.gauge("chat_queue_depth", "等待准入的请求数")
+        self._wait_histogram = REGISTRY.histogram("chat_queue_wait_seconds", "请求排队等待时间")
+        self._admitted_counter = REGISTRY.counter("chat_admitted_total", "准入的请求数")
+        self._rejected_counters = {
+            reason: REGISTRY.counter(f"chat_rejected_{reason}_total", f"因 {reason} 被拒绝的请求数")
+            for reason in self.rejected
+        }
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        self._rejected_counters[reason].inc()
+        return AdmissionRejected(reason, max(1, math.ceil(retry_after)))
+
+    def _estimated_wait(self) -> float:
+        """按平均生成耗时估算排队需要的时间"""
+        return self._service_seconds * (self.waiting + 1) / self.max_concurrent
+
+    def _check_rate(self, client_id: str) -> None:
+        if not self.client_rate:
+            return
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self._buckets[client_id] = bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_id)
+        wait = bucket.try_acquire()
+        if wait:
+            raise self._reject("rate_limited", wait)
+
+    async def acquire(self, client_id: str, conversation_id: Optional[str] = None) -> AdmissionTicket:
+        """申请准入：先检查客户端速率，再依次等待会话锁与全局并发槽位
+
+        Args:
+            client_id: 客户端标识
+            conversation_id: 会话ID，为空（新会话）时不加会话锁
+
+        Returns:
+            AdmissionTicket: 准入凭证
+
+        Raises:
+            AdmissionRejected: 超出速率、队列已满或等待超时
+        """
+        self._check_rate(client_id)
+        if self.waiting >= self.max_queue:
+            raise self._reject("queue_full", self._estimated_wait())
+
+        start = time.monotonic()
+        entry = None
+        if conversation_id:
+            entry = self._conversation_locks.setdefault(conversation_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+
+        self.waiting += 1
+        self._queue_gauge.inc()
+        lock_acquired = False
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                if entry is not None:
+                    await entry[0].acquire()
+                    lock_acquired = True
+                await self._semaphore.acquire()
+        except TimeoutError:
+            if lock_acquired:
+                entry[0].release()
+            self._drop_conversation_ref(conversation_id)
+            raise self._reject("queue_timeout", self._estimated_wait())
+        except BaseException:
+            if lock_acquired:
+                entry[0].release()
+            self._drop_conversation_ref(conversation_id)
+            raise
+        finally:
+            self.waiting -= 1
+            self._queue_gauge.dec()
+
+        wait_seconds = time.monotonic() - start
+        self._wait_histogram.observe(wait_seconds)
+        self.total_wait_seconds += wait_seconds
+        self.active += 1
+        self.admitted += 1
+        self._active_gauge.inc()
+        self._admitted_counter.inc()
+        return AdmissionTicket(self, conversation_id, wait_seconds)
+
+    def _drop_conversation_ref(self, conversation_id: Optional[str]) -> None:
+        if not conversation_id:
+            return
+        entry = self._conversation_locks.get(conversation_id)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._conversation_locks[conversation_id]
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        # 平均生成耗时的指数滑动平均，用于估算 Retry-After
+        held = time.monotonic() - ticket.admitted_at
+        self._service_seconds = 0.8 * self._service_seconds + 0.2 * held
+        self._semaphore.release()
+        self.active -= 1
+        self._active_gauge.dec()
+        if ticket.conversation_id:
+            entry = self._conversation_locks.get(ticket.conversation_id)
+            if entry is not None:
+                entry[0].release()
+            self._drop_conversation_ref(ticket.conversation_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_wait_seconds": self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+            "avg_service_seconds": self._service_seconds,
+            "conversation_locks": len(self._conversation_locks),
+            "clients": len(self._buckets),
+        }
@@ -1,17 +1,26 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import List, Optional
 import os
 from dotenv import load_dotenv
-from rag.agents.conversation_agent import StreamingConversationalAgent
 from rag.chains.conversation_chain import StreamingConversationChain
-from rag.vector.vector_database import get_vector_database_instance
-import json
+from rag.chains.answer_cache import SemanticAnswerCache
+from rag.chains.llm_pool import get_llm_pool
+from rag.api.chat_api.conversation_setup import create_context_packer, get_conversation_store
+from rag.api.chat_api.admission import AdmissionController, AdmissionRejected
+from rag.chains.cancellation import cancellation_stats
+from rag.chains.sse import SSEStats, TokenCoalescer, dumps, encode_event
+from rag.monitoring.request_timing import record_stage, stage, start_request_timing
+import asyncio
+import logging
 # 加载环境变量
 load_dotenv()
 
 # 创建路由
 chat_api = APIRouter(prefix="/chat")
+logger = logging.getLogger(__name__)
 
 # 请求模型定义
 class ChatRequest(BaseModel):
@@ -19,9 +28,20 @@ class ChatRequest(BaseModel):
     conversation_id: str | None = None
     temperature: float = 0.7
 
+class BatchChatRequest(BaseModel):
+    prompts: List[str] = Field(..., min_length=1)
+    # 同时进行的生成数，不超过 BATCH_MAX_CONCURRENCY
+    concurrency: Optional[int] = Field(None, ge=1)
 
+# 批量问答：单次请求的问题数上限、同时生成数上限与每批检索的问题数
+batch_max_prompts = int(os.getenv("BATCH_MAX_PROMPTS", "500"))
+batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+batch_retrieval_size = int(os.getenv("BATCH_RETRIEVAL_SIZE", "32"))
 
-# 初始化全局代理实例
+
+
+# 初始化全局代理实例（启用时需导入 rag.agents.conversation_agent.StreamingConversationalAgent，
+# 该模块会加载 langchain.agents，导入较慢，因此默认不导入）
 # streaming_conversation = StreamingConversationalAgent(verbose=False,
 #                                                 model_name=os.getenv("BASE_MODEL"),
 #                                                 api_base=os.getenv("API_BASE"),
@@ -30,38 +50,137 @@ class ChatRequest(BaseModel):
 #                                                 vector_database=get_vector_database_instance()
 #                                                )
 
-streaming_conversation = StreamingConversationChain(verbose=False,
-                                                model_name=os.getenv("BASE_MODEL"),
+# 语义回答缓存（可选），通过 ANSWER_CACHE_ENABLED=true 开启，需要向量库的嵌入模型，在 bind_resources 中创建
+answer_cache = None
+
+# 上下文打包器与会话存储由环境变量配置，与 CopilotKit 端点共用（见 conversation_setup）
+context_packer = create_context_packer()
+conversation_store = get_conversation_store()
+
+streaming_conversation = StreamingConversationChain(model_name=os.getenv("BASE_MODEL"),
                                                 api_base=os.getenv("API_BASE"),
                                                 api_key=os.getenv("API_KEY"),
                                                 use_rag=True,
-                                                vector_database=get_vector_database_instance()
+                                                context_packer=context_packer,
+                                                title_mode=os.getenv("TITLE_MODE", "llm"),
+                                                title_topic_overlap=float(os.getenv("TITLE_TOPIC_OVERLAP", "0")),
+                                                conversation_store=conversation_store,
+                                                retrieval_timeout=float(os.getenv("RETRIEVAL_TIMEOUT", "5")),
+                                                # 批量问答每批检索的超时，0 表示按每批问题数放大 RETRIEVAL_TIMEOUT
+                                                batch_retrieval_timeout=float(os.getenv("BATCH_RETRIEVAL_TIMEOUT", "0"))
                                                )
 
+# 等待后台标题生成的最长时间（秒），超时则本轮不推送新标题，生成结果仍会缓存
+title_timeout = float(os.getenv("TITLE_TIMEOUT", "10"))
+
+# 准入控制：全局并发上限、有界等待队列、按客户端限速（CHAT_CLIENT_RATE>0 时开启）、按会话串行
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", "32")),
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT", "30")),
+    client_rate=float(os.getenv("CHAT_CLIENT_RATE", "0")),
+    client_burst=int(os.getenv("CHAT_CLIENT_BURST", "10"))
+)
+
+def bind_resources(resources) -> None:
+    """服务依赖初始化完成后（lifespan 启动阶段）绑定向量库，并按配置创建语义回答缓存
+    
+    Args:
+        resources: 已启动的 ResourceManager
+    """
+    global answer_cache
+    vector_database = resources.get("vector_database")
+    streaming_conversation.vector_database = vector_database
+    if os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true" and vector_database is not None:
+        answer_cache = SemanticAnswerCache(
+            embed_query=vector_database.embeddings.embed_query,
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            max_size=int(os.getenv("ANSWER_CACHE_MAX_SIZE", "1024"))
+        )
+        streaming_conversation.answer_cache = answer_cache
+
+# SSE帧合并：缓冲token至多 SSE_FLUSH_INTERVAL_MS 毫秒或 SSE_FLUSH_BYTES 字节后写出一帧，0 表示逐token写出
+token_coalescer = TokenCoalescer(
+    flush_interval=float(os.getenv("SSE_FLUSH_INTERVAL_MS", "20")) / 1000,
+    max_bytes=int(os.getenv("SSE_FLUSH_BYTES", "64"))
+)
+
+# 可信代理地址（逗号分隔），X-Client-ID 请求头可被客户端任意伪造，只采用这些代理转发请求中的该请求头
+trusted_proxies = {host.strip() for host in os.getenv("TRUSTED_PROXIES", "").split(",") if host.strip()}
+
+def get_client_id(http_request: Request) -> str:
+    """客户端标识：来自可信代理的请求使用 X-Client-ID 请求头，否则使用来源IP"""
+    host = http_request.client.host if http_request.client else "unknown"
+    client_id = http_request.headers.get("X-Client-ID")
+    if client_id and host in trusted_proxies:
+        return client_id
+    return host
+
 @chat_api.post("/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
     try:
         conversation_id = request.conversation_id
         message = request.message  # 保持原始消息格式
+        # 分阶段耗时绑定到请求上下文，检索线程与生成任务中记录的耗时都会汇总到这里
+        timing = start_request_timing()
+
+        # 在返回流式响应前完成准入，未准入时直接返回429
+        try:
+            with stage("queue_wait"):
+                ticket = await admission.acquire(get_client_id(http_request), conversation_id)
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
         
         async def generate_stream(conversation_id: str):
-            full_response = ""
+            response_parts = []
+            stats = SSEStats()
+            try:
+                #检查是否有历史会话，如果没有则创建一个新的会话
+                conversation_id = await streaming_conversation.get_or_create_conversation(conversation_id)
 
-            #检查是否有历史会话，如果没有则创建一个新的会话
-            conversation_id = await streaming_conversation.get_or_create_conversation(conversation_id)
+                yield stats.raw(f"data:[conversation_id]:{conversation_id}\n\n")
 
-            yield f"data:[conversation_id]:{conversation_id}\n\n"
-            async for token_json in streaming_conversation.astream(
-                message=message,
-                conversation_id=conversation_id
-            ):
-                if token_json:
-                    full_response += token_json
-                    yield f"data: {token_json}\n\n"
+                # 标题只在新会话或话题切换时于后台生成，与回答生成并行
+                title_task = streaming_conversation.schedule_title(conversation_id, message)
+                # 客户端断开时立即取消检索与LLM生成；连续的token合并成帧后再编码写出
+                events = streaming_conversation.astream_events(
+                    message=message,
+                    conversation_id=conversation_id,
+                    is_disconnected=http_request.is_disconnected
+                )
+                async for kind, payload in token_coalescer.coalesce(events, stats):
+                    if kind == "token" and "first_token" not in timing.stages:
+                        # 从收到请求到首个token写出，包含排队、检索与LLM首token时间
+                        record_stage("first_token", timing.elapsed)
+                    # 空的token片段不写出；没有召回文档时仍写出 [rag_context]:[]，前端据此结束检索状态
+                    if kind != "token" or payload:
+                        data = encode_event(kind, payload)
+                        response_parts.append(data)
+                        yield stats.frame(data)
+            finally:
+                # 回答写入会话后即归还并发槽位与会话锁，等待标题不占用槽位
+                ticket.release()
 
+            if await http_request.is_disconnected():
+                stats.finish()
+                return
+            if title_task is not None:
+                try:
+                    with stage("title_wait"):
+                        await asyncio.wait_for(asyncio.shield(title_task), timeout=title_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning("会话 %s 标题生成超时，稍后推送", conversation_id)
             conversation_title = await streaming_conversation.get_title_from_conversation(conversation_id)
-            yield f"data:[conversation_title]:{conversation_title}\n\n"
-            yield f"event: complete\ndata: {json.dumps({'type':'conversation_full','data':full_response})}\n\n"
+            yield stats.raw(f"data:[conversation_title]:{conversation_title}\n\n")
+            stats.finish()
+            complete = {
+                'type': 'conversation_full',
+                'data': ''.join(response_parts),
+                'sse': stats.as_dict(),
+                'timing': timing.as_dict()
+            }
+            yield f"event: complete\ndata: {dumps(complete)}\n\n"
             
         return StreamingResponse(
             generate_stream(conversation_id),
@@ -70,16 +189,106 @@ async def chat_stream(request: ChatRequest):
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
                 "X-Accel-Buffering": "no",
-                "Content-Type": "text/event-stream"
-            }
+                "Content-Type": "text/event-stream",
+                # 响应头在流开始前发送，只包含准入排队耗时；完整的分阶段耗时见 complete 事件的 timing 字段
+                "Server-Timing": timing.server_timing()
+            },
+            # 响应未开始迭代就断开时，生成器的 finally 不会执行，由后台任务兜底释放
+            background=BackgroundTask(ticket.release)
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_details = f"错误: {str(e)}\n{traceback.format_exc()}"
         print(error_details)
         raise HTTPException(status_code=500, detail=str(e))
 
+@chat_api.post("/batch")
+async def chat_batch(request: BatchChatRequest, http_request: Request):
+    """批量问答接口，以NDJSON流式返回结果
+
+    检索按批进行（每批一次嵌入、一次FAISS检索），生成并发数有上限，不创建会话、不生成标题；
+    每个问题完成后输出一行 result（index 为问题在请求中的位置），最后一行为 complete。
+    每次生成各占用一个准入槽位，按客户端限速每个问题计一次；第一个槽位在返回响应前申请，
+    未准入时直接返回429，之后的问题未获准入时该行以错误结束
+    """
+    if len(request.prompts) > batch_max_prompts:
+        raise HTTPException(status_code=413, detail=f"单次最多 {batch_max_prompts} 个问题")
+    timing = start_request_timing()
+    client_id = get_client_id(http_request)
+    try:
+        with stage("queue_wait"):
+            ticket = await admission.acquire(client_id, None)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    pending_tickets = [ticket]
+
+    async def acquire_slot():
+        # 第一次生成使用已申请的槽位
+        if pending_tickets:
+            return pending_tickets.pop()
+        return await admission.acquire(client_id, None)
+
+    concurrency = min(request.concurrency or batch_max_concurrency, batch_max_concurrency)
+
+    async def generate_results():
+        errors = 0
+        retrieval_errors = 0
+        try:
+            async for result in streaming_conversation.abatch(
+                request.prompts,
+                concurrency=concurrency,
+                retrieval_batch_size=batch_retrieval_size,
+                acquire=acquire_slot
+            ):
+                errors += result["error"] is not None
+                retrieval_errors += result["retrieval_error"] is not None
+                yield dumps({"event": "result", **result}) + "\n"
+        finally:
+            ticket.release()
+        yield dumps({
+            "event": "complete",
+            "count": len(request.prompts),
+            "errors": errors,
+            "retrieval_errors": retrieval_errors,
+            "timing": timing.as_dict()
+        }) + "\n"
+
+    return StreamingResponse(
+        generate_results(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release)
+    )
+
 @chat_api.get("/health")
 def health_check():
-    return {"status": "OK"}
\ No newline at end of file
+    return {"status": "OK"}
+
+@chat_api.get("/cache/stats")
+def cache_stats():
+    if answer_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **answer_cache.stats()}
+
+@chat_api.get("/title/stats")
+def title_stats():
+    return streaming_conversation.title_generator.stats()
+
+@chat_api.get("/conversations/stats")
+def conversation_stats():
+    return conversation_store.stats()
+
+@chat_api.get("/admission/stats")
+def admission_stats():
+    return admission.stats()
+
+@chat_api.get("/cancellation/stats")
+def cancellation_stats_endpoint():
+    return cancellation_stats()
+
+@chat_api.get("/llm_pool/stats")
+def llm_pool_stats():
+    return get_llm_pool().stats()
\ No newline at end of file
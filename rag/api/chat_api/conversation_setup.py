@@ -0,0 +1,45 @@
+"""/chat 与 CopilotKit 端点共用的会话组件
+
+上下文打包器与会话存储都由环境变量配置，两个端点从这里获取，配置只在一处读取。
+"""
+import os
+from typing import Optional
+
+from rag.chains.context_packer import ContextPacker, TokenCounter
+from rag.chains.conversation_store import ConversationStore
+from rag.chains.session_backend import create_session_backend
+
+DEFAULT_SPILL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data/conversations"))
+
+conversation_store_instance = None
+
+
+def create_context_packer() -> Optional[ContextPacker]:
+    """上下文打包器，CONTEXT_TOKEN_BUDGET<=0 时不打包，完整拼接召回内容与历史对话"""
+    context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4096"))
+    if context_token_budget <= 0:
+        return None
+    return ContextPacker(
+        max_tokens=context_token_budget,
+        token_counter=TokenCounter(os.getenv("CONTEXT_TOKENIZER", "cl100k_base"))
+    )
+
+
+def get_conversation_store() -> ConversationStore:
+    """获取进程内共享的有界会话存储
+
+    - 超出容量或空闲超时的会话落盘到 CONVERSATION_SPILL_DIR（为空则直接丢弃）
+    - SESSION_BACKEND 配置为 sqlite:///... 或 redis://... 时会话写入共享后端，多个worker可处理同一会话
+    - CONVERSATION_MEMORY_MODE: buffer 完整历史 / window 最近N轮 / summary 最近N轮+滚动摘要
+    """
+    global conversation_store_instance
+    if conversation_store_instance is None:
+        conversation_store_instance = ConversationStore(
+            max_size=int(os.getenv("CONVERSATION_MAX_SIZE", "1000")),
+            ttl_seconds=float(os.getenv("CONVERSATION_TTL", "3600")),
+            spill_dir=os.getenv("CONVERSATION_SPILL_DIR", DEFAULT_SPILL_DIR) or None,
+            memory_mode=os.getenv("CONVERSATION_MEMORY_MODE", "buffer"),
+            window_turns=int(os.getenv("CONVERSATION_WINDOW_TURNS", "5")),
+            backend=create_session_backend(os.getenv("SESSION_BACKEND", ""))
+        )
+    return conversation_store_instance
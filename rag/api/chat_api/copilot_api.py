@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 
 from rag.chains.conversation_chain import StreamingConversationChain
-from rag.vector.vector_database import get_vector_database_instance
+from rag.api.chat_api.conversation_setup import create_context_packer, get_conversation_store
 from dotenv import load_dotenv
 import os
 
@@ -11,20 +11,31 @@ load_dotenv()
 
 # 初始化对话链
 streaming_conversation = StreamingConversationChain(
-    verbose=False,
     model_name=os.getenv("BASE_MODEL"),
     api_base=os.getenv("API_BASE"),
     api_key=os.getenv("API_KEY"),
     use_rag=True,
-    vector_database=get_vector_database_instance()
+    context_packer=create_context_packer(),
+    title_mode=os.getenv("TITLE_MODE", "llm"),
+    title_topic_overlap=float(os.getenv("TITLE_TOPIC_OVERLAP", "0")),
+    # 与 /chat 共用同一个会话存储，conversation_store_entries 等指标只对应一个存储
+    conversation_store=get_conversation_store(),
+    retrieval_timeout=float(os.getenv("RETRIEVAL_TIMEOUT", "5"))
 )
 
+def bind_resources(resources) -> None:
+    """服务依赖初始化完成后绑定向量库"""
+    streaming_conversation.vector_database = resources.get("vector_database")
+
 async def chat_with_ai(message: str, conversation_id: str = None, temperature: float = 0.7):
     """与AI进行对话的处理函数"""
     try:
         # 获取或创建会话ID
         conversation_id = await streaming_conversation.get_or_create_conversation(conversation_id)
         
+        # 需要时在后台生成标题，与回答生成并行
+        title_task = streaming_conversation.schedule_title(conversation_id, message)
+        
         # 获取完整响应
         full_response = ""
         async for token in streaming_conversation.astream(
@@ -35,6 +46,8 @@ async def chat_with_ai(message: str, conversation_id: str = None, temperature: f
                 full_response += token
         
         # 获取对话标题
+        if title_task is not None:
+            await title_task
         conversation_title = await streaming_conversation.get_title_from_conversation(conversation_id)
         
         return {
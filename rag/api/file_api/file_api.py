@@ -1,20 +1,40 @@
 import hashlib
 import os
 import json
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import zipfile
 from datetime import datetime
 import asyncio
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from typing import List, Dict
-from fastapi.responses import JSONResponse
-import aiofiles
-from rag.api.server import fastapi_server as app
+from fastapi import APIRouter, UploadFile, File, HTTPException
+from typing import Any, AsyncIterator, BinaryIO, Callable, Iterator, List, Dict, Optional, Tuple
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from rag.chains.sse import dumps
+from rag.vector.ingestion import IngestionJobQueue
 
-UPLOAD_DIR = "../../data/file_uploads"
-FILE_INFO = "../../data/file_info.json"
-file_lock = asyncio.Lock()  # 异步文件操作锁
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../data"))
+# 与向量库监听的上传目录一致
+UPLOAD_DIR = os.getenv("FILE_UPLOAD_DIR", os.path.join(DATA_DIR, "file_uploads"))
+# 旧版本的JSON元数据，首次打开数据库时导入
+FILE_INFO = os.path.join(DATA_DIR, "file_info.json")
+FILE_INFO_DB = os.getenv("FILE_INFO_DB", os.path.join(DATA_DIR, "file_info.db"))
+CHUNK_SIZE = 1024 * 1024
+# 同时执行的入库任务数
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# 单次上传请求中同时保存的文件（或解压的压缩包）数
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+# 压缩包内成员数与解压后总字节数上限，防止压缩炸弹
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "1000"))
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# 向量库可解析的文档类型，压缩包中的其他文件跳过
+DOCUMENT_EXTENSIONS = (".pdf", ".json", ".txt", ".docx")
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+file_api = APIRouter()
 
-# 确保上传目录存在
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 def generate_file_hash(file_path: str, chunk_size: int = 8192) -> str:
     """生成文件的SHA256哈希值"""
@@ -25,81 +45,339 @@ def generate_file_hash(file_path: str, chunk_size: int = 8192) -> str:
     return sha256.hexdigest()
 
 
-async def update_file_info(file_hash: str, original_name: str) -> None:
-    """异步更新文件信息到JSON文件"""
+def copy_and_hash(source: BinaryIO, temp_dir: str, chunk_size: int = CHUNK_SIZE) -> Tuple[str, str, int]:
+    """将上传内容分块写入临时文件，同时计算SHA256
+
+    Args:
+        source: 上传文件的文件对象
+        temp_dir: 临时目录，需与上传目录在同一文件系统以便原子重命名
+        chunk_size: 每次读写的字节数
+
+    Returns:
+        Tuple[str, str, int]: (临时文件路径, SHA256, 字节数)
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix=".part")
     try:
-        # 使用异步锁保证线程安全
-        async with file_lock:
-            # 读取现有数据
-            data: Dict = {}
-            if os.path.exists(FILE_INFO):
-                async with aiofiles.open(FILE_INFO, mode='r') as f:
-                    content = await f.read()
-                    if content:
-                        data = json.loads(content)
-
-            # 更新数据
-            data[file_hash] = {
-                "original_name": original_name,
-                "upload_time": datetime.now().isoformat()
-            }
-
-            # 写入更新后的数据
-            async with aiofiles.open(FILE_INFO, mode='w') as f:
-                await f.write(json.dumps(data, indent=2))
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to update file info: {str(e)}"
-        )
+        with os.fdopen(fd, "wb") as f:
+            while chunk := source.read(chunk_size):
+                sha256.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path, sha256.hexdigest(), size
 
 
+class UploadStore:
+    """按内容寻址的上传文件存储
 
-async def save_upload_file(file: UploadFile) -> dict:
-    """保存上传文件并返回文件信息"""
-    try:
-        contents = await file.read()
-        temp_path = os.path.join(UPLOAD_DIR, file.filename)
-        
-        # 保存临时文件
-        with open(temp_path, "wb") as f:
-            f.write(contents)
-        
-        # 生成哈希并重命名
-        file_hash = generate_file_hash(temp_path)
-        filename, ext = os.path.splitext(file.filename)
-        new_filename = f"{file_hash}{ext}"
-        new_path = os.path.join(UPLOAD_DIR, new_filename)
-        os.rename(temp_path, new_path)
-
-        # 异步更新文件信息
-        await update_file_info(file_hash, file.filename)
+    文件以 SHA256 命名保存在上传目录，相同内容只保存一份；
+    元数据写入SQLite：files 表记录每个内容一行，uploads 表追加记录每次上传，
+    并发上传只在各自的短事务上竞争，不再每次重写整个JSON文件。
 
+    Args:
+        upload_dir: 上传目录
+        db_path: 元数据数据库路径
+        legacy_json: 旧版本的 file_info.json，存在时首次打开数据库导入
+    """
+
+    def __init__(self, upload_dir: str = UPLOAD_DIR, db_path: str = FILE_INFO_DB, legacy_json: Optional[str] = FILE_INFO):
+        self.upload_dir = upload_dir
+        # 临时文件放在上传目录之外，避免向量库把未完成的上传当作新文档
+        self.temp_dir = os.path.join(os.path.dirname(os.path.abspath(upload_dir)), ".upload_tmp")
+        self.db_path = db_path
+        os.makedirs(self.upload_dir, exist_ok=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self._local = threading.local()
+        # 只保护查重与重命名，哈希计算与写入在锁外并行进行
+        self._commit_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    hash TEXT PRIMARY KEY,
+                    saved_name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS uploads (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    hash TEXT NOT NULL,
+                    original_name TEXT NOT NULL,
+                    upload_time TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS uploads_hash ON uploads(hash);
+                """
+            )
+        if legacy_json and os.path.exists(legacy_json):
+            self._import_legacy(legacy_json)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self, path: str) -> None:
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM uploads LIMIT 1").fetchone():
+                return
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data: Dict = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取旧版文件信息 {path} 失败: {str(e)}")
+                return
+            conn.executemany(
+                "INSERT INTO uploads (hash, original_name, upload_time) VALUES (?, ?, ?)",
+                [(h, info.get("original_name", ""), info.get("upload_time", "")) for h, info in data.items()]
+            )
+            print(f"已从 {path} 导入 {len(data)} 条文件信息")
+
+    def lookup(self, file_hash: str) -> Optional[dict]:
+        """查询已保存的内容，记录存在但文件已被删除时视为不存在"""
+        row = self._connect().execute(
+            "SELECT saved_name, size FROM files WHERE hash = ?", (file_hash,)
+        ).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.upload_dir, row[0])):
+            return None
+        return {"saved_name": row[0], "size": row[1]}
+
+    def _commit_upload(self, temp_path: str, file_hash: str, size: int, original_name: str) -> dict:
+        """登记一次上传：新内容原子重命名到上传目录，重复内容丢弃临时文件"""
+        now = datetime.now().isoformat()
+        with self._commit_lock:
+            existing = self.lookup(file_hash)
+            if existing is not None:
+                os.unlink(temp_path)
+                saved_name, duplicate = existing["saved_name"], True
+            else:
+                _, ext = os.path.splitext(original_name)
+                saved_name, duplicate = f"{file_hash}{ext.lower()}", False
+                os.replace(temp_path, os.path.join(self.upload_dir, saved_name))
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO files (hash, saved_name, size, created_at) VALUES (?, ?, ?, ?)",
+                        (file_hash, saved_name, size, now)
+                    )
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO uploads (hash, original_name, upload_time) VALUES (?, ?, ?)",
+                (file_hash, original_name, now)
+            )
         return {
-            "original_name": file.filename,
-            "saved_name": new_filename,
+            "original_name": original_name,
+            "saved_name": saved_name,
             "hash": file_hash,
-            "path": new_path,
-            "size": len(contents)
+            "path": os.path.join(self.upload_dir, saved_name),
+            "size": size,
+            "duplicate": duplicate
         }
+
+    def save(self, source: BinaryIO, original_name: str) -> dict:
+        """流式保存上传内容并登记元数据（同步，在线程池中调用）"""
+        temp_path, file_hash, size = copy_and_hash(source, self.temp_dir)
+        try:
+            return self._commit_upload(temp_path, file_hash, size, original_name)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def uploads(self, file_hash: str) -> List[dict]:
+        """某个内容的全部上传记录"""
+        rows = self._connect().execute(
+            "SELECT original_name, upload_time FROM uploads WHERE hash = ? ORDER BY id", (file_hash,)
+        ).fetchall()
+        return [{"original_name": name, "upload_time": upload_time} for name, upload_time in rows]
+
+
+def is_archive(filename: str) -> bool:
+    name = (filename or "").lower()
+    return name.endswith(".zip") or name.endswith(TAR_EXTENSIONS)
+
+
+def _iter_zip_members(source: BinaryIO) -> Iterator[Tuple[str, int, Optional[Callable[[], BinaryIO]]]]:
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, info.file_size, lambda info=info: archive.open(info)
+
+
+def _iter_tar_members(source: BinaryIO) -> Iterator[Tuple[str, int, Optional[Callable[[], BinaryIO]]]]:
+    # 流式模式（r|*）按顺序读取，不需要随机访问，也不会先解压到临时目录
+    with tarfile.open(fileobj=source, mode="r|*") as archive:
+        for member in archive:
+            if member.isdir():
+                continue
+            # 链接与设备文件没有可读取的内容
+            yield member.name, member.size, (lambda member=member: archive.extractfile(member)) if member.isfile() else None
+
+
+def extract_archive(store: UploadStore, source: BinaryIO, filename: str, emit: Callable[[Dict[str, Any]], None]) -> None:
+    """流式解压压缩包，逐个成员分块写入上传存储（同步，在线程池中调用）
+
+    成员内容直接从压缩流复制到内容寻址的存储，不在磁盘上展开目录结构；
+    只保存向量库可解析的文档，其余成员以 skipped 事件报告
+
+    Args:
+        store: 上传存储
+        source: 压缩包的文件对象
+        filename: 压缩包文件名，zip 或 tar（含 gz/bz2/xz 压缩）
+        emit: 事件回调，每个成员一个 file / skipped / error 事件
+    """
+    members = _iter_zip_members(source) if filename.lower().endswith(".zip") else _iter_tar_members(source)
+    count, total_bytes = 0, 0
+    for name, size, open_member in members:
+        original_name = f"{filename}/{name}"
+        _, ext = os.path.splitext(name)
+        if os.path.basename(name).startswith(".") or name.startswith("__MACOSX/") or open_member is None:
+            emit({"event": "skipped", "filename": original_name, "reason": "not a regular file"})
+            continue
+        if ext.lower() not in DOCUMENT_EXTENSIONS:
+            emit({"event": "skipped", "filename": original_name, "reason": f"unsupported type {ext or '(none)'}"})
+            continue
+        count += 1
+        total_bytes += size
+        if count > ARCHIVE_MAX_MEMBERS or total_bytes > ARCHIVE_MAX_BYTES:
+            raise ValueError(
+                f"压缩包 {filename} 超出限制（最多 {ARCHIVE_MAX_MEMBERS} 个文档、解压后 {ARCHIVE_MAX_BYTES} 字节）"
+            )
+        try:
+            with open_member() as stream:
+                emit({"event": "file", "archive": filename, **store.save(stream, original_name)})
+        except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+            emit({"event": "error", "filename": original_name, "error": str(e)})
+
+
+upload_store: Optional[UploadStore] = None
+
+
+def get_upload_store() -> UploadStore:
+    global upload_store
+    if upload_store is None:
+        upload_store = UploadStore()
+    return upload_store
+
+
+def _vector_database_ingest():
+    from rag.vector.vector_database import get_vector_database_instance
+
+    vector_database = get_vector_database_instance()
+    # reader模式下由独立的入库进程入库，任务只需异步等待包含这些文件的快照
+    if getattr(vector_database, "ingestion_mode", None) == "reader":
+        return vector_database.await_ingested
+    return vector_database.ingest_files
+
+
+# 上传后立即入库，不再等待向量库的定时轮询；由服务 lifespan 启动与停止
+ingestion_queue = IngestionJobQueue(_vector_database_ingest, workers=INGEST_WORKERS)
+
+
+async def save_upload_file(file: UploadFile) -> dict:
+    """保存上传文件并返回文件信息
+
+    上传内容分块写入临时文件并同时计算哈希，不在内存中保留整个文件，也不再二次读取计算哈希；
+    内容已存在时只追加一条上传记录
+    """
+    try:
+        return await asyncio.to_thread(get_upload_store().save, file.file, file.filename)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        await file.close()
-
-@app.post("/upload/")
-async def upload_files(files: List[UploadFile] = File(...)):
-    """批量上传文件接口"""
-    results = []
-    for file in files:
+
+@file_api.post("/upload/")
+async def upload_files(files: List[UploadFile] = File(...), priority: int = 10):
+    """批量上传文件接口，支持 zip / tar 压缩包，以NDJSON流式返回进度
+
+    文件与压缩包最多 UPLOAD_CONCURRENCY 个同时保存，每保存一个文档输出一行事件：
+    file（保存结果）、skipped（压缩包中跳过的成员）、error（保存失败）；
+    最后一行为 complete，汇总数量并给出新内容的入库任务ID（没有新内容时为 None）；
+    客户端提前断开时，已保存的新内容由响应的后台任务提交入库
+
+    Args:
+        files: 上传的文件或压缩包
+        priority: 入库任务优先级，数值越小越先执行
+    """
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    done = object()
+    counts = {"file": 0, "duplicate": 0, "skipped": 0, "error": 0}
+    new_files: Dict[str, None] = {}
+
+    def emit(event: Dict[str, Any]) -> None:
+        # 由保存线程调用，事件按产生顺序进入队列
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    async def process(file: UploadFile) -> None:
+        async with semaphore:
+            try:
+                if is_archive(file.filename):
+                    await asyncio.to_thread(extract_archive, get_upload_store(), file.file, file.filename, emit)
+                else:
+                    emit({"event": "file", **await save_upload_file(file)})
+            except HTTPException as e:
+                emit({"event": "error", "filename": file.filename, "error": e.detail})
+            except Exception as e:
+                emit({"event": "error", "filename": file.filename, "error": str(e)})
+            finally:
+                await file.close()
+
+    async def process_all() -> None:
+        try:
+            await asyncio.gather(*(process(file) for file in files))
+        finally:
+            emit(done)
+
+    async def submit_ingestion() -> Optional[str]:
+        # 只提交一次：正常结束时在 complete 之前提交，客户端断开时由后台任务提交
+        if not new_files:
+            return None
+        saved_names = list(new_files)
+        new_files.clear()
+        return (await ingestion_queue.submit(saved_names, priority=priority)).job_id
+
+    async def stream() -> AsyncIterator[str]:
+        task = asyncio.create_task(process_all())
         try:
-            file_info = await save_upload_file(file)
-            results.append(file_info)
-        except Exception as e:
-            results.append({
-                "filename": file.filename,
-                "error": str(e)
-            })
-            
-    return JSONResponse(content={"files": results})
+            while (event := await events.get()) is not done:
+                counts[event["event"]] += 1
+                if event["event"] == "file":
+                    if event["duplicate"]:
+                        counts["duplicate"] += 1
+                    else:
+                        new_files[event["saved_name"]] = None
+                yield dumps(event) + "\n"
+        finally:
+            if not task.done():
+                task.cancel()
+        job_id = await submit_ingestion()
+        yield dumps({
+            "event": "complete",
+            "files": counts["file"],
+            "duplicates": counts["duplicate"],
+            "skipped": counts["skipped"],
+            "errors": counts["error"],
+            "job_id": job_id
+        }) + "\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(submit_ingestion)
+    )
+
 
+@file_api.get("/ingest/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """查询入库任务的状态、各阶段进度与耗时"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"入库任务 {job_id} 不存在")
+    return job.as_dict()
@@ -0,0 +1,232 @@
+"""服务依赖的生命周期管理
+
+由 FastAPI lifespan 在启动时调用 ResourceManager.startup，关闭时调用 shutdown：
+
+- 每个组件只初始化一次（重复调用 startup 不会重复加载嵌入模型）
+- 各组件在线程池中并行初始化与预热，启动耗时按组件分别记录
+- 必需组件初始化失败时关闭已启动的组件并让启动失败；可选组件（如Neo4j）失败只记录错误
+- 关闭时按启动的逆序释放资源
+"""
+import asyncio
+import functools
+import inspect
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from rag.cpu_resources import ResourceSettings, apply_torch_settings, load_resource_settings
+
+
+@dataclass
+class Component:
+    """受管理的组件
+
+    Args:
+        name: 组件名
+        start: 创建并预热组件的函数，同步函数在线程池中执行
+        stop: 释放组件的函数，参数为 start 的返回值
+        required: 初始化失败时是否终止启动
+    """
+    name: str
+    start: Callable[[], Any]
+    stop: Optional[Callable[[Any], Any]] = None
+    required: bool = True
+    resource: Any = field(default=None, repr=False)
+    startup_seconds: Optional[float] = None
+    error: Optional[str] = None
+    started: bool = False
+
+
+async def _call(func: Callable, *args) -> Any:
+    if inspect.iscoroutinefunction(func):
+        return await func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+class ResourceManager:
+    """服务依赖的单次初始化、并行预热与有序关闭"""
+
+    def __init__(self):
+        self._components: Dict[str, Component] = {}
+        self._order: List[str] = []
+        self._lock = asyncio.Lock()
+        self.ready = False
+        self.startup_seconds: Optional[float] = None
+
+    def register(
+        self,
+        name: str,
+        start: Callable[[], Any],
+        stop: Optional[Callable[[Any], Any]] = None,
+        required: bool = True,
+    ) -> None:
+        """注册组件，需在 startup 之前调用"""
+        if name in self._components:
+            raise ValueError(f"组件 {name} 已注册")
+        self._components[name] = Component(name, start, stop, required)
+
+    def get(self, name: str) -> Any:
+        """获取已启动的组件，未启动或初始化失败时返回 None"""
+        component = self._components.get(name)
+        return component.resource if component is not None and component.started else None
+
+    async def _start(self, component: Component) -> None:
+        start = time.perf_counter()
+        try:
+            component.resource = await _call(component.start)
+            component.started = True
+        except Exception as e:
+            component.error = f"{type(e).__name__}: {e}"
+            if component.required:
+                raise
+            print(f"可选组件 {component.name} 初始化失败，已跳过: {component.error}")
+        finally:
+            component.startup_seconds = time.perf_counter() - start
+            if component.started:
+                self._order.append(component.name)
+
+    async def startup(self) -> None:
+        """并行初始化所有组件，已启动时直接返回"""
+        async with self._lock:
+            if self.ready:
+                return
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(self._start(c) for c in self._components.values()), return_exceptions=True
+            )
+            self.startup_seconds = time.perf_counter() - start
+            failures = [r for r in results if isinstance(r, BaseException)]
+            if failures:
+                await self._shutdown()
+                raise failures[0]
+            self.ready = True
+            breakdown = "，".join(
+                f"{c.name} {c.startup_seconds:.2f}s" for c in self._components.values()
+                if c.startup_seconds is not None
+            )
+            print(f"服务依赖初始化完成，共 {self.startup_seconds:.2f}s（{breakdown}）")
+
+    async def _shutdown(self) -> None:
+        for name in reversed(self._order):
+            component = self._components[name]
+            if component.stop is not None:
+                try:
+                    await _call(component.stop, component.resource)
+                except Exception as e:
+                    print(f"关闭组件 {name} 时出错: {str(e)}")
+            component.started = False
+            component.resource = None
+        self._order.clear()
+
+    async def shutdown(self) -> None:
+        """按启动的逆序释放组件"""
+        async with self._lock:
+            await self._shutdown()
+            self.ready = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "startup_seconds": self.startup_seconds,
+            "components": {
+                c.name: {
+                    "started": c.started,
+                    "required": c.required,
+                    "startup_seconds": c.startup_seconds,
+                    "error": c.error,
+                    # 组件自身记录的细分耗时，如向量库的嵌入模型加载与索引加载
+                    **({"breakdown": c.resource.startup_times}
+                       if c.started and isinstance(getattr(c.resource, "startup_times", None), dict) else {}),
+                }
+                for c in self._components.values()
+            },
+        }
+
+
+def _start_vector_database(cpu_settings: ResourceSettings):
+    # 在线程池中执行，只设置 torch 线程数；CPU亲和性与 FAISS 线程数由服务 lifespan 在此之前设置
+    apply_torch_settings(cpu_settings)
+    from rag.vector.vector_database import get_vector_database_instance
+
+    return get_vector_database_instance()
+
+
+def _stop_vector_database(vector_database) -> None:
+    stop = getattr(vector_database, "stop_auto_update", None)
+    if stop is not None:
+        stop()
+
+
+def _start_llm_pool():
+    """创建对话模型的客户端并缓存到客户端池，首个请求无需再创建客户端"""
+    from rag.chains.conversation_chain import CONVERSATION_PROMPT_TEMPLATE
+    from rag.chains.llm_pool import get_llm_pool
+
+    pool = get_llm_pool()
+    if os.getenv("BASE_MODEL"):
+        pool.get_chain(
+            CONVERSATION_PROMPT_TEMPLATE,
+            provider="openai",
+            model=os.getenv("BASE_MODEL"),
+            api_base=os.getenv("API_BASE"),
+            api_key=os.getenv("API_KEY"),
+            temperature=0.7,
+            max_tokens=2048,
+            streaming=True,
+        )
+    return pool
+
+
+async def _stop_llm_pool(pool) -> None:
+    await pool.aclose()
+
+
+def _start_conversation_memory():
+    """预先导入会话记忆依赖（langchain.memory），首个会话创建时无需再导入"""
+    from rag.chains.conversation_store import default_memory_factory
+
+    return default_memory_factory()
+
+
+def _start_tokenizer():
+    """加载上下文打包使用的分词器，加载结果按名称缓存，各会话链的 TokenCounter 共用"""
+    from rag.chains.context_packer import TokenCounter
+
+    return TokenCounter(os.getenv("CONTEXT_TOKENIZER", "cl100k_base")).load()
+
+
+def _start_neo4j():
+    from neo4j import GraphDatabase
+
+    driver = GraphDatabase.driver(
+        os.getenv("NEO4J_URI"),
+        auth=(os.getenv("NEO4J_USER", "neo4j"), os.getenv("NEO4J_PASSWORD", ""))
+    )
+    try:
+        driver.verify_connectivity()
+    except Exception:
+        driver.close()
+        raise
+    return driver
+
+
+def create_resource_manager(cpu_settings: Optional[ResourceSettings] = None) -> ResourceManager:
+    """注册服务默认依赖：向量库（含嵌入模型）、LLM客户端池、会话记忆依赖、上下文分词器，
+    以及配置了 NEO4J_URI 时的Neo4j驱动
+
+    Args:
+        cpu_settings: API进程的CPU资源配置，默认读取 config.yaml 的 resources.api
+    """
+    cpu_settings = cpu_settings or load_resource_settings("api")
+    resources = ResourceManager()
+    resources.register(
+        "vector_database", functools.partial(_start_vector_database, cpu_settings), _stop_vector_database
+    )
+    resources.register("llm_pool", _start_llm_pool, _stop_llm_pool)
+    resources.register("conversation_memory", _start_conversation_memory)
+    if int(os.getenv("CONTEXT_TOKEN_BUDGET", "4096")) > 0:
+        resources.register("tokenizer", _start_tokenizer)
+    if os.getenv("NEO4J_URI"):
+        resources.register("neo4j", _start_neo4j, lambda driver: driver.close(), required=False)
+    return resources
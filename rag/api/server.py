@@ -1,11 +1,41 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from copilotkit.integrations.fastapi import add_fastapi_endpoint
-from copilotkit import CopilotKitRemoteEndpoint, Action as CopilotAction
 # 导入路由
+from rag.api.chat_api import chat_api as chat_api_module
+from rag.api.chat_api import copilot_api as copilot_api_module
 from rag.api.chat_api.chat_api import chat_api  # 这一行很重要
 from rag.api.chat_api.copilot_api import chat_with_ai
-fastapi_server = FastAPI()
+from rag.api.file_api.file_api import file_api, ingestion_queue
+from rag.api.resources import create_resource_manager
+from rag.cpu_resources import (
+    apply_process_settings,
+    configure_default_executor,
+    describe_cpu_usage,
+    load_resource_settings,
+)
+from rag.monitoring.runtime_metrics import render_prometheus
+# 向量库（含嵌入模型）、LLM客户端池与可选的Neo4j驱动在启动阶段并行初始化一次，关闭时释放
+# config.yaml 中 resources.api 的线程数配置，向量库加载前应用
+cpu_settings = load_resource_settings("api")
+resources = create_resource_manager(cpu_settings)
+# 上传触发的入库任务工作协程
+resources.register("ingestion_queue", ingestion_queue.start, ingestion_queue.stop)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # CPU亲和性与 FAISS 线程数是进程级配置，在启动组件与创建线程池线程之前应用
+    apply_process_settings(cpu_settings)
+    configure_default_executor(cpu_settings)
+    await resources.startup()
+    chat_api_module.bind_resources(resources)
+    copilot_api_module.bind_resources(resources)
+    yield
+    await resources.shutdown()
+
+fastapi_server = FastAPI(lifespan=lifespan)
 
 # 配置CORS
 fastapi_server.add_middleware(
@@ -18,47 +48,70 @@ fastapi_server.add_middleware(
 
 # 添加路由
 fastapi_server.include_router(chat_api)
+fastapi_server.include_router(file_api)
 
 @fastapi_server.get("/")
 async def root():
     return {"message": "Hello World"}
 
+@fastapi_server.get("/resources")
+def resource_stats():
+    """服务依赖的启动状态与按组件的启动耗时"""
+    return {**resources.stats(), "ingestion": ingestion_queue.stats(), "cpu": describe_cpu_usage(cpu_settings)}
 
+@fastapi_server.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus 文本格式的运行时指标（多worker部署时为处理该请求的worker进程的指标）"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 
-# 定义Copilot动作
-chat_action = CopilotAction(
-    name="chatWithAI",
-    description="Chat with an AI assistant using RAG (Retrieval-Augmented Generation)",
-    parameters=[
-        {
-            "name": "message",
-            "type": "string",
-            "description": "The message to send to the AI",
-            "required": True,
-        },
-        {
-            "name": "conversation_id",
-            "type": "string",
-            "description": "The ID of the conversation (optional)",
-            "required": False,
-        },
-        {
-            "name": "temperature",
-            "type": "number",
-            "description": "The temperature parameter for response generation (0.0 to 1.0)",
-            "required": False,
-        }
-    ],
-    handler=chat_with_ai
-)
 
-# 初始化CopilotKit SDK
-sdk = CopilotKitRemoteEndpoint(actions=[chat_action])
 
-# 添加CopilotKit端点
-add_fastapi_endpoint(
-    fastapi_server, 
-    sdk, 
-    "/copilotkit_remote"  # 直接使用完整路
-)
\ No newline at end of file
+def add_copilotkit_endpoint(app: FastAPI) -> None:
+    """挂载CopilotKit远程端点
+
+    copilotkit 会连带导入 LangGraph 等大量依赖，只在启用该端点时导入
+    """
+    from copilotkit.integrations.fastapi import add_fastapi_endpoint
+    from copilotkit import CopilotKitRemoteEndpoint, Action as CopilotAction
+
+    # 定义Copilot动作
+    chat_action = CopilotAction(
+        name="chatWithAI",
+        description="Chat with an AI assistant using RAG (Retrieval-Augmented Generation)",
+        parameters=[
+            {
+                "name": "message",
+                "type": "string",
+                "description": "The message to send to the AI",
+                "required": True,
+            },
+            {
+                "name": "conversation_id",
+                "type": "string",
+                "description": "The ID of the conversation (optional)",
+                "required": False,
+            },
+            {
+                "name": "temperature",
+                "type": "number",
+                "description": "The temperature parameter for response generation (0.0 to 1.0)",
+                "required": False,
+            }
+        ],
+        handler=chat_with_ai
+    )
+
+    # 初始化CopilotKit SDK
+    sdk = CopilotKitRemoteEndpoint(actions=[chat_action])
+
+    # 添加CopilotKit端点
+    add_fastapi_endpoint(
+        app, 
+        sdk, 
+        "/copilotkit_remote"  # 直接使用完整路
+    )
+
+# COPILOTKIT_ENABLED=false 时不挂载 /copilotkit_remote，也不导入 copilotkit
+if os.getenv("COPILOTKIT_ENABLED", "true").lower() != "false":
+    add_copilotkit_endpoint(fastapi_server)
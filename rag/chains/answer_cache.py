@@ -0,0 +1,196 @@
+"""语义回答缓存
+
+以查询嵌入为键缓存首轮问题的回答及其召回上下文。新问题与已缓存问题的余弦相似度
+超过阈值、且向量库版本一致时直接回放缓存结果，跳过检索与LLM生成。
+支持TTL过期、按容量的LRU淘汰以及命中率统计。
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+
+@dataclass
+class CachedAnswer:
+    """缓存条目"""
+    query: str
+    answer: str
+    rag_context: List[Dict[str, Any]]
+    index_version: int
+    embedding: np.ndarray = field(repr=False)
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+class SemanticAnswerCache:
+    """语义回答缓存
+
+    Args:
+        embed_query: 查询嵌入函数，通常为向量库的 embeddings.embed_query
+        similarity_threshold: 命中所需的最小余弦相似度
+        ttl_seconds: 条目存活时间，0 表示不过期
+        max_size: 最大条目数，超出时淘汰最久未使用的条目
+    """
+
+    def __init__(
+        self,
+        embed_query: Callable[[str], List[float]],
+        similarity_threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_size: int = 1024,
+    ):
+        self.embed_query = embed_query
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        # 嵌入矩阵按需重建，查询时一次矩阵乘法完成全部相似度计算
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hits_counter = REGISTRY.counter("answer_cache_hits_total", "语义回答缓存命中次数")
+        self._misses_counter = REGISTRY.counter("answer_cache_misses_total", "语义回答缓存未命中次数")
+        self._evictions_counter = REGISTRY.counter("answer_cache_evictions_total", "语义回答缓存淘汰条目数")
+        self._size_gauge = REGISTRY.gauge("answer_cache_entries", "语义回答缓存当前条目数")
+
+    def _record_hit(self) -> None:
+        self.hits += 1
+        self._hits_counter.inc()
+
+    def _record_miss(self) -> None:
+        self.misses += 1
+        self._misses_counter.inc()
+
+    def _record_evictions(self, count: int) -> None:
+        self.evictions += count
+        self._evictions_counter.inc(count)
+        self._size_gauge.set(len(self._entries))
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed(self, query: str) -> np.ndarray:
+        """计算归一化的查询嵌入"""
+        return self._normalize(self.embed_query(query))
+
+    async def aembed(self, query: str) -> np.ndarray:
+        """在线程中计算查询嵌入，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.embed, query)
+
+    async def aembed_raw(self, query: str) -> Tuple[List[float], np.ndarray]:
+        """在线程中计算查询嵌入，同时返回原始嵌入与归一化嵌入
+
+        embed_query 与向量库使用同一嵌入模型时，原始嵌入可直接用于检索，问题只需嵌入一次
+        """
+        raw = await asyncio.to_thread(self.embed_query, query)
+        return raw, self._normalize(raw)
+
+    def _expired(self, entry: CachedAnswer, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - entry.created_at > self.ttl_seconds
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._record_evictions(len(expired))
+            self._matrix = None
+
+    def _ensure_matrix(self) -> None:
+        if self._matrix is None:
+            self._matrix_ids = list(self._entries.keys())
+            if self._matrix_ids:
+                self._matrix = np.stack([self._entries[key].embedding for key in self._matrix_ids])
+            else:
+                self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def lookup(self, embedding: np.ndarray, index_version: int = 0) -> Optional[CachedAnswer]:
+        """查找语义相近且向量库版本一致的缓存回答
+
+        Args:
+            embedding: 归一化的查询嵌入
+            index_version: 当前向量库版本
+        """
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            self._ensure_matrix()
+            if not self._matrix_ids:
+                self._record_miss()
+                return None
+
+            similarities = self._matrix @ embedding
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.similarity_threshold:
+                    break
+                key = self._matrix_ids[position]
+                entry = self._entries[key]
+                if entry.index_version != index_version:
+                    continue
+                entry.hits += 1
+                self._entries.move_to_end(key)
+                self._record_hit()
+                return entry
+
+            self._record_miss()
+            return None
+
+    def store(
+        self,
+        query: str,
+        embedding: np.ndarray,
+        answer: str,
+        rag_context: List[Dict[str, Any]],
+        index_version: int = 0,
+    ) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if not answer:
+            return
+        with self._lock:
+            self._entries[self._next_id] = CachedAnswer(
+                query=query,
+                answer=answer,
+                rag_context=rag_context,
+                index_version=index_version,
+                embedding=embedding,
+            )
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._record_evictions(1)
+            self._matrix = None
+            self._size_gauge.set(len(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._size_gauge.set(0)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计信息"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "similarity_threshold": self.similarity_threshold,
+            "ttl_seconds": self.ttl_seconds,
+        }
@@ -0,0 +1,79 @@
+"""客户端断开时取消生成
+
+DisconnectWatcher 在后台轮询客户端连接状态，检测到断开后取消正在执行生成的任务：
+正在等待的LLM流式读取或向量检索立即抛出 CancelledError，LLM的HTTP流随生成器关闭而断开，
+不再继续生成到 max_tokens。取消的生成数与回收的token数记录到运行时指标。
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_canceled_generations = REGISTRY.counter("llm_canceled_generations_total", "因客户端断开而取消的生成数")
+_tokens_before_cancel = REGISTRY.counter("llm_tokens_before_cancel_total", "取消前已生成的token数")
+_canceled_tokens = REGISTRY.counter(
+    "llm_canceled_tokens_total", "取消后不再生成的token数（按 max_tokens 上限估算的回收容量）"
+)
+
+
+def record_cancellation(tokens_generated: int, max_tokens: Optional[int] = None) -> None:
+    """记录一次被取消的生成
+
+    Args:
+        tokens_generated: 取消前已生成的token数（按流式片段计）
+        max_tokens: 本次生成的token上限，用于估算回收的token数
+    """
+    _canceled_generations.inc()
+    _tokens_before_cancel.inc(tokens_generated)
+    if max_tokens:
+        _canceled_tokens.inc(max(0, max_tokens - tokens_generated))
+
+
+def cancellation_stats() -> dict:
+    return {
+        "canceled_generations": _canceled_generations.value,
+        "tokens_before_cancel": _tokens_before_cancel.value,
+        "canceled_tokens": _canceled_tokens.value,
+    }
+
+
+class DisconnectWatcher:
+    """检测客户端断开并取消当前任务的异步上下文管理器
+
+    断开导致的取消在退出时被吸收，生成器正常结束；其他来源的取消照常向外传播。
+
+    Args:
+        is_disconnected: 返回客户端是否已断开的协程函数，如 starlette Request.is_disconnected
+        poll_interval: 轮询间隔（秒）
+    """
+
+    def __init__(self, is_disconnected: Callable[[], Awaitable[bool]], poll_interval: float = 0.5):
+        self.is_disconnected = is_disconnected
+        self.poll_interval = poll_interval
+        self.disconnected = False
+        self._task: Optional[asyncio.Task] = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if await self.is_disconnected():
+                self.disconnected = True
+                self._task.cancel()
+                return
+
+    async def __aenter__(self) -> "DisconnectWatcher":
+        self._task = asyncio.current_task()
+        self._watcher = asyncio.create_task(self._watch())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        self._watcher.cancel()
+        if self.disconnected and exc_type is asyncio.CancelledError:
+            self._task.uncancel()
+            logger.info("客户端已断开，已取消生成")
+            return True
+        return False
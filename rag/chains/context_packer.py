@@ -0,0 +1,310 @@
+"""按token预算打包RAG上下文
+
+将召回文档、历史对话和指令装入可配置的token预算：
+1. 去除相邻文档块之间重叠（chunk_overlap）造成的重复句子
+2. 将每个文档块裁剪为命中查询词的句子及其前后若干句
+3. 历史对话从最近一轮开始保留，超出预算的旧消息被丢弃
+并统计每次请求节省的token数。
+"""
+import functools
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# 句子边界：中文标点、英文句末标点后接空白、换行
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[。！？；!?])|(?<=\.)(?=\s)|\n+")
+WORD_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_\-\.]+")
+CJK_PATTERN = re.compile(r"[一-鿿]+")
+STOPWORDS = {
+    "the", "and", "for", "with", "what", "which", "who", "how", "why", "when", "where",
+    "are", "was", "were", "is", "does", "did", "this", "that", "about", "from", "into",
+    "什么", "哪些", "如何", "怎么", "为什么", "是否", "有没", "没有", "一下", "请问",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def load_tokenizer(tokenizer: str) -> Optional[Tuple[Callable, Callable]]:
+    """加载分词器并按名称缓存，返回 (encode, decode)，不可用时返回 None
+
+    Args:
+        tokenizer: tiktoken编码名称或本地分词器目录
+    """
+    if os.path.isdir(tokenizer):
+        try:
+            from transformers import AutoTokenizer
+
+            hf_tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+            return (lambda text: hf_tokenizer.encode(text, add_special_tokens=False)), hf_tokenizer.decode
+        except Exception as e:
+            logger.warning("加载分词器 %s 失败，使用估算: %s", tokenizer, e)
+            return None
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(tokenizer)
+        return encoding.encode, encoding.decode
+    except Exception as e:
+        logger.warning("加载tiktoken编码 %s 失败，使用估算: %s", tokenizer, e)
+        return None
+
+
+class TokenCounter:
+    """token计数器
+
+    优先使用 tiktoken 编码；也可以传入本地HuggingFace分词器目录；
+    两者都不可用时退化为按字符估算（中文每字1个token，其他文本约4个字符1个token）。
+    分词器在首次计数时加载（tiktoken 可能需要下载编码文件），可在服务启动阶段调用 load 预热。
+
+    Args:
+        tokenizer: tiktoken编码名称或本地分词器目录
+    """
+
+    def __init__(self, tokenizer: str = "cl100k_base"):
+        self.tokenizer = tokenizer
+        self._name = "estimate"
+        self._encode = None
+        self._decode = None
+        self._loaded = False
+
+    def load(self) -> "TokenCounter":
+        """加载分词器（只加载一次）"""
+        if not self._loaded:
+            codec = load_tokenizer(self.tokenizer)
+            if codec is not None:
+                self._encode, self._decode = codec
+                self._name = self.tokenizer
+            self._loaded = True
+        return self
+
+    @property
+    def name(self) -> str:
+        return self.load()._name
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        self.load()
+        if self._encode is not None:
+            return len(self._encode(text))
+        cjk_chars = sum(len(run) for run in CJK_PATTERN.findall(text))
+        return cjk_chars + math.ceil((len(text) - cjk_chars) / 4)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断文本使其不超过 max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        self.load()
+        if self._encode is not None:
+            return self._decode(self._encode(text)[:max_tokens])
+        # 估算模式下二分查找截断位置
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
+
+
+@dataclass
+class PackedContext:
+    """打包结果"""
+    rag_context: str
+    chat_history: str
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中英文句子边界切分文本"""
+    return [s.strip() for s in SENTENCE_SPLIT_PATTERN.split(text) if s and s.strip()]
+
+
+def extract_query_terms(query: str) -> List[str]:
+    """提取查询词：英文词（去除停用词）与中文双字词"""
+    terms = [w.lower().strip(".") for w in WORD_PATTERN.findall(query)]
+    terms = [t for t in terms if len(t) > 1 and t not in STOPWORDS]
+    for run in CJK_PATTERN.findall(query):
+        if len(run) == 1:
+            continue
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1) if run[i:i + 2] not in STOPWORDS)
+    return list(dict.fromkeys(terms))
+
+
+def format_chat_history(messages: Sequence[BaseMessage]) -> str:
+    """将消息列表格式化为文本"""
+    lines = []
+    for message in messages:
+        role = "人类" if message.type == "human" else "AI"
+        lines.append(f"{role}: {message.content}")
+    return "\n".join(lines)
+
+
+class ContextPacker:
+    """上下文打包器
+
+    Args:
+        max_tokens: 提示词总token预算（指令、问题、历史对话与召回内容之和）
+        history_ratio: 历史对话最多占用的剩余预算比例
+        sentence_window: 命中查询词的句子前后各保留的句子数
+        min_doc_tokens: 单个文档剩余预算低于该值时不再加入
+        min_dedup_chars: 参与去重的最短句子长度，避免误删过短的常见句子
+        token_counter: token计数器
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4096,
+        history_ratio: float = 0.3,
+        sentence_window: int = 1,
+        min_doc_tokens: int = 32,
+        min_dedup_chars: int = 8,
+        token_counter: Optional[TokenCounter] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.history_ratio = history_ratio
+        self.sentence_window = sentence_window
+        self.min_doc_tokens = min_doc_tokens
+        self.min_dedup_chars = min_dedup_chars
+        self.token_counter = token_counter or TokenCounter()
+
+        self._tokens_saved = REGISTRY.counter("context_tokens_saved_total", "上下文打包节省的token总数")
+        self._prompt_tokens = REGISTRY.histogram(
+            "context_prompt_tokens", "打包后的提示词token数",
+            buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+        )
+
+    def _select_sentences(self, sentences: List[str], terms: List[str]) -> List[str]:
+        """保留命中查询词的句子及其前后窗口；没有命中时保留全部，由预算截断"""
+        if not terms:
+            return sentences
+        lowered = [s.lower() for s in sentences]
+        hits = [i for i, sentence in enumerate(lowered) if any(term in sentence for term in terms)]
+        if not hits:
+            return sentences
+        keep = set()
+        for i in hits:
+            keep.update(range(max(0, i - self.sentence_window), min(len(sentences), i + self.sentence_window + 1)))
+        return [sentences[i] for i in sorted(keep)]
+
+    def _pack_history(self, messages: Sequence[BaseMessage], budget: int) -> str:
+        """从最近的消息开始保留历史对话"""
+        kept = []
+        used = 0
+        for message in reversed(messages):
+            line = format_chat_history([message])
+            tokens = self.token_counter.count(line) + 1
+            if used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        return format_chat_history(list(reversed(kept)))
+
+    def pack(
+        self,
+        query: str,
+        docs: List[Document],
+        history: Sequence[BaseMessage] = (),
+        instructions: str = "",
+    ) -> PackedContext:
+        """按预算打包召回文档与历史对话
+
+        Args:
+            query: 用户问题
+            docs: 召回文档（按相关性排序）
+            history: 历史对话消息
+            instructions: 提示词模板中的固定指令部分
+
+        Returns:
+            PackedContext: 打包后的召回内容、历史对话与统计信息
+        """
+        count = self.token_counter.count
+        fixed_tokens = count(instructions) + count(query)
+        remaining = max(0, self.max_tokens - fixed_tokens)
+
+        full_history = format_chat_history(history)
+        history_tokens_before = count(full_history)
+        context_tokens_before = sum(count(doc.page_content) for doc in docs)
+
+        # 先为历史对话预留上限，召回内容用掉剩余预算后，未用完的部分再还给历史对话
+        history_cap = min(history_tokens_before, int(remaining * self.history_ratio))
+        doc_budget = remaining - history_cap
+
+        terms = extract_query_terms(query)
+        seen_text: Dict[str, str] = {}
+        duplicates_removed = 0
+        parts = []
+        used = 0
+        for i, doc in enumerate(docs, 1):
+            source = doc.metadata.get("source", "未知来源")
+            kept_text = seen_text.get(source, "")
+            sentences = []
+            for sentence in split_sentences(doc.page_content):
+                # 同一来源相邻块的重叠部分会以完整或半截句子的形式重复出现
+                if len(sentence) >= self.min_dedup_chars and (
+                        sentence in kept_text or any(sentence in other for other in sentences)):
+                    duplicates_removed += 1
+                    continue
+                sentences.append(sentence)
+            seen_text[source] = kept_text + "\n" + "\n".join(sentences)
+
+            selected = self._select_sentences(sentences, terms)
+            if not selected:
+                continue
+            header = f"[文档{i}] 来源: {source}\n内容: "
+            body = " ".join(selected)
+            available = doc_budget - used - count(header)
+            if available < self.min_doc_tokens:
+                break
+            body = self.token_counter.truncate(body, available)
+            part = header + body
+            parts.append(part)
+            used += count(part)
+
+        if parts:
+            rag_context = "以下是相关文档信息：\n\n" + "\n\n".join(parts)
+        else:
+            rag_context = "没有找到相关文档。"
+
+        history_budget = history_cap + max(0, doc_budget - used)
+        if history_tokens_before <= history_budget:
+            chat_history = full_history
+        else:
+            chat_history = self._pack_history(history, history_budget)
+
+        history_tokens_after = count(chat_history)
+        context_tokens_after = count(rag_context)
+        tokens_saved = max(0, (history_tokens_before + context_tokens_before)
+                           - (history_tokens_after + context_tokens_after))
+        prompt_tokens = fixed_tokens + history_tokens_after + context_tokens_after
+
+        self._tokens_saved.inc(tokens_saved)
+        self._prompt_tokens.observe(prompt_tokens)
+
+        return PackedContext(
+            rag_context=rag_context,
+            chat_history=chat_history,
+            stats={
+                "tokenizer": self.token_counter.name,
+                "budget": self.max_tokens,
+                "prompt_tokens": prompt_tokens,
+                "history_tokens_before": history_tokens_before,
+                "history_tokens_after": history_tokens_after,
+                "context_tokens_before": context_tokens_before,
+                "context_tokens_after": context_tokens_after,
+                "duplicates_removed": duplicates_removed,
+                "tokens_saved": tokens_saved,
+            }
+        )
@@ -1,57 +1,50 @@
-from langchain.memory import ConversationBufferMemory
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
-from langchain.callbacks.base import BaseCallbackHandler
-from langchain.chains import LLMChain
-from langchain_core.prompts import ChatPromptTemplate
-from typing import Dict, Any, AsyncGenerator, List, Optional, Callable
+from typing import TYPE_CHECKING, Dict, Any, AsyncGenerator, Awaitable, List, Optional, Callable, Tuple
+from contextlib import aclosing
 from rag.vector.vector_database import VectorDatabase
+from rag.chains.answer_cache import SemanticAnswerCache, CachedAnswer
+from rag.chains.context_packer import ContextPacker, format_chat_history
+from rag.chains.llm_pool import LLMClientPool, get_llm_pool
+from rag.chains.title_generator import TitleGenerator
+from rag.chains.conversation_store import ConversationStore, SUMMARY_PROMPT_TEMPLATE
+from rag.chains.cancellation import DisconnectWatcher, record_cancellation
+from rag.chains.sse import StreamEvent, encode_event
+from rag.monitoring.runtime_metrics import REGISTRY
+from rag.monitoring.request_timing import record_count, record_stage, stage
 from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
 import os
 import json
 import asyncio
-import uuid
-from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
 
-class StreamingCallbackHandler(BaseCallbackHandler):
-    """自定义流式回调处理器，用于捕获和处理LLM生成的内容"""
-    
-    def __init__(self, stream_func: Callable[[str], None]):
-        """初始化回调处理器
-        
-        Args:
-            stream_func: 用于处理每个token的回调函数
-        """
-        super().__init__()
-        self.stream_func = stream_func
-        self.tokens = []
-        self.current_response = ""
-        
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
-        """处理LLM生成的新token
-        
-        Args:
-            token: 生成的token
-            **kwargs: 其他参数
-        """
-        self.tokens.append(token)
-        self.current_response += token
-        # 使用JSON格式化token
-        try:
-            token_json = json.dumps({"type": "conversation", "data": token})
-            self.stream_func(token_json)
-        except:
-            self.stream_func(token)
-    
-    def on_llm_error(self, error, **kwargs) -> None:
-        """LLM生成错误时的回调
-        
-        Args:
-            error: 错误信息
-            **kwargs: 其他参数
+if TYPE_CHECKING:
+    from langchain.memory import ConversationBufferMemory
+
+logger = logging.getLogger(__name__)
+
+_retrieval_timeouts = REGISTRY.counter("rag_retrieval_timeouts_total", "检索超时、以空上下文继续生成的次数")
+_generated_tokens = REGISTRY.counter("llm_generated_tokens_total", "LLM流式生成的token数（按流式片段计）")
+_in_flight_generations = REGISTRY.gauge("llm_in_flight_generations", "进行中的LLM流式生成数")
+_batch_prompts = REGISTRY.counter("chat_batch_prompts_total", "批量问答处理的问题数")
+
+CONVERSATION_PROMPT_TEMPLATE = """
+            你是一个专业的AI助手。请根据历史对话和检索到的信息回答用户问题。
+            
+            遵循以下原则：
+            1. 如果检索内容中包含问题的答案，请基于这些内容回答
+            2. 对于引用的内容，请明确指出信息来源
+            3. 如果检索内容不足以回答问题，可以使用你的知识补充，但请明确区分
+            4. 保持响应友好、专业、有帮助
+            
+            历史对话:
+            {chat_history}
+                                                               
+            检索召回内容:
+            {rag_context}
+
+            人类: {question}
         """
-        error_json = json.dumps({"error": f"生成过程中出错: {str(error)}"})
-        self.stream_func(error_json)
 
 class StreamingConversationChain:
     """使用Chain实现流式会话，替代Agent实现"""
@@ -66,7 +59,15 @@ class StreamingConversationChain:
         verbose: bool = False,
         use_rag: bool = False,
         vector_database: Optional[VectorDatabase] = None,
-        use_ollama: bool = False
+        use_ollama: bool = False,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        context_packer: Optional[ContextPacker] = None,
+        llm_pool: Optional[LLMClientPool] = None,
+        title_mode: str = "llm",
+        title_topic_overlap: float = 0.0,
+        conversation_store: Optional[ConversationStore] = None,
+        retrieval_timeout: Optional[float] = None,
+        batch_retrieval_timeout: Optional[float] = None
     ):
         """初始化流式会话链
         
@@ -76,42 +77,110 @@ class StreamingConversationChain:
             api_key: API密钥
             temperature: 温度参数
             max_tokens: 最大token数
-            verbose: 是否显示详细日志
+            verbose: 已废弃，不再生效，保留以兼容旧的调用方式；日志通过 logging 配置
             use_rag: 是否使用RAG
             vector_database: 向量数据库
             use_ollama: 是否使用ollama
+            answer_cache: 可选的语义回答缓存，仅对会话首轮问题生效
+            context_packer: 可选的上下文打包器，按token预算装入召回内容与历史对话
+            llm_pool: LLM客户端池，默认使用全局共享的客户端池
+            title_mode: 会话标题生成方式，llm 为调用LLM生成，heuristic 为本地关键词提取
+            title_topic_overlap: 新问题与标题关键词重叠比例低于该值时视为话题切换并重新生成标题，0 表示不重新生成
+            conversation_store: 会话存储，默认为完整保留历史的有界内存存储
+            retrieval_timeout: 检索的最长等待时间（秒），超时后以空上下文继续生成，None 或 0 表示不限
+            batch_retrieval_timeout: 批量问答每批检索的最长等待时间（秒），None 或 0 时按每批问题数放大 retrieval_timeout
         """
         self.model_name = model_name
         self.api_base = api_base 
         self.api_key = api_key 
         self.temperature = temperature
         self.max_tokens = max_tokens
-        self.verbose = verbose
         
-        # 会话存储
-        self.conversations = {}
+        # 会话存储，summary 模式未指定摘要函数时使用本会话链的LLM生成摘要
+        self.conversation_store = conversation_store or ConversationStore()
+        if self.conversation_store.summarizer is None:
+            self.conversation_store.summarizer = self._summarize
         self.is_use_rag = use_rag
         self.vector_database = vector_database
         self.use_ollama = use_ollama
+        self.retrieval_timeout = retrieval_timeout or None
+        self.batch_retrieval_timeout = batch_retrieval_timeout or None
+        self.answer_cache = answer_cache
+        self.context_packer = context_packer
+        self.llm_pool = llm_pool or get_llm_pool()
+        self.title_generator = TitleGenerator(
+            mode=title_mode,
+            llm_factory=lambda: self._create_llm(streaming=False, temperature=0.3, max_tokens=50),
+            topic_overlap_threshold=title_topic_overlap
+        )
+        self.conversation_store.add_evict_listener(self.title_generator.discard)
     
-    def _query_vector_database(self, query: str) -> List[Document]:
-        """使用向量数据库查询
+    async def _query_vector_database(self, query: str, embedding: Optional[List[float]] = None) -> List[Document]:
+        """使用向量数据库查询，嵌入与检索在线程池中执行，不阻塞事件循环
+        
+        超过 retrieval_timeout 时返回空列表，生成以空上下文继续；
+        已提交到线程池的检索无法中断，会在后台执行完后被丢弃
         
         Args:
             query: 查询文本
+            embedding: 已计算的查询嵌入（语义缓存查询时计算），传入时跳过嵌入
             
         Returns:
             List[Document]: 召回的文档列表
         """
         if not self.is_use_rag or not self.vector_database:
             return []
-            
-        print(f"使用向量数据库查询: {query}")
-        recall_docs = self.vector_database.query_vector_database(query)
-        print(f"向量数据库召回文档数: {len(recall_docs)}")
+        
+        try:
+            with stage("retrieval"):
+                if embedding is not None:
+                    search = self.vector_database.aquery_vector_database_by_vector(embedding)
+                else:
+                    search = self.vector_database.aquery_vector_database(query)
+                recall_docs = await asyncio.wait_for(search, self.retrieval_timeout)
+        except TimeoutError:
+            _retrieval_timeouts.inc()
+            logger.warning("向量检索超过 %.2f 秒，以空上下文继续生成", self.retrieval_timeout)
+            return []
+        logger.debug("向量数据库召回文档数: %d", len(recall_docs))
         return recall_docs
     
-    def _get_memory(self, conversation_id: str) -> ConversationBufferMemory:
+    def _batch_timeout(self, size: int) -> Optional[float]:
+        """一批检索的最长等待时间，未单独配置时按问题数放大单次检索的超时"""
+        if self.batch_retrieval_timeout:
+            return self.batch_retrieval_timeout
+        return self.retrieval_timeout * size if self.retrieval_timeout else None
+    
+    async def _query_vector_database_batch(self, queries: List[str]) -> Tuple[List[List[Document]], Optional[str]]:
+        """批量检索，一次嵌入全部问题并一次完成FAISS检索
+        
+        超时或出错时该批问题都以空上下文继续生成
+        
+        Args:
+            queries: 查询文本列表
+            
+        Returns:
+            tuple: (每个问题召回的文档列表, 检索失败原因，成功时为 None)
+        """
+        if not self.is_use_rag or not self.vector_database:
+            return [[] for _ in queries], None
+        
+        timeout = self._batch_timeout(len(queries))
+        try:
+            with stage("retrieval"):
+                return await asyncio.wait_for(
+                    self.vector_database.aquery_vector_database_batch(queries), timeout
+                ), None
+        except TimeoutError:
+            _retrieval_timeouts.inc()
+            logger.warning("批量检索 %d 个问题超过 %.2f 秒，以空上下文继续生成", len(queries), timeout)
+            error = f"检索超过 {timeout:.2f} 秒，以空上下文生成"
+        except Exception as e:
+            logger.warning("批量检索 %d 个问题失败，以空上下文继续生成: %s", len(queries), e)
+            error = f"检索失败，以空上下文生成: {str(e)}"
+        return [[] for _ in queries], error
+    
+    def _get_memory(self, conversation_id: str) -> "ConversationBufferMemory":
         """获取或创建会话记忆
         
         Args:
@@ -120,86 +189,120 @@ class StreamingConversationChain:
         Returns:
             ConversationBufferMemory: 会话记忆
         """
-        if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                input_key="question",
-                output_key="output"
-            )
-        return self.conversations[conversation_id]
+        return self.conversation_store.get_or_create(conversation_id).memory
+    
+    async def _is_first_turn(self, conversation_id: str) -> bool:
+        """判断会话是否还没有任何历史消息"""
+        state = await self.conversation_store.aget(conversation_id)
+        return state is None or (not state.messages and not state.summary)
+    
+    async def _save_turn(self, conversation_id: str, user_query: str, answer: str) -> None:
+        """写入一轮对话，summary 模式下在后台折叠旧消息"""
+        await self.conversation_store.asave_turn(conversation_id, user_query, answer)
+        self.conversation_store.schedule_compaction(conversation_id)
+    
+    async def _summarize(self, summary: str, conversation: str) -> str:
+        """使用非流式LLM合并滚动摘要"""
+        llm = self._create_llm(streaming=False, temperature=0.3, max_tokens=512)
+        response = await llm.ainvoke(SUMMARY_PROMPT_TEMPLATE.format(summary=summary or "无", conversation=conversation))
+        return response.content
     
-    def _create_llm(self, callback_handler):
-        """创建LLM实例
+    def _shares_cache_embedding(self) -> bool:
+        """语义缓存与向量库是否使用同一嵌入函数，是则缓存查询计算的嵌入可直接用于检索"""
+        embeddings = getattr(self.vector_database, "embeddings", None)
+        return embeddings is not None and self.answer_cache.embed_query == embeddings.embed_query
+    
+    def _index_version(self) -> int:
+        """当前向量库版本，用于校验缓存回答是否过期"""
+        return getattr(self.vector_database, "index_version", 0)
+    
+    async def _replay_cached_answer(
+        self, cached: CachedAnswer, user_query: str, conversation_id: str, chunk_size: int = 16
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """以流的形式回放缓存的回答，并写入会话记忆
         
         Args:
-            callback_handler: 回调处理器
+            cached: 缓存条目
+            user_query: 用户问题
+            conversation_id: 会话ID
+            chunk_size: 每个片段的字符数
+        """
+        yield "rag_context", cached.rag_context
+        answer = cached.answer
+        for start in range(0, len(answer), chunk_size):
+            yield "token", answer[start:start + chunk_size]
+        await self._save_turn(conversation_id, user_query, answer)
+    
+    def _create_llm(self, streaming: bool = True, temperature: Optional[float] = None, max_tokens: Optional[int] = None):
+        """从客户端池获取LLM实例
+        
+        Args:
+            streaming: 是否流式输出
+            temperature: 温度参数，默认使用会话链配置
+            max_tokens: 最大token数，默认使用会话链配置
             
         Returns:
             ChatOpenAI or ChatOllama: LLM实例
         """
-        if self.use_ollama:
-            return ChatOllama(
-                model=self.model_name,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                streaming=True,
-                callbacks=[callback_handler]
-            )
-        else:
-            return ChatOpenAI(
-                model=self.model_name,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                streaming=True,
-                callbacks=[callback_handler],
-                openai_api_base=self.api_base,
-                openai_api_key=self.api_key
-            )
+        return self.llm_pool.get_llm(
+            provider="ollama" if self.use_ollama else "openai",
+            model=self.model_name,
+            api_base=self.api_base,
+            api_key=self.api_key,
+            temperature=self.temperature if temperature is None else temperature,
+            max_tokens=self.max_tokens if max_tokens is None else max_tokens,
+            streaming=streaming
+        )
     
-    def _create_chain(self, conversation_id: str, callback_handler):
-        """创建对话链
+    def _create_chain(self, streaming: bool = True):
+        """获取预构建的对话链
+        
+        会话记忆不挂在链上，历史对话由 astream 按token预算打包后传入，生成结束后再写回记忆
         
         Args:
-            conversation_id: 会话ID
-            callback_handler: 回调处理器
+            streaming: 是否流式输出，批量问答使用非流式链
             
         Returns:
-            LLMChain: 对话链实例
+            Runnable: 提示模板与LLM组成的对话链，支持原生异步流式输出
         """
-        # 创建LLM实例
-        llm = self._create_llm(callback_handler)
+        return self.llm_pool.get_chain(
+            CONVERSATION_PROMPT_TEMPLATE,
+            provider="ollama" if self.use_ollama else "openai",
+            model=self.model_name,
+            api_base=self.api_base,
+            api_key=self.api_key,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            streaming=streaming
+        )
+    
+    def _build_context(self, user_query: str, rag_docs: List[Document], history: List[BaseMessage]) -> tuple:
+        """构建检索召回内容与历史对话
         
-        # 获取会话记忆
-        memory = self._get_memory(conversation_id)
+        配置了上下文打包器时按token预算打包，否则完整拼接
         
-        # 创建对话提示模板
-        prompt = ChatPromptTemplate.from_template("""
-            你是一个专业的AI助手。请根据历史对话和检索到的信息回答用户问题。
-            
-            遵循以下原则：
-            1. 如果检索内容中包含问题的答案，请基于这些内容回答
-            2. 对于引用的内容，请明确指出信息来源
-            3. 如果检索内容不足以回答问题，可以使用你的知识补充，但请明确区分
-            4. 保持响应友好、专业、有帮助
+        Args:
+            user_query: 用户问题
+            rag_docs: 召回文档
+            history: 按记忆模式读取的历史对话，批量问答时为空
             
-            历史对话:
-            {chat_history}
-                                                               
-            检索召回内容:
-            {rag_context}
-
-            人类: {question}
-        """)
-        
-        # 创建LLMChain
-        return LLMChain(
-            llm=llm,
-            prompt=prompt,
-            verbose=self.verbose,
-            memory=memory,
-            output_key="output"
-        )
+        Returns:
+            tuple: (检索召回内容, 历史对话)
+        """
+        if self.context_packer is not None:
+            packed = self.context_packer.pack(user_query, rag_docs, history, CONVERSATION_PROMPT_TEMPLATE)
+            logger.debug("上下文打包: 提示词 %d tokens，节省 %d tokens",
+                         packed.stats["prompt_tokens"], packed.stats["tokens_saved"])
+            return packed.rag_context, packed.chat_history
+        
+        if rag_docs:
+            rag_context = "以下是相关文档信息：\n\n"
+            for i, doc in enumerate(rag_docs, 1):
+                source = doc.metadata.get('source', '未知来源')
+                rag_context += f"[文档{i}] 来源: {source}\n内容: {doc.page_content}\n\n"
+        else:
+            rag_context = "没有找到相关文档。"
+        return rag_context, format_chat_history(history)
     
     def _parse_user_input(self, message: str) -> str:
         """解析用户输入，提取实际问题
@@ -231,69 +334,41 @@ class StreamingConversationChain:
         
         return message
     
-    async def get_title_from_conversation(self, conversation_id: str) -> str:
-        """从会话中生成标题
+    def schedule_title(self, conversation_id: str, message: str) -> Optional[asyncio.Task]:
+        """需要时在后台生成会话标题（新会话或话题切换），不阻塞回答生成
         
         Args:
             conversation_id: 会话ID
+            message: 用户消息
             
         Returns:
-            str: 生成的会话标题
+            Optional[asyncio.Task]: 标题生成任务，沿用已缓存标题时返回 None
         """
-        # 获取会话历史
-        if conversation_id not in self.conversations:
-            return conversation_id
-            
-        memory = self.conversations[conversation_id]
-        chat_history = memory.buffer
-        
-        if not chat_history:
-            return conversation_id
-            
-        # 创建LLM实例（非流式）
-        if self.use_ollama:
-            llm = ChatOllama(
-                model=self.model_name,
-                temperature=0.3,
-                max_tokens=50
+        task = self.title_generator.schedule(conversation_id, self._parse_user_input(message))
+        if task is not None:
+            # 标题随会话一起保存，会话落盘或由其他worker处理时仍可恢复；后端写入在线程池中执行
+            task.add_done_callback(
+                lambda t: asyncio.get_running_loop().run_in_executor(
+                    None, self.conversation_store.set_title, conversation_id, t.result()
+                )
+                if not t.cancelled() and t.exception() is None else None
             )
-        else:
-            llm = ChatOpenAI(
-                model=self.model_name,
-                temperature=0.3,
-                max_tokens=50,
-                openai_api_base=self.api_base,
-                openai_api_key=self.api_key
-            )
-            
-        # 创建提示词
-        prompt = ChatPromptTemplate.from_template("""
-        根据以下对话历史，生成一个简短的会话标题（不超过10个字）。标题应该概括对话的主要内容。
-        请直接返回标题文本，不要包含任何其他内容。
-        
-        对话历史:
-        {chat_history}
-        
-        标题:
-        """)
+        return task
+    
+    async def get_title_from_conversation(self, conversation_id: str) -> str:
+        """获取会话标题
         
-        try:
-            # 调用LLM生成标题
-            response = llm.invoke(prompt.format(chat_history=chat_history))
-            title = response.content.strip()
+        Args:
+            conversation_id: 会话ID
             
-            # 尝试解析JSON格式（如果返回的是JSON）
-            try:
-                title_data = json.loads(title)
-                if isinstance(title_data, dict) and "title" in title_data:
-                    return title_data["title"]
-            except:
-                pass
-                
-            return title if title else conversation_id
-        except Exception as e:
-            print(f"生成标题时出错: {str(e)}")
-            return conversation_id
+        Returns:
+            str: 缓存的会话标题，尚未生成时返回会话ID
+        """
+        title = self.title_generator.get(conversation_id)
+        if title is None:
+            state = await self.conversation_store.aget(conversation_id)
+            title = state.title if state is not None else None
+        return title or conversation_id
     
     async def get_or_create_conversation(self, conversation_id: str) -> str:
         """获取或创建会话
@@ -301,101 +376,244 @@ class StreamingConversationChain:
         Args:
             conversation_id: 会话ID
         """
-        if conversation_id not in self.conversations:
-            new_conversation_id = str(uuid.uuid4())
-            self.conversations[new_conversation_id] = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                input_key="question",
-                output_key="output"
-            )
-            return new_conversation_id
+        state = await self.conversation_store.aget(conversation_id)
+        if state is None:
+            return (await self.conversation_store.acreate()).conversation_id
+        # 从磁盘恢复的会话沿用已保存的标题
+        if state.title and self.title_generator.get(conversation_id) is None:
+            self.title_generator.set(conversation_id, state.title)
         return conversation_id
     
 
-    async def astream(self, message: str, conversation_id: str = None) -> AsyncGenerator[str, None]:
+    async def astream(
+        self,
+        message: str,
+        conversation_id: str = None,
+        callbacks: Optional[list] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> AsyncGenerator[str, None]:
         """异步流式生成响应
         
         Args:
             message: 用户消息
             conversation_id: 会话ID
+            callbacks: 本次请求的回调处理器，通过运行时config传给共享的对话链
+            is_disconnected: 返回客户端是否已断开的协程函数，断开后立即取消检索与LLM生成
             
         Yields:
             str: JSON格式的响应片段
         """
+        async for kind, payload in self.astream_events(message, conversation_id, callbacks, is_disconnected):
+            yield encode_event(kind, payload)
+    
+    async def astream_events(
+        self,
+        message: str,
+        conversation_id: str = None,
+        callbacks: Optional[list] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """异步流式生成未编码的事件，供SSE写出端合并token后再统一编码
+        
+        Args:
+            message: 用户消息
+            conversation_id: 会话ID
+            callbacks: 本次请求的回调处理器
+            is_disconnected: 返回客户端是否已断开的协程函数
+            
+        Yields:
+            StreamEvent: (rag_context, 召回列表) / (token, 文本) / (error, 错误信息)
+        """
+        if is_disconnected is None:
+            async for event in self._astream(message, conversation_id, callbacks):
+                yield event
+            return
+        
+        async with DisconnectWatcher(is_disconnected):
+            async with aclosing(self._astream(message, conversation_id, callbacks)) as stream:
+                async for event in stream:
+                    yield event
+    
+    async def _astream(
+        self, message: str, conversation_id: str, callbacks: Optional[list]
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """流式生成响应的实现，被取消时记录已生成与回收的token数"""
         # 解析用户输入
         user_query = self._parse_user_input(message)
         
-        # 创建异步生成器
-        async def token_generator():
-            queue = []
+        retrieval = None
+        cached = None
+        try:
+            # 语义缓存仅用于会话首轮问题，后续轮次的回答依赖历史对话
+            cache_embedding = None
+            query_embedding = None
+            index_version = self._index_version()
+            if self.answer_cache is not None and await self._is_first_turn(conversation_id):
+                # 先查缓存，命中时不再检索；缓存与向量库共用嵌入模型时检索复用这次计算的嵌入
+                with stage("cache_lookup"):
+                    query_embedding, cache_embedding = await self.answer_cache.aembed_raw(user_query)
+                    cached = self.answer_cache.lookup(cache_embedding, index_version)
+                if not self._shares_cache_embedding():
+                    query_embedding = None
             
-            # 定义token处理函数
-            def handle_token(token):
-                queue.append(token)
+            if cached is None:
+                # 检索在后台进行，与LLM客户端获取并行
+                retrieval = asyncio.create_task(self._query_vector_database(user_query, query_embedding))
+                # 创建对话链
+                chain = self._create_chain()
+                # 等待检索结果，等待期间可被取消
+                rag_docs = await retrieval
+        except asyncio.CancelledError:
+            record_cancellation(0, self.max_tokens)
+            raise
+        finally:
+            if retrieval is not None and not retrieval.done():
+                retrieval.cancel()
+        
+        if cached is not None:
+            async for event in self._replay_cached_answer(cached, user_query, conversation_id):
+                yield event
+            return
+        
+        answer_parts = []
+        rag_return_data = [
+            {
+                "type": "rag_context",
+                "source": doc.metadata.get('source', '未知来源'),
+                "data": doc.page_content
+            }
+            for doc in rag_docs
+        ]
+        history = await self.conversation_store.ahistory(conversation_id)
+        with stage("prompt_build"):
+            rag_context, chat_history = self._build_context(user_query, rag_docs, history)
+
+        yield "rag_context", rag_return_data
+
+        _in_flight_generations.inc()
+        generation_start = time.perf_counter()
+        try:
+            # 直接消费LLM的异步流，token生成后立即产出，无需线程池与轮询
+            async for chunk in chain.astream(
+                {
+                    "question": user_query,
+                    "rag_context": rag_context,
+                    "chat_history": chat_history
+                },
+                config={"callbacks": callbacks} if callbacks else None
+            ):
+                token = chunk.content
+                if token:
+                    if not answer_parts:
+                        # 首token时间从调用LLM开始计，不含检索与提示词构建
+                        record_stage("ttft", time.perf_counter() - generation_start)
+                    answer_parts.append(token)
+                    yield "token", token
             
-            # 创建回调处理器
-            callback_handler = StreamingCallbackHandler(handle_token)
+            answer = "".join(answer_parts)
+            await self._save_turn(conversation_id, user_query, answer)
             
-            # 创建对话链
-            chain = self._create_chain(conversation_id, callback_handler)
+            if cache_embedding is not None:
+                self.answer_cache.store(
+                    user_query,
+                    cache_embedding,
+                    answer,
+                    rag_return_data,
+                    index_version
+                )
+                
+        except (asyncio.CancelledError, GeneratorExit):
+            # 关闭生成器会同时关闭LLM的HTTP流，服务端随之停止生成
+            record_cancellation(len(answer_parts), self.max_tokens)
+            raise
+        except Exception as e:
+            yield "error", f"生成过程中出错: {str(e)}"
+        finally:
+            _in_flight_generations.dec()
+            _generated_tokens.inc(len(answer_parts))
+            record_count("tokens", len(answer_parts))
+            record_stage("generation", time.perf_counter() - generation_start)
+    
+    async def abatch(
+        self,
+        messages: List[str],
+        concurrency: int = 8,
+        retrieval_batch_size: int = 32,
+        acquire: Optional[Callable[[], Awaitable[Any]]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """批量问答，按完成顺序产出每个问题的结果
+        
+        问题按 retrieval_batch_size 分批检索（每批一次嵌入、一次FAISS检索），
+        每批检索完成后即开始该批的生成，与下一批的检索并行；
+        生成使用非流式对话链，最多 concurrency 个同时进行；不读写会话记忆，不生成标题
+        
+        Args:
+            messages: 用户消息列表
+            concurrency: 同时进行的LLM生成数
+            retrieval_batch_size: 每批检索的问题数
+            acquire: 每次生成前调用，返回带 release() 的准入凭证，生成结束后归还；
+                未获准入时该问题以错误结束
             
-            # 获取RAG上下文
-            rag_docs = self._query_vector_database(user_query)
-            rag_return_data = []
-            rag_context = ""
-            if rag_docs:
-                rag_context = "以下是相关文档信息：\n\n"
-                for i, doc in enumerate(rag_docs, 1):
-                    source = doc.metadata.get('source', '未知来源')
-                    rag_context += f"[文档{i}] 来源: {source}\n内容: {doc.page_content}\n\n"
-                    rag_return_data.append({
-                        "type": "rag_context",
-                        "source": source,
-                        "data": doc.page_content
+        Yields:
+            dict: {index, question, answer, sources, error, retrieval_error, seconds}，
+                检索超时或失败时 retrieval_error 为原因，回答以空上下文生成
+        """
+        queries = [self._parse_user_input(message) for message in messages]
+        chain = self._create_chain(streaming=False)
+        semaphore = asyncio.Semaphore(concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+        
+        async def answer(index: int, query: str, rag_docs: List[Document], retrieval_error: Optional[str]) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                result = {
+                    "index": index,
+                    "question": query,
+                    "answer": None,
+                    "sources": [doc.metadata.get('source', '未知来源') for doc in rag_docs],
+                    "error": None,
+                    "retrieval_error": retrieval_error
+                }
+                ticket = None
+                try:
+                    if acquire is not None:
+                        ticket = await acquire()
+                    rag_context, chat_history = self._build_context(query, rag_docs, [])
+                    response = await chain.ainvoke({
+                        "question": query,
+                        "rag_context": rag_context,
+                        "chat_history": chat_history
                     })
-            else:
-                rag_context = "没有找到相关文档。"
-
-            yield f"[rag_context]:{json.dumps(rag_return_data)}\n\n"
-
+                    result["answer"] = response.content
+                except Exception as e:
+                    result["error"] = f"生成过程中出错: {str(e)}"
+                finally:
+                    if ticket is not None:
+                        ticket.release()
+                result["seconds"] = round(time.perf_counter() - start, 3)
+            _batch_prompts.inc()
+            await results.put(result)
+        
+        async def produce() -> None:
+            tasks = []
             try:
-                # 非阻塞执行链
-                loop = asyncio.get_event_loop()
-                with ThreadPoolExecutor() as executor:
-                    # 在线程池中运行同步代码
-                    future = loop.run_in_executor(
-                        executor,
-                        lambda: chain.invoke({
-                            "question": user_query,
-                            "rag_context": rag_context
-                        })
+                for start in range(0, len(queries), retrieval_batch_size):
+                    batch = queries[start:start + retrieval_batch_size]
+                    docs_batch, retrieval_error = await self._query_vector_database_batch(batch)
+                    tasks.extend(
+                        asyncio.create_task(answer(start + offset, query, rag_docs, retrieval_error))
+                        for offset, (query, rag_docs) in enumerate(zip(batch, docs_batch))
                     )
-                    
-                    # 等待队列中有token
-                    while True:
-                        # 检查队列中是否有token
-                        if queue:
-                            token = queue.pop(0)
-                            yield token
-                        
-                        # 检查链是否已完成
-                        if future.done():
-                            # 确保所有剩余token都被处理
-                            while queue:
-                                yield queue.pop(0)
-                            break
-                        
-                        # 短暂等待
-                        await asyncio.sleep(0.01)
-                    
-                    # 确保future完成
-                    await future
-                    
-            except Exception as e:
-                error_json = json.dumps({"error": f"生成过程中出错: {str(e)}"})
-                yield error_json
-        
-        # 返回生成器
-        async for token in token_generator():
-            yield token
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        
+        producer = asyncio.create_task(produce())
+        try:
+            for _ in queries:
+                yield await results.get()
+        finally:
+            # 客户端断开时取消尚未完成的检索与生成
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
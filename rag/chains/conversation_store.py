@@ -0,0 +1,525 @@
+"""有界会话存储
+
+替代进程内无上限的会话字典：
+1. 最多在内存中保留 max_size 个会话，超出时按LRU淘汰，空闲超过TTL的会话也会被淘汰
+2. 配置了持久化后端（或 spill_dir）时，被淘汰的会话写入后端，再次访问时自动加载；
+   多进程共享的后端（SQLite、Redis）采用写穿，每轮对话后立即写入，读取时按版本号校验进程内缓存，
+   因此多个worker可以处理同一会话；写入以版本号做比较并交换，其他worker先写入时重新加载会话并重放修改
+3. 记忆模式：
+   - buffer: 保留完整历史（原有行为）
+   - window: 只保留最近 window_turns 轮对话
+   - summary: 最近 window_turns 轮保留原文，更早的对话折叠进滚动摘要
+   window 与 summary 模式下每轮的历史对话token数基本恒定，不随对话长度增长
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage, messages_from_dict, messages_to_dict
+
+from rag.chains.context_packer import format_chat_history
+from rag.chains.session_backend import FileSessionBackend, SessionBackend
+from rag.monitoring.runtime_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    from langchain.memory import ConversationBufferMemory
+
+MEMORY_MODES = ("buffer", "window", "summary")
+
+# 写穿模式下版本冲突时重新加载并重放修改的最大次数
+WRITE_RETRIES = 5
+
+SUMMARY_PROMPT_TEMPLATE = """
+        请将已有摘要与新增对话合并为一段简洁的对话摘要（不超过300字），保留用户关心的问题、关键事实与结论。
+        请直接返回摘要文本，不要包含任何其他内容。
+
+        已有摘要:
+        {summary}
+
+        新增对话:
+        {conversation}
+
+        摘要:
+        """
+
+
+def default_memory_factory() -> "ConversationBufferMemory":
+    """会话链使用的记忆对象（langchain.memory 导入较慢，首次创建会话时才导入）"""
+    from langchain.memory import ConversationBufferMemory
+
+    return ConversationBufferMemory(
+        memory_key="chat_history",
+        return_messages=True,
+        input_key="question",
+        output_key="output"
+    )
+
+
+def truncate_summary(summary: str, conversation: str, max_chars: int = 1000) -> str:
+    """不调用LLM的摘要：只保留用户问题，超出长度时丢弃最早的部分"""
+    questions = [line for line in conversation.splitlines() if line.startswith("人类: ")]
+    merged = "\n".join(part for part in [summary, *questions] if part)
+    return merged[-max_chars:]
+
+
+@dataclass
+class ConversationState:
+    """单个会话的状态"""
+    conversation_id: str
+    memory: "ConversationBufferMemory"
+    summary: str = ""
+    title: str = ""
+    version: int = 0
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.monotonic)
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.memory.chat_memory.messages
+
+
+class ConversationStore:
+    """有界会话存储
+
+    Args:
+        max_size: 内存中最多保留的会话数
+        ttl_seconds: 会话空闲超过该时间后移出内存，0 表示不过期
+        spill_dir: 淘汰会话的落盘目录，未指定 backend 时使用；两者都为空时淘汰即丢弃
+        memory_mode: 记忆模式，buffer / window / summary
+        window_turns: window 与 summary 模式下保留原文的最近对话轮数
+        summarizer: summary 模式的摘要函数 (已有摘要, 新增对话文本) -> 新摘要，
+            为空时使用不调用LLM的截断摘要
+        memory_factory: 创建记忆对象的函数
+        backend: 会话持久化后端，多进程共享的后端会启用写穿
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        ttl_seconds: float = 0,
+        spill_dir: Optional[str] = None,
+        memory_mode: str = "buffer",
+        window_turns: int = 5,
+        summarizer: Optional[Callable[[str, str], Awaitable[str]]] = None,
+        memory_factory: Callable[[], "ConversationBufferMemory"] = default_memory_factory,
+        backend: Optional[SessionBackend] = None,
+    ):
+        if memory_mode not in MEMORY_MODES:
+            raise ValueError(f"不支持的记忆模式: {memory_mode}")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.memory_mode = memory_mode
+        self.window_turns = window_turns
+        self.summarizer = summarizer
+        self.memory_factory = memory_factory
+        self.backend = backend or (FileSessionBackend(spill_dir) if spill_dir else None)
+        self.write_through = bool(self.backend is not None and self.backend.shared)
+
+        self._states: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._compactions: Dict[str, asyncio.Task] = {}
+        self._evict_listeners: List[Callable[[str], None]] = []
+        self._lock = threading.RLock()
+
+        self.evictions = 0
+        self.spills = 0
+        self.loads = 0
+        self.summaries = 0
+        self._evictions_counter = REGISTRY.counter("conversation_evictions_total", "移出内存的会话数")
+        self._spills_counter = REGISTRY.counter("conversation_spills_total", "写入磁盘的会话数")
+        self._loads_counter = REGISTRY.counter("conversation_loads_total", "从磁盘加载的会话数")
+        self._summaries_counter = REGISTRY.counter("conversation_summaries_total", "折叠进滚动摘要的次数")
+        self._size_gauge = REGISTRY.gauge("conversation_store_entries", "内存中的会话数")
+
+    # ---- 持久化 ----
+
+    @staticmethod
+    def _to_dict(state: ConversationState) -> Dict[str, object]:
+        return {
+            "conversation_id": state.conversation_id,
+            "summary": state.summary,
+            "title": state.title,
+            "version": state.version,
+            "created_at": state.created_at,
+            "messages": messages_to_dict(state.messages),
+        }
+
+    def _spill(self, state: ConversationState) -> None:
+        if self.backend is None:
+            return
+        self.backend.save(state.conversation_id, self._to_dict(state))
+        self.spills += 1
+        self._spills_counter.inc()
+
+    def _load(self, conversation_id: str) -> Optional[ConversationState]:
+        if self.backend is None:
+            return None
+        data = self.backend.load(conversation_id)
+        if data is None:
+            return None
+        memory = self.memory_factory()
+        memory.chat_memory.messages = messages_from_dict(data.get("messages", []))
+        self.loads += 1
+        self._loads_counter.inc()
+        return ConversationState(
+            conversation_id=conversation_id,
+            memory=memory,
+            summary=data.get("summary", ""),
+            title=data.get("title", ""),
+            version=data.get("version", 0),
+            created_at=data.get("created_at", time.time()),
+        )
+
+    def _persist(self, state: ConversationState) -> bool:
+        """递增版本号；写穿模式下仅当后端版本号仍是修改前的版本时写入
+
+        Returns:
+            bool: 是否提交成功，其他worker已写入更新的版本时返回 False
+        """
+        state.version += 1
+        if not self.write_through:
+            return True
+        if not self.backend.save_if_version(state.conversation_id, self._to_dict(state), state.version - 1):
+            return False
+        self.spills += 1
+        self._spills_counter.inc()
+        return True
+
+    def commit(self, conversation_id: str) -> bool:
+        """会话发生变化后递增版本号；写穿模式下立即写入后端
+
+        其他worker已写入更新的版本时放弃本次修改，丢弃进程内缓存，下次读取时重新加载。
+        需要在冲突后重放修改的调用方应使用 save_turn / save_messages
+
+        Returns:
+            bool: 是否提交成功
+        """
+        with self._lock:
+            state = self._states.get(conversation_id)
+            if state is None:
+                return False
+            if self._persist(state):
+                return True
+            self._states.pop(conversation_id, None)
+            logger.warning("会话 %s 已被其他worker更新，本次修改未写入", conversation_id)
+            return False
+
+    def _mutate(
+        self, conversation_id: str, apply: Callable[[ConversationState], bool], create: bool = True
+    ) -> Optional[ConversationState]:
+        """在最新的会话状态上执行修改并提交
+
+        写穿模式下提交时版本号冲突（其他worker先写入）会重新加载会话并重放修改，
+        避免多个worker同时处理同一会话时后写覆盖先写
+
+        Args:
+            conversation_id: 会话ID
+            apply: 修改函数，返回 False 表示无需修改
+            create: 会话不存在时是否创建
+
+        Returns:
+            Optional[ConversationState]: 修改后的会话，会话不存在且 create 为 False 时返回 None
+        """
+        with self._lock:
+            for _ in range(WRITE_RETRIES):
+                state = self.get_or_create(conversation_id) if create else self.get(conversation_id)
+                if state is None or not apply(state):
+                    return state
+                if self._persist(state):
+                    return state
+                self._states.pop(conversation_id, None)
+            logger.warning("会话 %s 写入冲突重试 %d 次后仍失败，本次修改未写入", conversation_id, WRITE_RETRIES)
+            return state
+
+    # ---- 淘汰 ----
+
+    def add_evict_listener(self, listener: Callable[[str], None]) -> None:
+        """注册会话移出内存时的回调，用于同步清理按会话缓存的其他数据（如标题）"""
+        self._evict_listeners.append(listener)
+
+    @staticmethod
+    def _cancel(task: Optional[asyncio.Task]) -> None:
+        # 后端读写在线程池中执行，淘汰可能发生在事件循环之外的线程
+        if task is not None and not task.done():
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def _evict(self, conversation_id: str) -> None:
+        state = self._states.pop(conversation_id)
+        self._cancel(self._compactions.pop(conversation_id, None))
+        # 写穿模式下后端已是最新，无需再次写入
+        if not self.write_through:
+            self._spill(state)
+        for listener in self._evict_listeners:
+            listener(conversation_id)
+        self.evictions += 1
+        self._evictions_counter.inc()
+
+    def _enforce_limits(self) -> None:
+        if self.ttl_seconds:
+            now = time.monotonic()
+            expired = [cid for cid, state in self._states.items() if now - state.last_access > self.ttl_seconds]
+            for conversation_id in expired:
+                self._evict(conversation_id)
+        while len(self._states) > self.max_size:
+            self._evict(next(iter(self._states)))
+        self._size_gauge.set(len(self._states))
+
+    def _insert(self, state: ConversationState) -> ConversationState:
+        self._states[state.conversation_id] = state
+        self._enforce_limits()
+        return state
+
+    # ---- 访问 ----
+
+    def __contains__(self, conversation_id: Optional[str]) -> bool:
+        if not conversation_id:
+            return False
+        with self._lock:
+            if conversation_id in self._states:
+                return True
+        return self.backend is not None and self.backend.exists(conversation_id)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def create(self, conversation_id: Optional[str] = None) -> ConversationState:
+        """创建新会话"""
+        with self._lock:
+            state = ConversationState(
+                conversation_id=conversation_id or str(uuid.uuid4()),
+                memory=self.memory_factory(),
+            )
+            if self.write_through:
+                if self.backend.save_if_version(state.conversation_id, self._to_dict(state), None):
+                    self.spills += 1
+                    self._spills_counter.inc()
+                else:
+                    # 其他worker已用该ID创建会话，沿用后端中的数据
+                    state = self._load(state.conversation_id) or state
+            return self._insert(state)
+
+    def get(self, conversation_id: Optional[str]) -> Optional[ConversationState]:
+        """获取会话，内存中没有时尝试从后端加载，并标记为最近使用
+
+        写穿模式下会校验后端版本号，其他worker更新过的会话会被重新加载
+        """
+        if not conversation_id:
+            return None
+        with self._lock:
+            state = self._states.get(conversation_id)
+            if state is not None and self.write_through:
+                version = self.backend.version(conversation_id)
+                if version is not None and version != state.version:
+                    state = None
+            if state is not None:
+                self._states.move_to_end(conversation_id)
+            else:
+                state = self._load(conversation_id)
+                if state is None:
+                    return None
+                self._insert(state)
+            state.last_access = time.monotonic()
+            return state
+
+    def get_or_create(self, conversation_id: Optional[str]) -> ConversationState:
+        """获取会话，不存在时以该ID创建"""
+        return self.get(conversation_id) or self.create(conversation_id)
+
+    def delete(self, conversation_id: str) -> None:
+        """删除会话（包括后端中的数据）"""
+        with self._lock:
+            self._states.pop(conversation_id, None)
+            self._cancel(self._compactions.pop(conversation_id, None))
+            if self.backend is not None:
+                self.backend.delete(conversation_id)
+            self._size_gauge.set(len(self._states))
+
+    def flush(self) -> None:
+        """将内存中的全部会话写入后端（如服务关闭时）；写穿模式下后端已是最新，无需写入"""
+        if self.write_through:
+            return
+        with self._lock:
+            for state in self._states.values():
+                self._spill(state)
+
+    # ---- 记忆模式 ----
+
+    def history(self, conversation_id: str) -> List[BaseMessage]:
+        """按记忆模式返回传给LLM的历史对话"""
+        with self._lock:
+            state = self.get(conversation_id)
+            if state is None:
+                return []
+            messages = list(state.messages)
+        if self.memory_mode == "buffer":
+            return messages
+        recent = messages[-2 * self.window_turns:] if self.window_turns > 0 else []
+        if self.memory_mode == "summary" and state.summary:
+            return [SystemMessage(content=f"更早对话的摘要: {state.summary}")] + recent
+        return recent
+
+    def save_turn(self, conversation_id: str, question: str, answer: str) -> ConversationState:
+        """写入一轮对话；window 模式下直接丢弃窗口之外的旧消息"""
+        def apply(state: ConversationState) -> bool:
+            state.memory.save_context({"question": question}, {"output": answer})
+            self._trim_state(state)
+            return True
+
+        return self._mutate(conversation_id, apply)
+
+    def save_messages(
+        self, conversation_id: str, messages: List[BaseMessage], summary_as_window: bool = False
+    ) -> ConversationState:
+        """追加调用方自行生成的一轮消息（如Agent的输入、工具调用与回答）
+
+        Args:
+            conversation_id: 会话ID
+            messages: 本轮新增的消息
+            summary_as_window: 同 trim()
+        """
+        def apply(state: ConversationState) -> bool:
+            state.messages.extend(messages)
+            self._trim_state(state, summary_as_window)
+            return True
+
+        return self._mutate(conversation_id, apply)
+
+    def set_title(self, conversation_id: str, title: str) -> None:
+        """保存会话标题"""
+        def apply(state: ConversationState) -> bool:
+            if state.title == title:
+                return False
+            state.title = title
+            return True
+
+        self._mutate(conversation_id, apply, create=False)
+
+    def trim(self, conversation_id: str, summary_as_window: bool = False) -> None:
+        """window 模式下丢弃窗口之外的旧消息
+
+        Args:
+            conversation_id: 会话ID
+            summary_as_window: summary 模式下也直接裁剪，用于不经过 history() 读取记忆的调用方（如Agent）
+        """
+        with self._lock:
+            state = self._states.get(conversation_id)
+            if state is not None:
+                self._trim_state(state, summary_as_window)
+
+    def _trim_state(self, state: ConversationState, summary_as_window: bool = False) -> None:
+        if self.memory_mode == "buffer":
+            return
+        if self.memory_mode == "summary" and not summary_as_window:
+            return
+        overflow = len(state.messages) - 2 * self.window_turns
+        if overflow > 0:
+            del state.messages[:overflow]
+
+    def needs_compaction(self, conversation_id: str) -> bool:
+        state = self._states.get(conversation_id)
+        return (
+            self.memory_mode == "summary"
+            and state is not None
+            and conversation_id not in self._compactions
+            and len(state.messages) > 2 * self.window_turns
+        )
+
+    async def acompact(self, conversation_id: str) -> None:
+        """summary 模式下将窗口之外的旧消息折叠进滚动摘要"""
+        state = self._states.get(conversation_id)
+        if state is None:
+            return
+        overflow = len(state.messages) - 2 * self.window_turns
+        if overflow <= 0:
+            return
+        folded = list(state.messages[:overflow])
+        conversation = format_chat_history(folded)
+        summary = None
+        if self.summarizer is not None:
+            try:
+                summary = (await self.summarizer(state.summary, conversation)).strip()
+            except Exception as e:
+                logger.warning("生成对话摘要时出错: %s", e)
+        if not summary:
+            summary = truncate_summary(state.summary, conversation)
+        applied = False
+
+        def apply(current: ConversationState) -> bool:
+            # 摘要生成期间可能写入了新消息（或会话被其他worker更新后重新加载），只删除已折叠的部分
+            nonlocal applied
+            applied = current.messages[:overflow] == folded
+            if applied:
+                del current.messages[:overflow]
+                current.summary = summary
+            return applied
+
+        await self._run(self._mutate, conversation_id, apply, False)
+        if applied:
+            self.summaries += 1
+            self._summaries_counter.inc()
+
+    def schedule_compaction(self, conversation_id: str) -> Optional[asyncio.Task]:
+        """需要时在后台任务中折叠旧消息，不阻塞本轮回答"""
+        if not self.needs_compaction(conversation_id):
+            return None
+        task = asyncio.create_task(self.acompact(conversation_id))
+        self._compactions[conversation_id] = task
+        task.add_done_callback(lambda _: self._compactions.pop(conversation_id, None))
+        return task
+
+    # ---- 异步接口 ----
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """配置了后端时在线程池中执行，SQLite/Redis/文件读写不阻塞事件循环"""
+        if self.backend is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    async def acontains(self, conversation_id: Optional[str]) -> bool:
+        return await self._run(self.__contains__, conversation_id)
+
+    async def acreate(self, conversation_id: Optional[str] = None) -> ConversationState:
+        return await self._run(self.create, conversation_id)
+
+    async def aget(self, conversation_id: Optional[str]) -> Optional[ConversationState]:
+        return await self._run(self.get, conversation_id)
+
+    async def aget_or_create(self, conversation_id: Optional[str]) -> ConversationState:
+        return await self._run(self.get_or_create, conversation_id)
+
+    async def ahistory(self, conversation_id: str) -> List[BaseMessage]:
+        return await self._run(self.history, conversation_id)
+
+    async def asave_turn(self, conversation_id: str, question: str, answer: str) -> ConversationState:
+        return await self._run(self.save_turn, conversation_id, question, answer)
+
+    async def asave_messages(
+        self, conversation_id: str, messages: List[BaseMessage], summary_as_window: bool = False
+    ) -> ConversationState:
+        return await self._run(self.save_messages, conversation_id, messages, summary_as_window)
+
+    async def aset_title(self, conversation_id: str, title: str) -> None:
+        await self._run(self.set_title, conversation_id, title)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "size": len(self._states),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "memory_mode": self.memory_mode,
+            "window_turns": self.window_turns,
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "write_through": self.write_through,
+            "evictions": self.evictions,
+            "spills": self.spills,
+            "loads": self.loads,
+            "summaries": self.summaries,
+            "compacting": len(self._compactions),
+        }
@@ -0,0 +1,226 @@
+"""LLM客户端池
+
+按 (provider, model, api_base, temperature, max_tokens) 复用LLM实例与预构建的对话链，
+同一 api_base 的所有OpenAI兼容客户端共享带连接池的 httpx 客户端，保持长连接，
+避免每条消息都新建HTTP客户端、重复TLS握手。
+流式回调等按请求变化的处理器通过运行时 config 传入，而不是在构造时绑定。
+"""
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+
+class LLMClientPool:
+    """LLM客户端注册表
+
+    Args:
+        max_connections: 每个 api_base 的最大连接数
+        max_keepalive_connections: 保持空闲的最大长连接数
+        keepalive_expiry: 空闲长连接的保持时间（秒）
+        timeout: 请求超时时间（秒）
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 120.0,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self._clients: Dict[Tuple, Any] = {}
+        self._chains: Dict[Tuple, Any] = {}
+        self._http_clients: Dict[Optional[str], Tuple[httpx.Client, httpx.AsyncClient]] = {}
+        self._lock = threading.Lock()
+        self._creation_seconds = 0.0
+
+        self.clients_created = 0
+        self.client_reuses = 0
+        self.seconds_saved = 0.0
+        self.http_requests = 0
+        self.http_new_connections = 0
+        self._clients_created_counter = REGISTRY.counter("llm_clients_created_total", "新建的LLM客户端数")
+        self._client_reuses_counter = REGISTRY.counter("llm_client_reuses_total", "复用已有LLM客户端的次数")
+        self._seconds_saved_counter = REGISTRY.counter(
+            "llm_client_creation_seconds_saved_total", "复用LLM客户端节省的构造时间（按平均构造耗时估算）"
+        )
+        self._http_requests_counter = REGISTRY.counter("llm_http_requests_total", "发往LLM服务的HTTP请求数")
+        self._http_new_connections_counter = REGISTRY.counter(
+            "llm_http_new_connections_total", "新建的LLM服务TCP连接数"
+        )
+
+    # ---- HTTP连接池 ----
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.http_new_connections += 1
+            self._http_new_connections_counter.inc()
+
+    async def _atrace(self, event_name: str, info: dict) -> None:
+        self._trace(event_name, info)
+
+    def _count_request(self) -> None:
+        self.http_requests += 1
+        self._http_requests_counter.inc()
+
+    def _on_request(self, request: httpx.Request) -> None:
+        self._count_request()
+        request.extensions["trace"] = self._trace
+
+    async def _aon_request(self, request: httpx.Request) -> None:
+        self._count_request()
+        request.extensions["trace"] = self._atrace
+
+    def _get_http_clients(self, api_base: Optional[str]) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        """获取某个 api_base 共享的同步与异步HTTP客户端"""
+        clients = self._http_clients.get(api_base)
+        if clients is None:
+            clients = (
+                httpx.Client(
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    event_hooks={"request": [self._on_request]},
+                ),
+                httpx.AsyncClient(
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    event_hooks={"request": [self._aon_request]},
+                ),
+            )
+            self._http_clients[api_base] = clients
+        return clients
+
+    # ---- LLM客户端 ----
+
+    def _build_llm(
+        self,
+        provider: str,
+        model: str,
+        api_base: Optional[str],
+        api_key: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int],
+        streaming: bool,
+    ) -> Any:
+        if provider == "ollama":
+            from langchain_ollama import ChatOllama
+
+            return ChatOllama(
+                model=model,
+                temperature=temperature,
+                num_predict=max_tokens,
+            )
+
+        from langchain_openai import ChatOpenAI
+
+        http_client, http_async_client = self._get_http_clients(api_base)
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            streaming=streaming,
+            openai_api_base=api_base,
+            openai_api_key=api_key,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+
+    def get_llm(
+        self,
+        provider: str,
+        model: str,
+        api_base: Optional[str] = None,
+        api_key: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        streaming: bool = True,
+    ) -> Any:
+        """获取（或创建并缓存）LLM实例
+
+        Args:
+            provider: openai 或 ollama
+            model: 模型名称
+            api_base: API基础URL
+            api_key: API密钥，不同密钥使用不同的客户端
+            temperature: 温度参数
+            max_tokens: 最大token数
+            streaming: 是否流式输出
+        """
+        key = (provider, model, api_base, temperature, max_tokens, streaming, api_key)
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is not None:
+                saved = self._creation_seconds / self.clients_created if self.clients_created else 0.0
+                self.client_reuses += 1
+                self.seconds_saved += saved
+                self._client_reuses_counter.inc()
+                self._seconds_saved_counter.inc(saved)
+                return llm
+
+            start = time.perf_counter()
+            llm = self._build_llm(provider, model, api_base, api_key, temperature, max_tokens, streaming)
+            self._creation_seconds += time.perf_counter() - start
+            self.clients_created += 1
+            self._clients_created_counter.inc()
+            self._clients[key] = llm
+            return llm
+
+    def get_chain(self, prompt_template: str, **llm_kwargs) -> Any:
+        """获取预构建的 prompt | llm 对话链
+
+        Args:
+            prompt_template: 提示模板字符串
+            **llm_kwargs: 传给 get_llm 的参数
+        """
+        llm = self.get_llm(**llm_kwargs)
+        key = (prompt_template, id(llm))
+        with self._lock:
+            chain = self._chains.get(key)
+            if chain is None:
+                from langchain_core.prompts import ChatPromptTemplate
+
+                chain = ChatPromptTemplate.from_template(prompt_template) | llm
+                self._chains[key] = chain
+            return chain
+
+    def stats(self) -> Dict[str, Any]:
+        """客户端复用与连接复用统计"""
+        return {
+            "clients": len(self._clients),
+            "chains": len(self._chains),
+            "clients_created": self.clients_created,
+            "client_reuses": self.client_reuses,
+            "creation_seconds_saved": self.seconds_saved,
+            "http_requests": self.http_requests,
+            "http_new_connections": self.http_new_connections,
+            "http_connection_reuses": max(0, self.http_requests - self.http_new_connections),
+        }
+
+    async def aclose(self) -> None:
+        """关闭所有HTTP客户端"""
+        for http_client, http_async_client in self._http_clients.values():
+            http_client.close()
+            await http_async_client.aclose()
+        self._http_clients.clear()
+        self._clients.clear()
+        self._chains.clear()
+
+
+llm_pool_instance = None
+
+
+def get_llm_pool() -> LLMClientPool:
+    """获取全局LLM客户端池"""
+    global llm_pool_instance
+    if llm_pool_instance is None:
+        llm_pool_instance = LLMClientPool()
+    return llm_pool_instance
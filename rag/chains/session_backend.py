@@ -0,0 +1,306 @@
+"""会话状态持久化后端
+
+会话以字典形式（消息、摘要、标题、版本号）保存在进程外，多个uvicorn worker
+共享同一后端时，任意worker都可以处理任意 conversation_id。
+共享后端的写入按版本号比较并交换（save_if_version），多个worker同时写入同一会话时不会后写覆盖先写。
+
+- FileSessionBackend: 每个会话一个JSON文件，仅适合单进程落盘
+- SQLiteSessionBackend: 本地SQLite（WAL模式），适合单机多worker
+- RedisSessionBackend: Redis协议，适合多机部署；本地可用 fakeredis 代替
+
+通过 create_session_backend(url) 按URL创建：
+    file:///abs/path/to/dir
+    sqlite:///relative/sessions.db 或 sqlite:////abs/sessions.db
+    redis://host:6379/0
+    fakeredis://
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,128}$")
+
+
+class SessionBackend:
+    """会话持久化后端基类"""
+
+    # 多个进程是否共享该后端，共享时会话存储需要写穿并在读取时校验版本
+    shared = False
+
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话数据，不存在时返回 None"""
+        raise NotImplementedError
+
+    def save(self, conversation_id: str, data: Dict[str, Any]) -> None:
+        """写入会话数据"""
+        raise NotImplementedError
+
+    def save_if_version(self, conversation_id: str, data: Dict[str, Any], expected_version: Optional[int]) -> bool:
+        """后端中的版本号等于 expected_version 时才写入（为 None 时要求会话不存在）
+
+        共享后端需以原子操作实现；默认实现先读后写，只适合单进程使用的后端
+
+        Returns:
+            bool: 是否写入，版本号不一致（其他进程已写入）时返回 False
+        """
+        if self.version(conversation_id) != expected_version:
+            return False
+        self.save(conversation_id, data)
+        return True
+
+    def version(self, conversation_id: str) -> Optional[int]:
+        """读取会话版本号，用于判断进程内缓存是否过期；默认读取完整数据"""
+        data = self.load(conversation_id)
+        return data.get("version", 0) if data is not None else None
+
+    def exists(self, conversation_id: str) -> bool:
+        return self.version(conversation_id) is not None
+
+    def delete(self, conversation_id: str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class FileSessionBackend(SessionBackend):
+    """每个会话一个JSON文件
+
+    Args:
+        directory: 存放会话文件的目录
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, conversation_id: str) -> Optional[str]:
+        if not CONVERSATION_ID_PATTERN.match(conversation_id):
+            return None
+        return os.path.join(self.directory, f"{conversation_id}.json")
+
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(conversation_id)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("加载会话 %s 失败: %s", conversation_id, e)
+            return None
+
+    def save(self, conversation_id: str, data: Dict[str, Any]) -> None:
+        path = self._path(conversation_id)
+        if path is None:
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def exists(self, conversation_id: str) -> bool:
+        path = self._path(conversation_id)
+        return path is not None and os.path.exists(path)
+
+    def delete(self, conversation_id: str) -> None:
+        path = self._path(conversation_id)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """SQLite会话后端，开启WAL以支持多进程并发读写
+
+    Args:
+        path: 数据库文件路径
+        busy_timeout: 等待其他进程释放写锁的最长时间（秒）
+    """
+
+    shared = True
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # sqlite3 连接不能跨线程使用，每个线程各自持有连接
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "conversation_id TEXT PRIMARY KEY, "
+            "version INTEGER NOT NULL, "
+            "data TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, conversation_id: str, data: Dict[str, Any]) -> None:
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO sessions (conversation_id, version, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(conversation_id) DO UPDATE SET "
+            "version = excluded.version, data = excluded.data, updated_at = excluded.updated_at",
+            (conversation_id, data.get("version", 0), json.dumps(data, ensure_ascii=False), time.time())
+        )
+        conn.commit()
+
+    def save_if_version(self, conversation_id: str, data: Dict[str, Any], expected_version: Optional[int]) -> bool:
+        conn = self._connection()
+        payload = json.dumps(data, ensure_ascii=False)
+        if expected_version is None:
+            cursor = conn.execute(
+                "INSERT INTO sessions (conversation_id, version, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(conversation_id) DO NOTHING",
+                (conversation_id, data.get("version", 0), payload, time.time())
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE sessions SET version = ?, data = ?, updated_at = ? "
+                "WHERE conversation_id = ? AND version = ?",
+                (data.get("version", 0), payload, time.time(), conversation_id, expected_version)
+            )
+        conn.commit()
+        return cursor.rowcount == 1
+
+    def version(self, conversation_id: str) -> Optional[int]:
+        row = self._connection().execute(
+            "SELECT version FROM sessions WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, conversation_id: str) -> None:
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE conversation_id = ?", (conversation_id,))
+        conn.commit()
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisSessionBackend(SessionBackend):
+    """Redis会话后端，每个会话一个hash（version与data两个字段）
+
+    Args:
+        client: redis.Redis 或兼容客户端（如 fakeredis.FakeRedis）
+        prefix: 键前缀
+        ttl_seconds: 会话过期时间，0 表示不过期
+    """
+
+    shared = True
+
+    def __init__(self, client: Any, prefix: str = "threatrag:session:", ttl_seconds: float = 0):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisSessionBackend":
+        """按URL创建，fakeredis:// 使用进程内的 fakeredis 代替真实Redis
+
+        fakeredis 的数据只在当前进程内，其他worker看不到，因此不视为共享后端
+        """
+        if url.startswith("fakeredis://"):
+            import fakeredis
+
+            backend = cls(fakeredis.FakeRedis(), **kwargs)
+            backend.shared = False
+            return backend
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, conversation_id: str) -> str:
+        return f"{self.prefix}{conversation_id}"
+
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.hget(self._key(conversation_id), "data")
+        return json.loads(raw) if raw else None
+
+    def save(self, conversation_id: str, data: Dict[str, Any]) -> None:
+        key = self._key(conversation_id)
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={
+            "version": data.get("version", 0),
+            "data": json.dumps(data, ensure_ascii=False),
+        })
+        if self.ttl_seconds:
+            pipe.expire(key, int(self.ttl_seconds))
+        pipe.execute()
+
+    def save_if_version(self, conversation_id: str, data: Dict[str, Any], expected_version: Optional[int]) -> bool:
+        from redis.exceptions import WatchError
+
+        key = self._key(conversation_id)
+        with self.client.pipeline() as pipe:
+            try:
+                # WATCH 期间键被其他客户端修改时 EXEC 失败
+                pipe.watch(key)
+                raw = pipe.hget(key, "version")
+                if (int(raw) if raw is not None else None) != expected_version:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping={
+                    "version": data.get("version", 0),
+                    "data": json.dumps(data, ensure_ascii=False),
+                })
+                if self.ttl_seconds:
+                    pipe.expire(key, int(self.ttl_seconds))
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def version(self, conversation_id: str) -> Optional[int]:
+        raw = self.client.hget(self._key(conversation_id), "version")
+        return int(raw) if raw is not None else None
+
+    def delete(self, conversation_id: str) -> None:
+        self.client.delete(self._key(conversation_id))
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def create_session_backend(url: str) -> Optional[SessionBackend]:
+    """按URL创建会话后端，url 为空时返回 None
+
+    Args:
+        url: file:///dir、sqlite:///path.db、redis://host:port/db 或 fakeredis://
+    """
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://", "fakeredis://")):
+        return RedisSessionBackend.from_url(url)
+    if url.startswith("file://"):
+        return FileSessionBackend(url[len("file://"):])
+    raise ValueError(f"不支持的会话后端: {url}")
@@ -0,0 +1,171 @@
+"""流式输出的编码与SSE帧合并
+
+- dumps: 优先使用 orjson 序列化，未安装时退化为标准库 json
+- TokenCoalescer: 将连续的token按时间或大小阈值（默认20毫秒或64字节）合并为一帧，
+  减少每个token的序列化、拼接与写socket开销；非token事件（召回内容、错误）先冲刷缓冲区再原样输出
+- 每个响应的字节数与帧数记录到运行时指标
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+try:
+    import orjson
+
+    def dumps(obj: Any) -> str:
+        """序列化为JSON字符串（orjson，非ASCII字符不转义）"""
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:  # pragma: no cover - 取决于运行环境
+    def dumps(obj: Any) -> str:
+        """序列化为JSON字符串（标准库json）"""
+        return json.dumps(obj, ensure_ascii=False)
+
+# 流式事件：(类型, 内容)，类型为 rag_context / token / error
+StreamEvent = Tuple[str, Any]
+
+_response_bytes = REGISTRY.histogram(
+    "sse_response_bytes", "每个SSE响应写出的字节数",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144)
+)
+_response_frames = REGISTRY.histogram(
+    "sse_response_frames", "每个SSE响应写出的帧数",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+_tokens_coalesced = REGISTRY.counter("sse_tokens_total", "写入SSE帧的token数")
+
+
+def encode_event(kind: str, payload: Any) -> str:
+    """将流式事件编码为与原有格式一致的字符串（不含SSE的 data: 前缀）"""
+    if kind == "token":
+        return dumps({"type": "conversation", "data": payload})
+    if kind == "rag_context":
+        return f"[rag_context]:{dumps(payload)}\n\n"
+    return dumps({"error": payload})
+
+
+class SSEStats:
+    """单个响应的字节数、帧数与token数"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.frames = 0
+        self.tokens = 0
+
+    def frame(self, data: str) -> str:
+        """生成一帧SSE数据并计数"""
+        return self.raw(f"data: {data}\n\n")
+
+    def raw(self, frame: str) -> str:
+        """计数已格式化好的SSE帧"""
+        self.frames += 1
+        self.bytes += len(frame.encode("utf-8"))
+        return frame
+
+    def finish(self) -> None:
+        _response_bytes.observe(self.bytes)
+        _response_frames.observe(self.frames)
+        _tokens_coalesced.inc(self.tokens)
+
+    def as_dict(self) -> dict:
+        return {"bytes": self.bytes, "frames": self.frames, "tokens": self.tokens}
+
+
+class TokenCoalescer:
+    """按时间或大小阈值合并token
+
+    上游事件在单独的任务中消费（断开检测等取消逻辑作用于该任务），
+    缓冲区中第一个token到达后 flush_interval 秒或累计超过 max_bytes 字节时输出一帧。
+
+    Args:
+        flush_interval: 最长缓冲时间（秒），0 表示不合并
+        max_bytes: 缓冲区达到该字节数时立即输出
+    """
+
+    def __init__(self, flush_interval: float = 0.02, max_bytes: int = 64):
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+
+    async def coalesce(
+        self, events: AsyncIterator[StreamEvent], stats: Optional[SSEStats] = None
+    ) -> AsyncIterator[StreamEvent]:
+        """合并连续的token事件
+
+        Args:
+            events: 上游事件流
+            stats: 可选的响应统计，累计token数
+
+        Yields:
+            StreamEvent: 合并后的事件
+        """
+        if not self.flush_interval:
+            async for kind, payload in events:
+                if kind == "token" and stats is not None:
+                    stats.tokens += 1
+                yield kind, payload
+            return
+
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        buffer: List[str] = []
+        output: "deque[StreamEvent]" = deque()
+        state = {"bytes": 0, "timer": None, "done": False}
+
+        def flush_buffer() -> None:
+            if buffer:
+                output.append(("token", "".join(buffer)))
+                buffer.clear()
+                state["bytes"] = 0
+            if state["timer"] is not None:
+                state["timer"].cancel()
+                state["timer"] = None
+
+        def on_timer() -> None:
+            state["timer"] = None
+            flush_buffer()
+            ready.set()
+
+        async def produce() -> None:
+            try:
+                async for kind, payload in events:
+                    if kind != "token":
+                        flush_buffer()
+                        output.append((kind, payload))
+                        ready.set()
+                        continue
+                    if stats is not None:
+                        stats.tokens += 1
+                    if not buffer:
+                        state["timer"] = loop.call_later(self.flush_interval, on_timer)
+                    buffer.append(payload)
+                    state["bytes"] += len(payload.encode("utf-8"))
+                    if state["bytes"] >= self.max_bytes:
+                        flush_buffer()
+                        ready.set()
+            finally:
+                flush_buffer()
+                state["done"] = True
+                ready.set()
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                while output:
+                    # yield 期间上游追加的事件在本轮继续输出
+                    yield output.popleft()
+                if state["done"] and not output:
+                    break
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
+            if state["timer"] is not None:
+                state["timer"].cancel()
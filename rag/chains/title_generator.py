@@ -0,0 +1,210 @@
+"""会话标题生成
+
+标题只在会话创建后的首个问题或话题切换时生成一次，并按会话缓存；
+生成在后台任务中进行，不阻塞回答的流式输出。
+支持两种模式：
+- llm: 调用非流式LLM（异步）生成标题
+- heuristic: 本地关键词提取，不调用LLM
+"""
+import asyncio
+import json
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from rag.chains.context_packer import CJK_PATTERN, STOPWORDS, WORD_PATTERN, extract_query_terms
+from rag.monitoring.runtime_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TITLE_PROMPT_TEMPLATE = """
+        根据以下对话内容，生成一个简短的会话标题（不超过10个字）。标题应该概括对话的主要内容。
+        请直接返回标题文本，不要包含任何其他内容。
+
+        对话内容:
+        {chat_history}
+
+        标题:
+        """
+
+
+# 中文问句中的虚词与疑问词，提取标题关键词时去掉
+CJK_FILLERS = ("请问", "什么是", "什么", "哪些", "如何", "怎么样", "怎么", "为什么", "是否", "有没有", "一下", "关于", "介绍")
+CJK_PARTICLES = "的了吗呢吧啊是和与及在对有"
+
+
+def extract_title_terms(text: str) -> List[str]:
+    """提取标题候选词：英文词（去除停用词）与去掉虚词后的中文片段，按出现顺序"""
+    found = []
+    for match in WORD_PATTERN.finditer(text):
+        word = match.group().strip(".")
+        if len(word) > 1 and word.lower() not in STOPWORDS:
+            found.append((match.start(), word))
+    for match in CJK_PATTERN.finditer(text):
+        run = match.group()
+        for filler in CJK_FILLERS:
+            run = run.replace(filler, " " * len(filler))
+        offset = 0
+        for piece in run.split(" "):
+            cleaned = piece.strip(CJK_PARTICLES)
+            if len(cleaned) > 1:
+                found.append((match.start() + offset + piece.find(cleaned), cleaned))
+            offset += len(piece) + 1
+    return [term for _, term in sorted(found)]
+
+
+def heuristic_title(text: str, max_terms: int = 3, max_chars: int = 30) -> str:
+    """按词频提取关键词拼成标题，不调用LLM
+
+    Args:
+        text: 对话文本（通常为用户问题）
+        max_terms: 最多使用的关键词数
+        max_chars: 标题最大字符数
+    """
+    terms = extract_title_terms(text)
+    if not terms:
+        return text.strip()[:max_chars]
+    counts = Counter(term.lower() for term in terms)
+    unique = list(dict.fromkeys(terms))
+    # 按词频选出关键词，再按原文顺序拼接
+    top = sorted(unique, key=lambda term: -counts[term.lower()])[:max_terms]
+    return " ".join(term for term in unique if term in top)[:max_chars]
+
+
+def clean_title(raw: str) -> str:
+    """清理LLM返回的标题（兼容JSON格式与多余引号）"""
+    title = raw.strip()
+    try:
+        title_data = json.loads(title)
+        if isinstance(title_data, dict) and "title" in title_data:
+            title = str(title_data["title"])
+    except (ValueError, TypeError):
+        pass
+    return title.strip().strip("\"'“”《》").strip()
+
+
+@dataclass
+class TitleState:
+    """会话标题缓存条目"""
+    title: str
+    terms: List[str] = field(default_factory=list)
+
+
+class TitleGenerator:
+    """按会话缓存的后台标题生成器
+
+    Args:
+        mode: llm 或 heuristic
+        llm_factory: 返回非流式LLM实例的函数，llm 模式必需
+        topic_overlap_threshold: 新问题与标题关键词的重叠比例低于该值时视为话题切换，
+            0 表示只在首个问题时生成
+    """
+
+    def __init__(
+        self,
+        mode: str = "llm",
+        llm_factory: Optional[Callable[[], Any]] = None,
+        topic_overlap_threshold: float = 0.0,
+    ):
+        if mode not in ("llm", "heuristic"):
+            raise ValueError(f"不支持的标题生成模式: {mode}")
+        if mode == "llm" and llm_factory is None:
+            raise ValueError("llm 模式需要提供 llm_factory")
+        self.mode = mode
+        self.llm_factory = llm_factory
+        self.topic_overlap_threshold = topic_overlap_threshold
+
+        self._titles: Dict[str, TitleState] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        self.generated = 0
+        self.skipped = 0
+        self._generated_counter = REGISTRY.counter("conversation_titles_generated_total", "生成的会话标题数")
+        self._skipped_counter = REGISTRY.counter("conversation_titles_skipped_total", "沿用已缓存标题的次数")
+        self._latency = REGISTRY.histogram("conversation_title_seconds", "会话标题生成耗时")
+
+    def get(self, conversation_id: str) -> Optional[str]:
+        """获取缓存的标题"""
+        state = self._titles.get(conversation_id)
+        return state.title if state else None
+
+    def set(self, conversation_id: str, title: str, terms: Optional[List[str]] = None) -> None:
+        """写入标题缓存（如从持久化存储恢复）"""
+        self._titles[conversation_id] = TitleState(title=title, terms=terms or [])
+
+    def discard(self, conversation_id: str) -> None:
+        """删除会话的标题缓存，并取消进行中的生成任务"""
+        self._titles.pop(conversation_id, None)
+        task = self._tasks.pop(conversation_id, None)
+        if task is not None and not task.done():
+            # 会话存储可能在线程池中淘汰会话并调用本方法
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def needs_title(self, conversation_id: str, question: str) -> bool:
+        """判断是否需要（重新）生成标题：尚无标题，或新问题的话题与标题明显不同"""
+        if conversation_id in self._tasks:
+            return False
+        state = self._titles.get(conversation_id)
+        if state is None:
+            return True
+        if not self.topic_overlap_threshold or not state.terms:
+            return False
+        terms = extract_query_terms(question)
+        if not terms:
+            return False
+        overlap = len(set(terms) & set(state.terms)) / len(set(terms))
+        return overlap < self.topic_overlap_threshold
+
+    async def agenerate(self, text: str) -> str:
+        """生成标题，LLM调用失败时退化为关键词标题"""
+        if self.mode == "heuristic":
+            return heuristic_title(text)
+        try:
+            llm = self.llm_factory()
+            response = await llm.ainvoke(TITLE_PROMPT_TEMPLATE.format(chat_history=text))
+            title = clean_title(response.content)
+            return title or heuristic_title(text)
+        except Exception as e:
+            logger.warning("生成标题时出错: %s", e)
+            return heuristic_title(text)
+
+    async def _generate_and_store(self, conversation_id: str, text: str) -> str:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            title = await self.agenerate(text)
+            self._titles[conversation_id] = TitleState(title=title, terms=extract_query_terms(text))
+            self.generated += 1
+            self._generated_counter.inc()
+            self._latency.observe(loop.time() - start)
+            return title
+        finally:
+            self._tasks.pop(conversation_id, None)
+
+    def schedule(self, conversation_id: str, question: str) -> Optional[asyncio.Task]:
+        """需要时在后台任务中生成标题
+
+        Args:
+            conversation_id: 会话ID
+            question: 本轮用户问题
+
+        Returns:
+            Optional[asyncio.Task]: 生成任务，沿用已有标题时返回 None
+        """
+        if not self.needs_title(conversation_id, question):
+            self.skipped += 1
+            self._skipped_counter.inc()
+            return None
+        task = asyncio.create_task(self._generate_and_store(conversation_id, question))
+        self._tasks[conversation_id] = task
+        return task
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "titles": len(self._titles),
+            "pending": len(self._tasks),
+            "generated": self.generated,
+            "skipped": self.skipped,
+        }
@@ -0,0 +1,168 @@
+"""CPU资源划分
+
+仅有CPU的机器上，bge-m3 的 torch 线程、FAISS 的 OpenMP 线程与请求处理默认都会使用全部核心，
+查询与入库同时进行时相互抢占。config.yaml 的 resources 段按进程角色配置各子系统的线程数：
+
+    resources:
+      api:                  # API进程（INGESTION_MODE=inline 时也包括入库）
+        torch_threads: 4
+        faiss_threads: 2
+        thread_pool: 8
+        cpu_affinity: []
+      ingestion_worker:     # 独立的入库进程（INGESTION_MODE=worker）
+        torch_threads: 2
+        faiss_threads: 1
+        cpu_affinity: [6, 7]
+
+数值为 0、列表为空时保持库的默认行为；配置了 faiss_threads 时，未配置的 torch_threads 取进程可用的CPU数，
+避免 torch 随 OMP_NUM_THREADS 一起被限制。
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+DEFAULT_CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../config.yaml"))
+ROLES = ("api", "ingestion_worker")
+
+
+@dataclass
+class ResourceSettings:
+    """一个进程的CPU资源配置
+
+    Args:
+        torch_threads: torch intra-op 线程数（嵌入模型推理）
+        faiss_threads: FAISS OpenMP 线程数（向量检索与索引写入）
+        thread_pool: 事件循环默认线程池的线程数（检索、文件保存等 to_thread 调用）
+        cpu_affinity: 进程绑定的CPU编号
+    """
+    torch_threads: int = 0
+    faiss_threads: int = 0
+    thread_pool: int = 0
+    cpu_affinity: List[int] = field(default_factory=list)
+
+
+def load_resource_settings(role: str, path: Optional[str] = None) -> ResourceSettings:
+    """读取某个角色的资源配置，配置文件或配置段不存在时返回默认值
+
+    Args:
+        role: api 或 ingestion_worker
+        path: 配置文件路径，默认为环境变量 RESOURCE_CONFIG 或仓库根目录的 config.yaml
+    """
+    if role not in ROLES:
+        raise ValueError(f"未知的进程角色: {role}，可选 {', '.join(ROLES)}")
+    path = path or os.getenv("RESOURCE_CONFIG", DEFAULT_CONFIG_PATH)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return ResourceSettings()
+    section = (config.get("resources") or {}).get(role) or {}
+    unknown = set(section) - set(ResourceSettings.__dataclass_fields__)
+    if unknown:
+        raise ValueError(f"resources.{role} 中有未知的配置项: {', '.join(sorted(unknown))}")
+    return ResourceSettings(
+        torch_threads=int(section.get("torch_threads", 0)),
+        faiss_threads=int(section.get("faiss_threads", 0)),
+        thread_pool=int(section.get("thread_pool", 0)),
+        cpu_affinity=[int(cpu) for cpu in section.get("cpu_affinity") or []],
+    )
+
+
+def _set_process_affinity(cpus: List[int]) -> None:
+    """设置进程内所有线程的CPU亲和性
+
+    sched_setaffinity(0) 只作用于调用它的线程，在线程池中调用时主线程与其他线程不受影响；
+    这里逐个设置 /proc/self/task 中的线程，之后创建的线程继承创建者的亲和性
+    """
+    try:
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        thread_ids = [0]
+    for tid in thread_ids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except ProcessLookupError:
+            # 线程已经退出
+            pass
+
+
+def apply_process_settings(settings: ResourceSettings) -> None:
+    """应用进程级的配置：CPU亲和性与 FAISS 线程数，需在导入 faiss 之前调用
+
+    FAISS 的线程数由 OMP_NUM_THREADS 决定：OpenMP 在加载时读取该变量作为所有线程的默认值，
+    而 omp_set_num_threads 只影响调用它的线程，检索在线程池中执行，因此需在导入 faiss 之前设置。
+    该变量同样是 torch 的默认线程数，由 apply_torch_settings 显式设置 torch 的线程数
+    """
+    if settings.cpu_affinity and hasattr(os, "sched_setaffinity"):
+        _set_process_affinity(settings.cpu_affinity)
+    if settings.faiss_threads:
+        if "faiss" in sys.modules:
+            print("警告: faiss 已经导入，faiss_threads 只对当前线程生效")
+        os.environ["OMP_NUM_THREADS"] = str(settings.faiss_threads)
+        try:
+            import faiss
+
+            faiss.omp_set_num_threads(settings.faiss_threads)
+        except ImportError:
+            pass
+
+
+def _available_cpus() -> int:
+    """进程可用的CPU数，设置了亲和性时为绑定的CPU数"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(os.getpid()))
+    return os.cpu_count() or 1
+
+
+def apply_torch_settings(settings: ResourceSettings) -> None:
+    """设置 torch 的线程数，在加载嵌入模型之前调用
+
+    torch 同样以 OMP_NUM_THREADS 作为默认线程数，apply_process_settings 为 FAISS 设置该变量后，
+    未配置 torch_threads 的 torch 也会只用 faiss_threads 个线程，此时显式设置为进程可用的CPU数
+    """
+    torch_threads = settings.torch_threads or (_available_cpus() if settings.faiss_threads else 0)
+    if torch_threads:
+        try:
+            import torch
+
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+
+
+def apply_resource_settings(settings: ResourceSettings) -> Dict[str, Any]:
+    """在加载嵌入模型与索引之前应用全部资源配置，供独立进程在主线程启动时调用
+
+    Returns:
+        dict: 实际生效的配置
+    """
+    apply_process_settings(settings)
+    apply_torch_settings(settings)
+    applied = describe_cpu_usage(settings)
+    print(f"已应用CPU资源配置: {applied}")
+    return applied
+
+
+def configure_default_executor(settings: ResourceSettings, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    """按 thread_pool 设置事件循环的默认线程池，未配置时保持 asyncio 的默认大小"""
+    if settings.thread_pool:
+        loop = loop or asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=settings.thread_pool, thread_name_prefix="api"))
+
+
+def describe_cpu_usage(settings: ResourceSettings) -> Dict[str, Any]:
+    """配置与各库当前实际使用的线程数，未加载的库不列出"""
+    usage: Dict[str, Any] = {"configured": asdict(settings), "cpu_count": os.cpu_count()}
+    if hasattr(os, "sched_getaffinity"):
+        # 按进程号查询主线程，而不是调用本函数的线程池线程
+        usage["cpu_affinity"] = sorted(os.sched_getaffinity(os.getpid()))
+    if "torch" in sys.modules:
+        usage["torch_threads"] = sys.modules["torch"].get_num_threads()
+    if "faiss" in sys.modules:
+        usage["faiss_threads"] = sys.modules["faiss"].omp_get_max_threads()
+    return usage
@@ -0,0 +1,249 @@
+"""CPU资源划分自动调优
+
+在本机上对 config.yaml 中 resources 段的若干种划分分别测量：查询进程（API角色，并发执行
+查询嵌入 + FAISS检索）与入库进程（ingestion_worker角色，批量嵌入文档块）同时运行时的
+查询QPS与入库吞吐，按权重打分后给出最佳划分对应的配置。
+
+每种划分启动两个独立进程，各自在加载模型之前应用资源配置（与服务启动时相同），
+模型加载完成后同时开始计时，测量的是两类负载互相争抢CPU时的表现。
+
+运行方式:
+    python -m rag.monitoring.cpu_autotune --duration 20 --concurrency 8
+    python -m rag.monitoring.cpu_autotune --weight 0.8     # 更看重查询QPS
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence
+
+from rag.cpu_resources import ResourceSettings, apply_resource_settings
+
+DEFAULT_MODEL = os.path.abspath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../../models/embedding_model/bge-m3"
+))
+QUERIES = [
+    "APT29 常用的初始访问手段有哪些？",
+    "Lazarus 组织针对金融机构的攻击链",
+    "Which malware families use DLL side-loading for persistence?",
+    "CosmicDuke 的命令与控制通信方式",
+]
+CHUNK_TEXT = (
+    "The threat actor delivered spearphishing attachments containing a malicious macro, "
+    "which dropped a loader that established persistence through a scheduled task. "
+    "攻击者随后通过合法云服务进行命令与控制通信，并横向移动到域控制器。"
+)
+
+
+@dataclass
+class Split:
+    """一种CPU划分：查询进程与入库进程的资源配置"""
+    name: str
+    api: ResourceSettings
+    ingestion_worker: ResourceSettings
+
+
+def candidate_splits(cpus: Sequence[int], pin: bool = True) -> List[Split]:
+    """生成候选划分
+
+    第一个候选为库的默认行为（两个进程都使用全部核心），其余候选把核心分成两组，
+    入库进程使用 k 个核心、查询进程使用剩余核心，FAISS 线程数在 1 与查询核心数的一半之间取值
+
+    Args:
+        cpus: 可用的CPU编号
+        pin: 是否按划分绑定CPU亲和性
+    """
+    cpus = sorted(cpus)
+    splits = [Split("default", ResourceSettings(), ResourceSettings())]
+    for ingest_cores in range(1, len(cpus)):
+        query_cores = len(cpus) - ingest_cores
+        for faiss_threads in sorted({1, max(1, query_cores // 2)}):
+            splits.append(Split(
+                f"api={query_cores}/faiss={faiss_threads}/ingest={ingest_cores}",
+                ResourceSettings(
+                    torch_threads=query_cores,
+                    faiss_threads=faiss_threads,
+                    thread_pool=max(4, query_cores * 2),
+                    cpu_affinity=cpus[:query_cores] if pin else [],
+                ),
+                ResourceSettings(
+                    torch_threads=ingest_cores,
+                    faiss_threads=1,
+                    cpu_affinity=cpus[query_cores:] if pin else [],
+                ),
+            ))
+    return splits
+
+
+def score_results(results: List[Dict], weight: float = 0.5) -> List[Dict]:
+    """按 weight * 归一化QPS + (1 - weight) * 归一化入库吞吐 打分，按得分从高到低排序"""
+    max_qps = max((r["qps"] for r in results), default=0) or 1
+    max_ingest = max((r["chunks_per_second"] for r in results), default=0) or 1
+    scored = [
+        {**r, "score": weight * r["qps"] / max_qps + (1 - weight) * r["chunks_per_second"] / max_ingest}
+        for r in results
+    ]
+    return sorted(scored, key=lambda r: r["score"], reverse=True)
+
+
+def format_config(split: Split) -> str:
+    """划分对应的 config.yaml resources 段"""
+    lines = ["resources:"]
+    for role in ("api", "ingestion_worker"):
+        settings = asdict(getattr(split, role))
+        if role == "ingestion_worker":
+            settings.pop("thread_pool")
+        lines.append(f"  {role}:")
+        lines.extend(f"    {key}: {value}" for key, value in settings.items())
+    return "\n".join(lines)
+
+
+def _load_embeddings(model: str):
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=model)
+
+
+def _query_process(settings, model, num_docs, concurrency, duration, barrier, results):
+    apply_resource_settings(settings)
+    import faiss
+    import numpy as np
+
+    embeddings = _load_embeddings(model)
+    dim = len(embeddings.embed_query(QUERIES[0]))
+    index = faiss.IndexFlatL2(dim)
+    index.add(np.random.default_rng(0).standard_normal((num_docs, dim)).astype(np.float32))
+
+    latencies: List[float] = []
+    lock = threading.Lock()
+    barrier.wait()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset: int):
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            vector = np.asarray([embeddings.embed_query(QUERIES[i % len(QUERIES)])], dtype=np.float32)
+            index.search(vector, 4)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+            i += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    results.put(("api", {
+        "qps": len(latencies) / duration,
+        "p95_ms": latencies[max(0, math.ceil(0.95 * len(latencies)) - 1)] * 1000 if latencies else None,
+    }))
+
+
+def _ingest_process(settings, model, batch_size, chunk_chars, duration, barrier, results):
+    apply_resource_settings(settings)
+    embeddings = _load_embeddings(model)
+    chunk = (CHUNK_TEXT * (chunk_chars // len(CHUNK_TEXT) + 1))[:chunk_chars]
+    batch = [f"{i} {chunk}" for i in range(batch_size)]
+
+    chunks = 0
+    barrier.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        embeddings.embed_documents(batch)
+        chunks += len(batch)
+    results.put(("ingestion_worker", {"chunks_per_second": chunks / duration}))
+
+
+def run_split(split: Split, model: str, duration: float, concurrency: int, num_docs: int,
+              batch_size: int, chunk_chars: int, startup_timeout: float = 600) -> Dict:
+    """在两个独立进程中同时运行查询与入库负载，返回该划分的测量结果
+
+    Raises:
+        RuntimeError: 子进程异常退出（如模型加载失败）
+        TimeoutError: 超过 startup_timeout + duration 仍未得到全部结果
+    """
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(2)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_query_process, name="api",
+                        args=(split.api, model, num_docs, concurrency, duration, barrier, results)),
+        context.Process(target=_ingest_process, name="ingestion_worker",
+                        args=(split.ingestion_worker, model, batch_size, chunk_chars, duration, barrier, results)),
+    ]
+    for process in processes:
+        process.start()
+    deadline = time.monotonic() + startup_timeout + duration
+    measured: Dict[str, Dict] = {}
+    try:
+        while len(measured) < len(processes):
+            try:
+                role, result = results.get(timeout=1)
+                measured[role] = result
+                continue
+            except queue.Empty:
+                pass
+            # 一个进程异常退出时另一个会一直阻塞在 barrier 上，不再等待
+            failed = [p for p in processes if p.name not in measured and p.exitcode not in (None, 0)]
+            if failed:
+                raise RuntimeError(", ".join(f"{p.name} 进程异常退出（exitcode={p.exitcode}）" for p in failed))
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"等待测量结果超时（{startup_timeout + duration:.0f}s）")
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+    return {"name": split.name, **measured["api"], **measured["ingestion_worker"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询QPS与入库吞吐的CPU资源划分自动调优")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="嵌入模型路径或名称")
+    parser.add_argument("--duration", type=float, default=20, help="每种划分的测量时长（秒）")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发查询数")
+    parser.add_argument("--num-docs", type=int, default=20000, help="检索使用的随机向量数")
+    parser.add_argument("--batch-size", type=int, default=16, help="入库每批嵌入的文档块数")
+    parser.add_argument("--chunk-chars", type=int, default=3000, help="文档块字符数，与入库分块大小一致")
+    parser.add_argument("--weight", type=float, default=0.5, help="查询QPS的权重，其余为入库吞吐的权重")
+    parser.add_argument("--no-pin", action="store_true", help="只划分线程数，不绑定CPU亲和性")
+    parser.add_argument("--max-splits", type=int, default=None, help="最多测量的候选划分数")
+    parser.add_argument("--startup-timeout", type=float, default=600, help="子进程加载模型的最长等待时间（秒）")
+    args = parser.parse_args()
+
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    splits = candidate_splits(cpus, pin=not args.no_pin)[:args.max_splits]
+    print(f"可用CPU: {len(cpus)} 个，候选划分: {len(splits)} 种，每种测量 {args.duration}s")
+
+    results = []
+    for split in splits:
+        try:
+            result = run_split(split, args.model, args.duration, args.concurrency, args.num_docs,
+                               args.batch_size, args.chunk_chars, args.startup_timeout)
+        except (RuntimeError, TimeoutError) as e:
+            print(f"  {split.name:<32} 测量失败: {str(e)}")
+            continue
+        print(f"  {result['name']:<32} QPS {result['qps']:8.2f}  p95 {result['p95_ms'] or 0:8.1f} ms  "
+              f"入库 {result['chunks_per_second']:8.2f} 块/s")
+        results.append(result)
+
+    if not results:
+        print("没有成功测量的划分")
+        return
+    ranked = score_results(results, args.weight)
+    print(f"\n{'划分':<32} {'得分':>6} {'QPS':>8} {'入库块/s':>10}")
+    for r in ranked:
+        print(f"{r['name']:<32} {r['score']:6.3f} {r['qps']:8.2f} {r['chunks_per_second']:10.2f}")
+    best = next(s for s in splits if s.name == ranked[0]["name"])
+    print(f"\n最佳划分（查询权重 {args.weight}）对应的 config.yaml 配置:\n{format_config(best)}")
+
+
+if __name__ == "__main__":
+    main()
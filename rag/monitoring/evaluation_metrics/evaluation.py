@@ -1,28 +1,362 @@
+"""RAG评测：对比纯文本RAG与知识图谱增强RAG
+
+查询通过有界的asyncio并发池执行，生成结果按 (查询, 上下文哈希, 模型) 缓存到磁盘，
+重复评测同一查询集时不会再次调用LLM。结果DataFrame随每条查询完成增量构建。
+
+离线运行:
+    python -m rag.monitoring.evaluation_metrics.evaluation --queries queries.jsonl --stub
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Union
+
 import pandas as pd
+from langchain_core.documents import Document
+
+# 检索函数签名: 查询文本 -> 文档列表
+RetrieverFunc = Callable[[str], List[Document]]
+# 生成函数签名: (查询文本, 上下文) -> 回答
+GeneratorFunc = Callable[[str, str], Awaitable[str]]
+
+GENERATION_PROMPT = """你是一个专业的网络威胁情报分析助手，请基于以下上下文回答问题。
+若上下文不足以回答，请声明「根据现有资料」。
+
+上下文:
+{context}
+
+问题: {query}
+"""
+
+
+def _tokenize(text: str) -> List[str]:
+    """简单分词：英文按词，中文按字"""
+    return re.findall(r"[A-Za-z0-9_\-\.]+|[一-鿿]", text.lower())
+
+
+def build_context(docs: List[Document]) -> str:
+    """将召回文档拼接为上下文"""
+    parts = []
+    for i, doc in enumerate(docs, 1):
+        source = doc.metadata.get("source", "未知来源")
+        parts.append(f"[文档{i}] 来源: {source}\n内容: {doc.page_content}")
+    return "\n\n".join(parts)
+
+
+class GenerationCache:
+    """生成结果的磁盘缓存，每条结果一个JSON文件
+
+    Args:
+        cache_dir: 缓存目录
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(query: str, context: str, model: str) -> str:
+        context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        payload = json.dumps([query, context_hash, model], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["answer"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, answer: str, **extra) -> None:
+        # 先写临时文件再原子替换，避免并发写入产生半截文件
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"answer": answer, **extra}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
 
 class EvaluationMetrics:
-    def __init__(self):
-        pass
+    """RAG评测运行器
+
+    Args:
+        retrievers: 评测模式到检索函数的映射，例如 {"text_only": ..., "graph_enhanced": ...}
+        model_name: 生成模型名称，同时作为缓存键的一部分
+        api_base: OpenAI兼容API地址，可指向本地模拟服务
+        api_key: API密钥
+        generator: 自定义异步生成函数，提供时不再创建ChatOpenAI
+        cache_dir: 生成结果缓存目录，为None时不缓存
+        max_concurrency: 最大并发查询数
+        temperature: 生成温度，评测默认使用0以保证可复现
+    """
+
+    def __init__(
+        self,
+        retrievers: Optional[Dict[str, RetrieverFunc]] = None,
+        model_name: Optional[str] = None,
+        api_base: Optional[str] = None,
+        api_key: Optional[str] = None,
+        generator: Optional[GeneratorFunc] = None,
+        cache_dir: Optional[str] = ".eval_cache",
+        max_concurrency: int = 8,
+        temperature: float = 0.0,
+    ):
+        self.retrievers = retrievers or {}
+        self.model_name = model_name or os.getenv("BASE_MODEL") or "stub-model"
+        self.api_base = api_base or os.getenv("API_BASE")
+        self.api_key = api_key or os.getenv("API_KEY")
+        self.temperature = temperature
+        self.max_concurrency = max_concurrency
+        self.cache = GenerationCache(cache_dir) if cache_dir else None
+        self.generator = generator or self._llm_generate
+        self._llm = None
+
+    async def _llm_generate(self, query: str, context: str) -> str:
+        """使用OpenAI兼容接口生成回答"""
+        if self._llm is None:
+            from langchain_openai import ChatOpenAI
+
+            self._llm = ChatOpenAI(
+                model=self.model_name,
+                temperature=self.temperature,
+                openai_api_base=self.api_base,
+                openai_api_key=self.api_key or "EMPTY",
+            )
+        response = await self._llm.ainvoke(GENERATION_PROMPT.format(context=context, query=query))
+        return response.content
+
+    async def _generate(self, query: str, context: str) -> tuple:
+        """生成回答，命中缓存时直接返回
+
+        Returns:
+            tuple: (回答, 是否命中缓存)
+        """
+        if self.cache is None:
+            return await self.generator(query, context), False
+
+        key = GenerationCache.make_key(query, context, self.model_name)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, True
 
-    def evaluate(self, query, response):
-        pass
+        answer = await self.generator(query, context)
+        self.cache.put(key, answer, query=query, model=self.model_name)
+        return answer, False
+
+    def evaluate(self, query: str, response: str, context: str = "", reference: Optional[str] = None) -> Dict[str, Any]:
+        """计算单条回答的指标
+
+        context_overlap: 回答中出现在上下文里的词占比，用作忠实度的近似
+        reference_f1: 提供参考答案时，回答与参考答案的词级F1
+        """
+        answer_tokens = _tokenize(response)
+        metrics = {
+            "answer_chars": len(response),
+            "context_chars": len(context),
+            "context_overlap": 0.0,
+        }
+        if answer_tokens and context:
+            context_tokens = set(_tokenize(context))
+            metrics["context_overlap"] = sum(t in context_tokens for t in answer_tokens) / len(answer_tokens)
+
+        if reference is not None:
+            reference_tokens = _tokenize(reference)
+            common = sum(min(answer_tokens.count(t), reference_tokens.count(t)) for t in set(reference_tokens))
+            if common == 0:
+                metrics["reference_f1"] = 0.0
+            else:
+                precision = common / len(answer_tokens)
+                recall = common / len(reference_tokens)
+                metrics["reference_f1"] = 2 * precision * recall / (precision + recall)
+        return metrics
+
+    async def _evaluate_query(self, item: Dict[str, Any], mode: str) -> Dict[str, Any]:
+        query = item["query"]
+        retriever = self.retrievers[mode]
+
+        start = time.perf_counter()
+        docs = await asyncio.to_thread(retriever, query)
+        retrieval_seconds = time.perf_counter() - start
+
+        context = build_context(docs)
+        start = time.perf_counter()
+        try:
+            answer, cached = await self._generate(query, context)
+            error = None
+        except Exception as e:
+            answer, cached, error = "", False, str(e)
+        generation_seconds = time.perf_counter() - start
+
+        row = {
+            "query": query,
+            "mode": mode,
+            "model": self.model_name,
+            "num_docs": len(docs),
+            "retrieval_seconds": retrieval_seconds,
+            "generation_seconds": generation_seconds,
+            "cached": cached,
+            "error": error,
+            "answer": answer,
+        }
+        row.update(self.evaluate(query, answer, context, item.get("reference")))
+        return row
+
+    async def aiter_evaluation(
+        self, test_queries: List[Union[str, Dict[str, Any]]], mode: str = "text_only"
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """并发评测查询集，按完成顺序逐条产出结果
+
+        Args:
+            test_queries: 查询列表，元素为字符串或包含 query/reference 的字典
+            mode: 评测模式，对应 retrievers 中的键
+        """
+        if mode not in self.retrievers:
+            raise ValueError(f"未配置评测模式 {mode} 的检索函数，可用模式: {list(self.retrievers)}")
+
+        items = [q if isinstance(q, dict) else {"query": q} for q in test_queries]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(item):
+            async with semaphore:
+                return await self._evaluate_query(item, mode)
+
+        tasks = [asyncio.create_task(bounded(item)) for item in items]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def arun_evaluation_comparison(
+        self,
+        test_queries: List[Union[str, Dict[str, Any]]],
+        mode: str = "text_only",
+        on_update: Optional[Callable[[pd.DataFrame], None]] = None,
+        output_path: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """运行一种模式的评测并增量构建DataFrame
+
+        Args:
+            test_queries: 查询列表
+            mode: 评测模式
+            on_update: 每完成一条查询时以当前DataFrame回调
+            output_path: 逐行追加写入的CSV路径
+        """
+        rows = []
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+        async for row in self.aiter_evaluation(test_queries, mode):
+            rows.append(row)
+            if output_path:
+                pd.DataFrame([row]).to_csv(
+                    output_path, mode="a", header=len(rows) == 1, index=False, encoding="utf-8"
+                )
+            if on_update:
+                on_update(pd.DataFrame(rows))
+        return pd.DataFrame(rows)
 
     # 测试脚本示例：对比纯文本RAG vs 知识图谱增强RAG
     def run_evaluation_comparison(self, test_queries, mode='text_only'):
-        results = []
-        for query in test_queries:
-            if mode == 'text_only':
-                context = text_retriever(query)
-            else:
-                context = graph_enhanced_retriever(query)
-                
-            report = generator(query, context)
-            results.append(calculate_metrics(report))
-        return pd.DataFrame(results)
+        return asyncio.run(self.arun_evaluation_comparison(test_queries, mode))
+
+    async def arun_all_metrics(self, params: dict) -> Dict[str, pd.DataFrame]:
+        """对所有模式运行评测，返回各模式结果与汇总对比"""
+        modes = params.get("modes") or list(self.retrievers)
+        results = {}
+        for mode in modes:
+            results[mode] = await self.arun_evaluation_comparison(
+                params["test_queries"],
+                mode,
+                on_update=params.get("on_update"),
+                output_path=params.get("output_paths", {}).get(mode),
+            )
+
+        summary_columns = ["num_docs", "retrieval_seconds", "generation_seconds", "context_overlap", "cached"]
+        if any("reference_f1" in df for df in results.values()):
+            summary_columns.append("reference_f1")
+        results["summary"] = pd.DataFrame({
+            mode: df.reindex(columns=summary_columns).mean(numeric_only=True)
+            for mode, df in results.items()
+        }).T
+        return results
 
     def run_all_metrics(self, params: dict):
         # 执行对比测试
-        baseline_df = self.run_evaluation_comparison(params['test_queries'], 'text_only')
-        enhanced_df = self.run_evaluation_comparison(params['test_queries'], 'graph_enhanced')
+        return asyncio.run(self.arun_all_metrics(params))
+
+
+def load_queries(path: str) -> List[Dict[str, Any]]:
+    """加载查询集，支持每行一个JSON对象或每行一条纯文本查询"""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                queries.append(item if isinstance(item, dict) else {"query": str(item)})
+            except ValueError:
+                queries.append({"query": line})
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="纯文本RAG评测")
+    parser.add_argument("--queries", required=True, help="查询集文件（jsonl或纯文本）")
+    parser.add_argument("--stub", action="store_true", help="启动本地OpenAI兼容模拟服务进行离线评测")
+    parser.add_argument("--stub-port", type=int, default=18000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cache-dir", default=".eval_cache")
+    parser.add_argument("--output-dir", default="eval_results")
+    args = parser.parse_args()
+
+    from rag.vector.vector_database import get_vector_database_instance
+
+    vector_database = get_vector_database_instance()
+    # 图检索器尚未实现，命令行只评测纯文本模式；对比其他模式时通过 retrievers 参数注入
+    retrievers = {"text_only": vector_database.query_vector_database}
+
+    stub = None
+    api_base = None
+    if args.stub:
+        from rag.monitoring.openai_stub import StubServer
+
+        stub = StubServer(port=args.stub_port).start()
+        api_base = stub.api_base
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    runner = EvaluationMetrics(
+        retrievers=retrievers,
+        model_name="stub-model" if args.stub else None,
+        api_base=api_base,
+        api_key="stub" if args.stub else None,
+        cache_dir=args.cache_dir,
+        max_concurrency=args.concurrency,
+    )
+    try:
+        results = runner.run_all_metrics({
+            "test_queries": load_queries(args.queries),
+            "output_paths": {mode: os.path.join(args.output_dir, f"{mode}.csv") for mode in retrievers},
+            "on_update": lambda df: print(f"已完成 {len(df)} 条"),
+        })
+        print(results["summary"])
+        results["summary"].to_csv(os.path.join(args.output_dir, "summary.csv"), encoding="utf-8")
+    finally:
+        if stub:
+            stub.stop()
 
 
+if __name__ == "__main__":
+    main()
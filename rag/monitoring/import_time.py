@@ -0,0 +1,136 @@
+"""导入耗时预算
+
+在独立的子进程中以 `python -X importtime` 导入各入口模块，统计累计导入耗时与最慢的依赖，
+并检查入口模块没有在导入时加载重量级依赖（torch、FAISS、langchain_community、copilotkit等，
+这些依赖应由需要它们的组件在启动阶段或首次使用时加载）。
+
+运行方式:
+    python -m rag.monitoring.import_time            # 检查全部预算，超出时退出码为1
+    python -m rag.monitoring.import_time rag.api.server --top 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+# 入口模块的导入耗时预算（秒），为子进程冷启动导入的累计耗时，留有一定余量
+IMPORT_BUDGETS: Dict[str, float] = {
+    "rag.api.server": 1.5,
+    "rag.api.chat_api.chat_api": 1.5,
+    "rag.chains.conversation_chain": 1.2,
+    "rag.api.resources": 0.2,
+    "rag.chains.session_backend": 0.2,
+    "rag.monitoring.runtime_metrics": 0.1,
+}
+
+# 入口模块导入时不应加载的重量级依赖
+HEAVY_MODULES = (
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "faiss",
+    "langchain_community",
+    "langchain.agents",
+    "langchain.memory",
+    "langchain_openai",
+    "langchain_ollama",
+    "copilotkit",
+    "tiktoken",
+)
+
+# 测量时关闭的可选组件：CopilotKit 端点启用时必然导入 copilotkit
+MEASURE_ENV = {"COPILOTKIT_ENABLED": "false"}
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """解析 -X importtime 的输出，返回 [{module, self_us, cumulative_us, depth}]"""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            # 表头行
+            continue
+        name = parts[2].rstrip()
+        module = name.lstrip(" ")
+        records.append({
+            "module": module,
+            "self_us": self_us,
+            "cumulative_us": cumulative_us,
+            "depth": (len(name) - len(module) - 1) // 2,
+        })
+    return records
+
+
+def measure_import(module: str, top: int = 10, env: Optional[Dict[str, str]] = None) -> Dict:
+    """在新的子进程中导入模块并统计耗时
+
+    Args:
+        module: 模块名
+        top: 返回自身耗时最长的依赖个数
+        env: 额外的环境变量
+
+    Returns:
+        dict: 累计导入秒数、最慢的依赖与导入时加载的重量级依赖
+    """
+    code = (
+        f"import sys, json; import {module}; "
+        f"print(json.dumps([m for m in {list(HEAVY_MODULES)!r} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **MEASURE_ENV, **(env or {})},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败: {result.stderr.strip().splitlines()[-1]}")
+    records = parse_importtime(result.stderr)
+    total = next((r["cumulative_us"] for r in records if r["module"] == module and r["depth"] == 0), 0)
+    slowest = sorted(records, key=lambda r: r["self_us"], reverse=True)[:top]
+    return {
+        "module": module,
+        "seconds": total / 1e6,
+        "heavy_modules": json.loads(result.stdout.strip().splitlines()[-1]),
+        "slowest": [{"module": r["module"], "self_ms": r["self_us"] / 1000} for r in slowest],
+    }
+
+
+def check_budgets(budgets: Dict[str, float] = IMPORT_BUDGETS, top: int = 10) -> List[Dict]:
+    """测量各模块并标记是否超出预算"""
+    reports = []
+    for module, budget in budgets.items():
+        report = measure_import(module, top=top)
+        report["budget"] = budget
+        report["ok"] = report["seconds"] <= budget and not report["heavy_modules"]
+        reports.append(report)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口模块导入耗时预算检查")
+    parser.add_argument("modules", nargs="*", help="要测量的模块，默认为全部预算中的模块")
+    parser.add_argument("--top", type=int, default=10, help="列出自身耗时最长的依赖个数")
+    args = parser.parse_args()
+
+    budgets = {m: IMPORT_BUDGETS.get(m, float("inf")) for m in args.modules} if args.modules else IMPORT_BUDGETS
+    reports = check_budgets(budgets, top=args.top)
+    for report in reports:
+        status = "OK" if report["ok"] else "超出预算"
+        print(f"[{status}] {report['module']}: {report['seconds']:.3f}s（预算 {report['budget']}s）")
+        if report["heavy_modules"]:
+            print(f"    导入时加载了重量级依赖: {', '.join(report['heavy_modules'])}")
+        for item in report["slowest"]:
+            print(f"    {item['self_ms']:8.1f} ms  {item['module']}")
+    sys.exit(0 if all(r["ok"] for r in reports) else 1)
+
+
+if __name__ == "__main__":
+    main()
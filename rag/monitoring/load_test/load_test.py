@@ -0,0 +1,354 @@
+"""流式对话接口压测
+
+启动本地OpenAI兼容模拟服务（openai_stub），以 API_BASE 指向模拟服务的方式在子进程中启动 FastAPI 应用，
+再由 N 个并发客户端持续请求 /chat/stream（SSE）或 /copilotkit_remote，统计：
+
+- 吞吐：完成的请求数/秒
+- 首token时间（TTFT）：从发出请求到收到第一个token帧
+- token间隔：相邻两个token帧之间的时间（服务端合并token帧时为帧间隔）
+- 服务端进程的CPU占用与内存（RSS）
+
+运行方式:
+    python -m rag.monitoring.load_test.load_test --concurrency 32 --requests 500 --tokens-per-second 50
+也可以用 --url 压测已经启动的服务（此时需用 --pid 指定服务进程才能采集CPU与内存）。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - 取决于运行环境
+    psutil = None
+
+DEFAULT_MESSAGE = "APT29 常用的初始访问手段有哪些？"
+
+
+@dataclass
+class RequestResult:
+    """单个请求的测量结果"""
+
+    ok: bool
+    status: int = 0
+    ttft: Optional[float] = None
+    total: float = 0.0
+    tokens: int = 0
+    inter_token: List[float] = field(default_factory=list)
+    error: str = ""
+
+
+def percentiles(values: Sequence[float], points: Sequence[int] = (50, 90, 99)) -> Dict[str, float]:
+    """最近秩法计算百分位数，单位为毫秒"""
+    if not values:
+        return {f"p{p}": 0.0 for p in points}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        result[f"p{p}"] = round(ordered[index] * 1000, 2)
+    return result
+
+
+class ProcessSampler:
+    """周期采样进程的CPU时间与常驻内存，优先使用 psutil，否则读取 /proc（仅Linux）
+
+    Args:
+        pid: 被采样的进程ID
+        interval: 采样间隔（秒）
+    """
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._start_cpu = 0.0
+        self._start_wall = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._process = psutil.Process(pid) if psutil is not None else None
+
+    def _cpu_seconds(self) -> float:
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime 与 stime 为第14、15个字段（去掉 pid 与进程名后的第12、13个）
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def _rss_bytes(self) -> int:
+        if self._process is not None:
+            return self._process.memory_info().rss
+        with open(f"/proc/{self.pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    async def _run(self) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, self._rss_bytes())
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._start_cpu = self._cpu_seconds()
+        self._start_wall = time.perf_counter()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        wall = time.perf_counter() - self._start_wall
+        cpu = self._cpu_seconds() - self._start_cpu
+        rss = self._rss_bytes()
+        return {
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(cpu / wall * 100, 1) if wall else 0.0,
+            "rss_mb": round(rss / 2**20, 1),
+            "peak_rss_mb": round(max(self.peak_rss, rss) / 2**20, 1),
+        }
+
+
+async def chat_stream_request(client: httpx.AsyncClient, url: str, message: str, client_id: str) -> RequestResult:
+    """请求 /chat/stream 并逐帧记录token到达时间"""
+    start = time.perf_counter()
+    last_token = None
+    result = RequestResult(ok=False)
+    try:
+        async with client.stream(
+            "POST", f"{url}/chat/stream", json={"message": message}, headers={"X-Client-ID": client_id}
+        ) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                result.error = (await response.aread()).decode("utf-8", "replace")[:200]
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                try:
+                    event = json.loads(line[len("data: "):])
+                except ValueError:
+                    continue
+                if not isinstance(event, dict):
+                    continue
+                if "error" in event:
+                    result.error = str(event["error"])
+                    return result
+                if event.get("type") != "conversation":
+                    continue
+                now = time.perf_counter()
+                if last_token is None:
+                    result.ttft = now - start
+                else:
+                    result.inter_token.append(now - last_token)
+                last_token = now
+                result.tokens += 1
+        result.ok = result.ttft is not None
+    except httpx.HTTPError as e:
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        result.total = time.perf_counter() - start
+    return result
+
+
+async def copilot_request(client: httpx.AsyncClient, url: str, message: str, client_id: str) -> RequestResult:
+    """调用 /copilotkit_remote 的 chatWithAI 动作，动作结果一次性返回，TTFT 即完整响应时间"""
+    start = time.perf_counter()
+    result = RequestResult(ok=False)
+    try:
+        response = await client.post(
+            f"{url}/copilotkit_remote/actions/execute",
+            json={"name": "chatWithAI", "arguments": {"message": message}},
+            headers={"X-Client-ID": client_id},
+        )
+        result.status = response.status_code
+        result.ok = response.status_code == 200
+        if not result.ok:
+            result.error = response.text[:200]
+    except httpx.HTTPError as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.total = time.perf_counter() - start
+    if result.ok:
+        result.ttft = result.total
+        result.tokens = 1
+    return result
+
+
+TARGETS = {"chat": chat_stream_request, "copilot": copilot_request}
+
+
+async def run_load_test(
+    url: str,
+    concurrency: int = 16,
+    requests: int = 100,
+    target: str = "chat",
+    message: str = DEFAULT_MESSAGE,
+    server_pid: Optional[int] = None,
+    timeout: float = 120.0,
+) -> dict:
+    """以固定并发数发送请求并汇总结果
+
+    Args:
+        url: 被测服务地址，如 http://127.0.0.1:8000
+        concurrency: 并发客户端数
+        requests: 请求总数
+        target: chat（/chat/stream）或 copilot（/copilotkit_remote）
+        message: 请求的问题
+        server_pid: 被测服务进程ID，提供时采集CPU与内存
+        timeout: 单个请求的超时时间（秒）
+
+    Returns:
+        dict: 吞吐、TTFT与token间隔百分位、错误统计及服务端资源占用
+    """
+    request_func = TARGETS[target]
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    results: List[RequestResult] = []
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+
+        async def worker(worker_id: int) -> None:
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results.append(await request_func(client, url, message, f"load-test-{worker_id}"))
+
+        sampler = ProcessSampler(server_pid) if server_pid else None
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        server = await sampler.stop() if sampler else {}
+
+    succeeded = [r for r in results if r.ok]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            key = str(r.status) if r.status and r.status != 200 else (r.error.split(":")[0] or "no_tokens")
+            errors[key] = errors.get(key, 0) + 1
+    return {
+        "target": target,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "succeeded": len(succeeded),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(succeeded) / elapsed, 2) if elapsed else 0.0,
+        "tokens_per_second": round(sum(r.tokens for r in succeeded) / elapsed, 2) if elapsed else 0.0,
+        "ttft_ms": percentiles([r.ttft for r in succeeded]),
+        "inter_token_ms": percentiles([gap for r in succeeded for gap in r.inter_token]),
+        "latency_ms": percentiles([r.total for r in succeeded]),
+        "server": server,
+    }
+
+
+def start_app_server(port: int, api_base: str, extra_env: Optional[Dict[str, str]] = None,
+                     startup_timeout: float = 300.0) -> subprocess.Popen:
+    """在子进程中启动 FastAPI 应用，LLM请求指向模拟服务，等待健康检查通过后返回"""
+    env = dict(os.environ)
+    env.update({
+        "API_BASE": api_base,
+        "API_KEY": "stub",
+        "BASE_MODEL": "stub-model",
+        "TITLE_MODE": "heuristic",
+        # 压测客户端数有限，关闭按客户端限速并放宽准入，避免测到的是429
+        "CHAT_CLIENT_RATE": "0",
+        "CHAT_MAX_QUEUE": "100000",
+    })
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "rag.api.server:fastapi_server",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"应用启动失败，退出码 {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/chat/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"应用在 {startup_timeout} 秒内未就绪")
+
+
+def print_report(report: dict) -> None:
+    print(f"目标: {report['target']}  并发: {report['concurrency']}  "
+          f"请求: {report['succeeded']}/{report['requests']}  耗时: {report['elapsed_seconds']}s")
+    print(f"吞吐: {report['requests_per_second']} req/s, {report['tokens_per_second']} token帧/s")
+    print(f"TTFT(ms): {report['ttft_ms']}")
+    print(f"token间隔(ms): {report['inter_token_ms']}")
+    print(f"总延迟(ms): {report['latency_ms']}")
+    if report["errors"]:
+        print(f"错误: {report['errors']}")
+    if report["server"]:
+        print(f"服务端: {report['server']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式对话接口压测")
+    parser.add_argument("--url", help="压测已启动的服务，不指定时启动模拟LLM服务与应用子进程")
+    parser.add_argument("--pid", type=int, help="--url 模式下被测服务的进程ID，用于采集CPU与内存")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="chat")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--message", default=DEFAULT_MESSAGE)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="模拟服务每个流的输出速率")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="模拟服务的首token延迟（秒）")
+    parser.add_argument("--stub-port", type=int, default=18000)
+    parser.add_argument("--app-port", type=int, default=18080)
+    parser.add_argument("--output", help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    stub = app_process = None
+    url, pid = args.url, args.pid
+    try:
+        if url is None:
+            from rag.monitoring.openai_stub import StubServer
+
+            stub = StubServer(
+                port=args.stub_port,
+                tokens_per_second=args.tokens_per_second,
+                first_token_latency=args.first_token_latency,
+            ).start()
+            app_process = start_app_server(args.app_port, stub.api_base)
+            url, pid = f"http://127.0.0.1:{args.app_port}", app_process.pid
+
+        report = asyncio.run(run_load_test(
+            url.rstrip("/"),
+            concurrency=args.concurrency,
+            requests=args.requests,
+            target=args.target,
+            message=args.message,
+            server_pid=pid,
+        ))
+        print_report(report)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    finally:
+        if app_process is not None:
+            app_process.terminate()
+            app_process.wait(timeout=10)
+        if stub is not None:
+            stub.stop()
+
+
+if __name__ == "__main__":
+    main()
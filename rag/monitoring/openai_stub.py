@@ -0,0 +1,214 @@
+"""本地OpenAI兼容的模拟服务
+
+实现 /v1/chat/completions（流式与非流式）和 /v1/models，
+返回确定性的合成回答，用于离线评测与压测，不消耗真实模型额度。
+请求带有 tools 且尚未返回工具结果时，以用户问题调用第一个工具，收到工具结果后基于结果作答。
+
+运行方式:
+    python -m rag.monitoring.openai_stub --port 18000
+然后将 API_BASE 设置为 http://127.0.0.1:18000/v1
+"""
+import argparse
+import asyncio
+import json
+import re
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def synthesize_answer(messages: List[dict], max_tokens: Optional[int] = None) -> str:
+    """根据最后一条用户消息（及其后的工具结果）生成确定性回答
+
+    回答由消息中与问题最相关的几句拼接而成，使离线评测中的上下文重叠指标有意义。
+    """
+    content = ""
+    tool_results = []
+    for message in reversed(messages):
+        if message.get("role") == "tool":
+            tool_results.insert(0, message.get("content") or "")
+        elif message.get("role") in ("user", "human"):
+            content = _message_text(message)
+            break
+
+    # 工具结果作为上下文放在问题之前
+    lines = [line.strip() for line in "\n".join(tool_results + [content]).splitlines() if line.strip()]
+    question = lines[-1] if lines else ""
+    body = "\n".join(lines[:-1])
+    sentences = [s.strip() for s in re.split(r"(?<=[。！？.!?])\s*|\n", body) if len(s.strip()) > 10]
+
+    # 选出与问题词重叠最多的句子，保持原文顺序
+    question_terms = set(re.findall(r"\w+", question.lower()))
+    overlaps = [len(question_terms & set(re.findall(r"\w+", s.lower()))) for s in sentences]
+    ranked = sorted((i for i in range(len(sentences)) if overlaps[i] > 0), key=lambda i: -overlaps[i])
+    picked = sorted(ranked[:3]) or list(range(min(3, len(sentences))))
+    answer = " ".join(sentences[i] for i in picked) if picked else "根据现有资料，无法确定答案。"
+    if max_tokens:
+        answer = " ".join(answer.split(" ")[:max_tokens])
+    return answer
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def plan_tool_call(messages: List[dict], tools: Optional[List[dict]]) -> Optional[dict]:
+    """请求带有工具且最后一条消息不是工具结果时，以最后一条用户消息调用第一个工具"""
+    if not tools or (messages and messages[-1].get("role") == "tool"):
+        return None
+    function = tools[0].get("function", {})
+    properties = (function.get("parameters") or {}).get("properties") or {"query": {}}
+    question = next((_message_text(m) for m in reversed(messages) if m.get("role") in ("user", "human")), "")
+    return {
+        "id": f"call_{uuid.uuid4().hex[:24]}",
+        "type": "function",
+        "function": {"name": function.get("name"), "arguments": json.dumps({next(iter(properties)): question})},
+    }
+
+
+def split_tokens(text: str) -> List[str]:
+    """将文本切分为模拟token（英文按词，中文按字）"""
+    return re.findall(r"\s*[A-Za-z0-9_]+|\s*[^\sA-Za-z0-9_]", text)
+
+
+def create_stub_app(tokens_per_second: float = 0.0, first_token_latency: float = 0.0) -> FastAPI:
+    """创建模拟服务应用
+
+    Args:
+        tokens_per_second: 流式输出速率，0 表示不限速
+        first_token_latency: 首token前的延迟（秒）
+    """
+    app = FastAPI()
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model") or "stub-model"
+        tool_call = plan_tool_call(body.get("messages", []), body.get("tools"))
+        answer = "" if tool_call else synthesize_answer(body.get("messages", []), body.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        finish_reason = "tool_calls" if tool_call else "stop"
+
+        if not body.get("stream"):
+            if first_token_latency:
+                await asyncio.sleep(first_token_latency)
+            tokens = split_tokens(answer)
+            if tokens_per_second:
+                await asyncio.sleep(len(tokens) / tokens_per_second)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer or None, "tool_calls": [tool_call]}
+                    if tool_call else {"role": "assistant", "content": answer},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+        async def event_stream():
+            if first_token_latency:
+                await asyncio.sleep(first_token_latency)
+            interval = 1.0 / tokens_per_second if tokens_per_second else 0.0
+            if tool_call:
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"role": "assistant", "tool_calls": [{"index": 0, **tool_call}]},
+                        "finish_reason": None,
+                    }],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            for token in split_tokens(answer):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if interval:
+                    await asyncio.sleep(interval)
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+class StubServer:
+    """在后台线程中运行的模拟服务，可用作上下文管理器"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 18000, app: Optional[FastAPI] = None, **app_kwargs):
+        self.host = host
+        self.port = port
+        # 传入 app 时运行该应用（如压测用的模拟对话服务），否则运行OpenAI兼容模拟服务
+        config = uvicorn.Config(app or create_stub_app(**app_kwargs), host=host, port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def api_base(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError(f"模拟服务启动失败: {self.host}:{self.port}")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_stub_app(args.tokens_per_second, args.first_token_latency),
+        host=args.host,
+        port=args.port,
+        log_level="warning"
+    )
@@ -0,0 +1,83 @@
+"""单个请求的分阶段耗时
+
+每个对话请求开始时调用 start_request_timing 创建 RequestTiming 并绑定到 contextvars，
+之后在同一请求内（包括派生的异步任务与 asyncio.to_thread 线程）调用 stage / record_stage
+记录嵌入、向量检索、提示词构建、首token时间、生成与标题等阶段的耗时：
+
+- 每个阶段的耗时写入全局 REGISTRY 的直方图 chat_stage_<阶段>_seconds，供 /metrics 导出
+- 当前请求的耗时汇总为 Server-Timing 格式或字典，随响应返回
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+_current_timing: ContextVar[Optional["RequestTiming"]] = ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """一次请求内各阶段的耗时（秒），同名阶段多次记录时累加"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头的值，单位为毫秒"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round(self.elapsed * 1000, 1),
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+            **self.counts,
+        }
+
+
+def start_request_timing() -> RequestTiming:
+    """创建当前请求的耗时记录并绑定到上下文"""
+    timing = RequestTiming()
+    _current_timing.set(timing)
+    return timing
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current_timing.get()
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """记录一个阶段的耗时：写入全局直方图，并累加到当前请求（如有）"""
+    REGISTRY.histogram(f"chat_stage_{name}_seconds", f"{name} 阶段耗时").observe(seconds)
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.record(name, seconds)
+
+
+def record_count(name: str, amount: int = 1) -> None:
+    """记录当前请求的计数（如生成的token数）"""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.count(name, amount)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """统计 with 语句块的耗时，异常或取消时同样记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
@@ -1 +1,348 @@
-# 基于MISP数据集的召回率评估
\ No newline at end of file
+"""检索基准测试与召回率计算
+
+以FAISS向量库中已存储的向量为基础，用精确的Flat索引计算每个查询的真实近邻，
+再对不同的索引类型（index_factory字符串）或已配置的检索器测量：
+    recall@k、MRR、p50/p95/p99 延迟与 QPS
+结果以JSON报告输出，可与历史报告对比用于回归跟踪。
+
+运行方式:
+    python -m rag.monitoring.retrieval_metrics.recall_calculator \
+        --k 5 --index-specs Flat HNSW32 "IVF{nlist},Flat|nprobe=8" \
+        --retrievers similarity mmr --output recall_report.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+# 检索器签名: (查询文本, k) -> 文档列表
+Retriever = Callable[[str, int], List[Document]]
+
+# CTI报告中常见的实体模式，用于自动生成查询
+ENTITY_PATTERNS = [
+    re.compile(r"\bCVE-\d{4}-\d{4,7}\b", re.IGNORECASE),
+    re.compile(r"\b(?:APT|TA|UNC|FIN)\s?\d{1,4}\b"),
+    re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b"),
+    re.compile(r"\b[a-fA-F0-9]{32}(?:[a-fA-F0-9]{8})?(?:[a-fA-F0-9]{24})?\b"),
+    re.compile(r"\b(?:[a-z0-9-]+\.)+(?:com|net|org|info|ru|cn|io)\b", re.IGNORECASE),
+    re.compile(r"\b[A-Z][a-z]+[A-Z][A-Za-z]+\b"),
+]
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """计算百分位数，空序列返回0"""
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q))
+
+
+def latency_summary(latencies_ms: List[float], total_seconds: float) -> Dict[str, float]:
+    """汇总延迟分布与吞吐"""
+    return {
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "mean_ms": float(np.mean(latencies_ms)) if latencies_ms else 0.0,
+        "qps": len(latencies_ms) / total_seconds if total_seconds > 0 else 0.0,
+    }
+
+
+def recall_and_mrr(retrieved: List[List[int]], truth: List[List[int]], k: int) -> Dict[str, float]:
+    """计算 recall@k 与 MRR
+
+    recall@k: 检索结果前k个与真实前k近邻的交集占比
+    MRR: 真实最近邻在检索结果中排名的倒数，未出现记为0
+    """
+    recalls, reciprocal_ranks = [], []
+    for found, expected in zip(retrieved, truth):
+        expected_k = [i for i in expected[:k] if i != -1]
+        if not expected_k:
+            continue
+        found_k = list(found[:k])
+        recalls.append(len(set(found_k) & set(expected_k)) / len(expected_k))
+        nearest = expected_k[0]
+        reciprocal_ranks.append(1.0 / (found_k.index(nearest) + 1) if nearest in found_k else 0.0)
+    return {
+        f"recall@{k}": float(np.mean(recalls)) if recalls else 0.0,
+        "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0.0,
+    }
+
+
+class RetrievalBenchmark:
+    """检索基准测试
+
+    Args:
+        vector_store: langchain_community 的 FAISS 向量库
+        embed_query: 查询嵌入函数，通常为 embeddings.embed_query
+    """
+
+    def __init__(self, vector_store: Any, embed_query: Callable[[str], List[float]]):
+        self.vector_store = vector_store
+        self.embed_query = embed_query
+
+        index = vector_store.index
+        self.vectors = index.reconstruct_n(0, index.ntotal).astype(np.float32)
+        self.positions_by_id = {
+            doc_id: position for position, doc_id in vector_store.index_to_docstore_id.items()
+        }
+        self.metric = (
+            faiss.METRIC_INNER_PRODUCT
+            if str(getattr(vector_store, "distance_strategy", "")).endswith("MAX_INNER_PRODUCT")
+            else faiss.METRIC_L2
+        )
+        self.normalize = bool(getattr(vector_store, "_normalize_L2", False))
+        self._positions_by_content = None
+
+    def _positioned_documents(self) -> List[Tuple[int, Document]]:
+        """按索引位置顺序返回 (索引位置, 文档)，跳过文档库中缺失的文档"""
+        docs = []
+        for position in range(len(self.vectors)):
+            doc = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[position])
+            if isinstance(doc, Document):
+                docs.append((position, doc))
+        return docs
+
+    def _documents(self) -> List[Document]:
+        """按索引位置顺序返回向量库中的文档"""
+        return [doc for _, doc in self._positioned_documents()]
+
+    def generate_queries(self, max_queries: int = 100, seed: int = 0) -> List[str]:
+        """根据文档块标题与实体生成查询集
+
+        标题取自文档来源文件名或首行文本，实体通过CVE、APT组织、IP、哈希、域名等模式抽取。
+        """
+        rng = random.Random(seed)
+        queries = []
+        for doc in self._documents():
+            source = doc.metadata.get("source", "")
+            title = os.path.splitext(os.path.basename(source))[0] if source else ""
+            first_line = next((line.strip() for line in doc.page_content.splitlines() if line.strip()), "")
+            if not title or len(title) > 60 or re.fullmatch(r"[\w-]{32,}", title):
+                title = first_line[:80]
+
+            entities = []
+            for pattern in ENTITY_PATTERNS:
+                entities.extend(match.group(0) for match in pattern.finditer(doc.page_content))
+            entities = list(dict.fromkeys(entities))
+
+            if entities:
+                picked = rng.sample(entities, min(2, len(entities)))
+                queries.append(f"{title} {' '.join(picked)}".strip())
+            elif title:
+                queries.append(title)
+
+        queries = list(dict.fromkeys(q for q in queries if q))
+        rng.shuffle(queries)
+        return queries[:max_queries]
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """嵌入查询集"""
+        vectors = np.asarray([self.embed_query(q) for q in queries], dtype=np.float32)
+        if self.normalize:
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def ground_truth(self, query_vectors: np.ndarray, k: int) -> List[List[int]]:
+        """用精确的Flat索引计算真实近邻位置"""
+        index = faiss.IndexFlat(self.vectors.shape[1], self.metric)
+        index.add(self.vectors)
+        _, positions = index.search(query_vectors, k)
+        return positions.tolist()
+
+    def build_index(self, spec: str) -> Any:
+        """根据 index_factory 字符串构建索引
+
+        spec 中可以使用 {nlist} 占位符，"|" 之后为搜索参数，例如 "IVF{nlist},Flat|nprobe=8"
+        """
+        factory, _, params = spec.partition("|")
+        nlist = max(1, min(int(4 * math.sqrt(len(self.vectors))), len(self.vectors) // 39 or 1))
+        index = faiss.index_factory(self.vectors.shape[1], factory.format(nlist=nlist), self.metric)
+        if not index.is_trained:
+            index.train(self.vectors)
+        index.add(self.vectors)
+        if params:
+            faiss.ParameterSpace().set_index_parameters(index, params)
+        return index
+
+    def evaluate_index(self, spec: str, query_vectors: np.ndarray, truth: List[List[int]], k: int) -> Dict[str, Any]:
+        """评估一种索引类型，逐条查询计时"""
+        build_start = time.perf_counter()
+        index = self.build_index(spec)
+        build_seconds = time.perf_counter() - build_start
+
+        retrieved, latencies = [], []
+        total_start = time.perf_counter()
+        for vector in query_vectors:
+            start = time.perf_counter()
+            _, positions = index.search(vector.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            retrieved.append(positions[0].tolist())
+        total_seconds = time.perf_counter() - total_start
+
+        result = {"name": spec, "kind": "index", "build_seconds": build_seconds}
+        result.update(recall_and_mrr(retrieved, truth, k))
+        result.update(latency_summary(latencies, total_seconds))
+        return result
+
+    def _position_of(self, doc: Document) -> int:
+        """将检索器返回的文档映射回索引位置"""
+        if doc.id is not None and doc.id in self.positions_by_id:
+            return self.positions_by_id[doc.id]
+        if self._positions_by_content is None:
+            self._positions_by_content = {}
+            # 使用原始索引位置，缺失的文档不会使后面的位置前移
+            for position, stored in self._positioned_documents():
+                self._positions_by_content.setdefault(stored.page_content, position)
+        return self._positions_by_content.get(doc.page_content, -1)
+
+    def evaluate_retriever(
+        self, name: str, retriever: Retriever, queries: List[str], truth: List[List[int]], k: int
+    ) -> Dict[str, Any]:
+        """评估一个检索器，延迟包含查询嵌入时间"""
+        retrieved, latencies = [], []
+        total_start = time.perf_counter()
+        for query in queries:
+            start = time.perf_counter()
+            docs = retriever(query, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            retrieved.append([self._position_of(doc) for doc in docs])
+        total_seconds = time.perf_counter() - total_start
+
+        result = {"name": name, "kind": "retriever"}
+        result.update(recall_and_mrr(retrieved, truth, k))
+        result.update(latency_summary(latencies, total_seconds))
+        return result
+
+    def run(
+        self,
+        queries: Optional[List[str]] = None,
+        k: int = 5,
+        index_specs: Sequence[str] = ("Flat",),
+        retrievers: Optional[Dict[str, Retriever]] = None,
+        max_queries: int = 100,
+    ) -> Dict[str, Any]:
+        """运行完整基准测试并返回报告"""
+        queries = queries or self.generate_queries(max_queries=max_queries)
+        if not queries:
+            raise ValueError("查询集为空，无法进行基准测试")
+
+        query_vectors = self.embed_queries(queries)
+        truth = self.ground_truth(query_vectors, k)
+
+        results = [self.evaluate_index(spec, query_vectors, truth, k) for spec in index_specs]
+        for name, retriever in (retrievers or {}).items():
+            results.append(self.evaluate_retriever(name, retriever, queries, truth, k))
+
+        return {
+            "created_at": datetime.now().isoformat(),
+            "k": k,
+            "num_queries": len(queries),
+            "num_vectors": int(self.vectors.shape[0]),
+            "dimension": int(self.vectors.shape[1]),
+            "environment": {
+                "python": platform.python_version(),
+                "faiss": getattr(faiss, "__version__", "unknown"),
+                "machine": platform.machine(),
+            },
+            "results": results,
+        }
+
+
+def save_report(report: Dict[str, Any], path: str) -> None:
+    """保存JSON报告"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def compare_reports(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    recall_tolerance: float = 0.01,
+    latency_tolerance: float = 0.2,
+) -> List[str]:
+    """对比两份报告，返回回归项描述
+
+    Args:
+        baseline: 基线报告
+        current: 当前报告
+        recall_tolerance: 允许的recall/MRR绝对下降
+        latency_tolerance: 允许的p95延迟相对上升比例
+    """
+    regressions = []
+    baseline_results = {r["name"]: r for r in baseline.get("results", [])}
+    for result in current.get("results", []):
+        previous = baseline_results.get(result["name"])
+        if previous is None:
+            continue
+        for metric in [key for key in result if key.startswith("recall@")] + ["mrr"]:
+            if metric in previous and result[metric] < previous[metric] - recall_tolerance:
+                regressions.append(
+                    f"{result['name']}: {metric} {previous[metric]:.4f} -> {result[metric]:.4f}"
+                )
+        if previous.get("p95_ms", 0) > 0 and result["p95_ms"] > previous["p95_ms"] * (1 + latency_tolerance):
+            regressions.append(
+                f"{result['name']}: p95_ms {previous['p95_ms']:.2f} -> {result['p95_ms']:.2f}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索召回率与延迟基准测试")
+    parser.add_argument("--queries", help="查询文件，每行一个查询；不指定时从文档块自动生成")
+    parser.add_argument("--max-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--index-specs", nargs="*", default=["Flat", "HNSW32", "IVF{nlist},Flat|nprobe=8"])
+    parser.add_argument("--retrievers", nargs="*", default=["similarity", "mmr"], choices=["similarity", "mmr"])
+    parser.add_argument("--output", default="recall_report.json")
+    parser.add_argument("--baseline", help="基线报告路径，存在回归时以非零状态退出")
+    args = parser.parse_args()
+
+    from rag.vector.faiss import FaissVectorDatabase
+
+    vector_database = FaissVectorDatabase()
+    vector_database.stop_auto_update()
+    store = vector_database.vector_store
+
+    available_retrievers = {
+        "similarity": lambda query, k: store.similarity_search(query, k=k),
+        "mmr": lambda query, k: vector_database.max_marginal_relevance_search(query, k=k, fetch_k=k * 4),
+    }
+
+    queries = None
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    benchmark = RetrievalBenchmark(store, vector_database.embeddings.embed_query)
+    report = benchmark.run(
+        queries=queries,
+        k=args.k,
+        index_specs=args.index_specs,
+        retrievers={name: available_retrievers[name] for name in args.retrievers},
+        max_queries=args.max_queries,
+    )
+    save_report(report, args.output)
+    print(json.dumps(report["results"], ensure_ascii=False, indent=2))
+    print(f"报告已保存到 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_reports(json.load(f), report)
+        for regression in regressions:
+            print(f"回归: {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from rag.api.chat_api.admission import AdmissionController, AdmissionRejected
+
+
+async def test_queue_full_and_timeout_are_rejected():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.1, client_rate=0)
+    first = await admission.acquire("a")
+
+    waiter = asyncio.create_task(admission.acquire("b"))
+    await asyncio.sleep(0.01)
+    assert admission.stats()["queue_depth"] == 1
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        await admission.acquire("c")
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after >= 1
+
+    with pytest.raises(AdmissionRejected) as timed_out:
+        await waiter
+    assert timed_out.value.reason == "queue_timeout"
+
+    first.release()
+    first.release()
+    second = await admission.acquire("b")
+    second.release()
+    stats = admission.stats()
+    assert stats["active"] == 0
+    assert stats["admitted"] == 2
+    assert stats["rejected"] == {"rate_limited": 0, "queue_full": 1, "queue_timeout": 1}
+
+
+async def test_client_token_bucket():
+    admission = AdmissionController(client_rate=1, client_burst=2)
+    for _ in range(2):
+        (await admission.acquire("client")).release()
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        await admission.acquire("client")
+    assert rejected.value.reason == "rate_limited"
+    # 其他客户端不受影响
+    (await admission.acquire("other")).release()
+
+
+async def test_same_conversation_is_serialized():
+    admission = AdmissionController(max_concurrent=4, client_rate=0)
+    order = []
+
+    async def turn(name: str, conversation_id: str):
+        ticket = await admission.acquire(name, conversation_id)
+        order.append(f"{name}-start")
+        await asyncio.sleep(0.05)
+        order.append(f"{name}-end")
+        ticket.release()
+
+    await asyncio.gather(turn("a", "c1"), turn("b", "c1"), turn("c", "c2"))
+
+    assert order.index("a-end") < order.index("b-start")
+    assert order.index("c-start") < order.index("a-end")
+    assert admission.stats()["conversation_locks"] == 0
+
+
+def test_client_id_header_only_trusted_from_proxies(monkeypatch):
+    from starlette.requests import Request
+
+    from rag.api.chat_api import chat_api as chat_api_module
+
+    def request_from(host):
+        return Request({"type": "http", "headers": [(b"x-client-id", b"spoofed")], "client": (host, 1234)})
+
+    monkeypatch.setattr(chat_api_module, "trusted_proxies", {"10.0.0.1"})
+    assert chat_api_module.get_client_id(request_from("203.0.113.7")) == "203.0.113.7"
+    assert chat_api_module.get_client_id(request_from("10.0.0.1")) == "spoofed"
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag.chains.answer_cache import SemanticAnswerCache
+from rag.chains.conversation_chain import StreamingConversationChain
+from rag.monitoring.openai_stub import StubServer
+from rag.vector.vector_database import VectorDatabase
+from rag.test.evaluation_test import free_port
+
+
+def bag_of_words(text: str):
+    vector = np.zeros(64, dtype=np.float32)
+    for word in text.lower().replace("?", "").split():
+        # 内置 hash() 每次运行加盐，分桶需与运行无关
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1
+    return vector.tolist()
+
+
+class FakeVectorDatabase(VectorDatabase):
+    def query_vector_database(self, query):
+        return [Document(page_content="APT29 is a Russian threat actor.", metadata={"source": "apt29.pdf"})]
+
+
+def test_lookup_threshold_and_index_version():
+    cache = SemanticAnswerCache(bag_of_words, similarity_threshold=0.9)
+    embedding = cache.embed("who is apt29")
+    cache.store("who is apt29", embedding, "a threat actor", [], index_version=1)
+
+    assert cache.lookup(cache.embed("who is APT29?"), index_version=1).answer == "a threat actor"
+    assert cache.lookup(cache.embed("what is lazarus"), index_version=1) is None
+    assert cache.lookup(embedding, index_version=2) is None
+    assert cache.stats()["hit_rate"] == 1 / 3
+
+
+def test_ttl_and_lru_eviction():
+    cache = SemanticAnswerCache(bag_of_words, ttl_seconds=0.05, max_size=2)
+    for query in ["alpha", "beta", "gamma"]:
+        cache.store(query, cache.embed(query), f"answer {query}", [])
+
+    assert cache.lookup(cache.embed("alpha")) is None
+    assert cache.lookup(cache.embed("gamma")).answer == "answer gamma"
+    time.sleep(0.06)
+    assert cache.lookup(cache.embed("gamma")) is None
+    assert cache.stats()["evictions"] == 3
+
+
+async def collect(chain, message, conversation_id):
+    return [chunk async for chunk in chain.astream(message, conversation_id)]
+
+
+async def test_chain_replays_cached_answer():
+    cache = SemanticAnswerCache(bag_of_words, similarity_threshold=0.9)
+    with StubServer(port=free_port()) as stub:
+        chain = StreamingConversationChain(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=FakeVectorDatabase(),
+            answer_cache=cache,
+        )
+        first_id = await chain.get_or_create_conversation(None)
+        first = await collect(chain, "who is apt29", first_id)
+        second_id = await chain.get_or_create_conversation(None)
+        second = await collect(chain, "Who is APT29?", second_id)
+
+    def answer(chunks):
+        return "".join(json.loads(c)["data"] for c in chunks[1:])
+
+    assert cache.hits == 1
+    assert second[0] == first[0]
+    assert answer(second) == answer(first) != ""
+    assert chain._get_memory(second_id).chat_memory.messages[-1].content == answer(first)
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return bag_of_words(text)
+
+
+class EmbeddingVectorDatabase(FakeVectorDatabase):
+    """与语义缓存共用嵌入函数的向量库，记录按文本与按嵌入的检索次数"""
+
+    def __init__(self):
+        super().__init__()
+        self.embeddings = CountingEmbeddings()
+        self.text_queries = 0
+        self.vector_queries = 0
+
+    def query_vector_database(self, query):
+        self.text_queries += 1
+        self.embeddings.embed_query(query)
+        return super().query_vector_database(query)
+
+    def query_vector_database_by_vector(self, embedding):
+        self.vector_queries += 1
+        return super().query_vector_database("")
+
+
+async def test_chain_embeds_query_once_and_skips_retrieval_on_hit():
+    vector_database = EmbeddingVectorDatabase()
+    cache = SemanticAnswerCache(vector_database.embeddings.embed_query, similarity_threshold=0.9)
+    with StubServer(port=free_port()) as stub:
+        chain = StreamingConversationChain(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=vector_database,
+            answer_cache=cache,
+        )
+        await collect(chain, "who is apt29", await chain.get_or_create_conversation(None))
+        await collect(chain, "Who is APT29?", await chain.get_or_create_conversation(None))
+
+    # 未命中时检索复用缓存查询的嵌入，命中时不再检索：两个问题共嵌入两次
+    assert cache.hits == 1
+    assert vector_database.embeddings.calls == 2
+    assert vector_database.text_queries == 0
+    assert vector_database.vector_queries == 1
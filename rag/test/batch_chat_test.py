@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+
+import httpx
+from fastapi import FastAPI
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from rag.api.chat_api import chat_api as chat_api_module
+from rag.api.chat_api.admission import AdmissionController
+from rag.chains.conversation_chain import StreamingConversationChain
+from rag.chains.conversation_store import ConversationStore
+from rag.monitoring.openai_stub import StubServer, create_stub_app
+from rag.test.evaluation_test import free_port
+from rag.vector.faiss import FaissVectorDatabase
+from rag.vector.vector_database import VectorDatabase
+
+
+class BatchRecordingVectorDatabase(VectorDatabase):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def query_vector_database(self, query):
+        return [Document(page_content=f"{query} was reported in a vendor report.", metadata={"source": f"{query}.pdf"})]
+
+    def query_vector_database_batch(self, queries):
+        self.batches.append(list(queries))
+        return super().query_vector_database_batch(queries)
+
+
+def concurrency_tracking_stub():
+    """首token延迟50毫秒的模拟服务，记录同时处理的请求数"""
+    app = create_stub_app(first_token_latency=0.05)
+    state = {"running": 0, "max_running": 0, "requests": 0}
+
+    @app.middleware("http")
+    async def track(request, call_next):
+        state["running"] += 1
+        state["requests"] += 1
+        state["max_running"] = max(state["max_running"], state["running"])
+        try:
+            return await call_next(request)
+        finally:
+            state["running"] -= 1
+
+    return StubServer(port=free_port(), app=app), state
+
+
+def make_chain(stub, vector_database):
+    return StreamingConversationChain(
+        model_name="stub-model",
+        api_base=stub.api_base,
+        api_key="stub",
+        use_rag=True,
+        vector_database=vector_database,
+        conversation_store=ConversationStore(),
+    )
+
+
+async def test_batch_retrieves_in_batches_and_bounds_generation():
+    stub, state = concurrency_tracking_stub()
+    vector_database = BatchRecordingVectorDatabase()
+    prompts = [f"IOC-{i}" for i in range(10)]
+    with stub:
+        chain = make_chain(stub, vector_database)
+        results = [r async for r in chain.abatch(prompts, concurrency=3, retrieval_batch_size=4)]
+
+    assert [len(batch) for batch in vector_database.batches] == [4, 4, 2]
+    assert sorted(r["index"] for r in results) == list(range(10))
+    for result in results:
+        assert result["error"] is None
+        assert result["answer"]
+        assert result["sources"] == [f"{prompts[result['index']]}.pdf"]
+    assert state["requests"] == 10
+    assert state["max_running"] <= 3
+    # 不创建会话，也不生成标题
+    assert chain.conversation_store.stats()["size"] == 0
+    assert chain.title_generator.stats()["generated"] == 0
+
+
+async def test_batch_endpoint_streams_ndjson(monkeypatch):
+    stub, _ = concurrency_tracking_stub()
+    with stub:
+        monkeypatch.setattr(chat_api_module, "streaming_conversation", make_chain(stub, BatchRecordingVectorDatabase()))
+        app = FastAPI()
+        app.include_router(chat_api_module.chat_api)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/chat/batch", json={"prompts": ["APT29", "Lazarus"], "concurrency": 2})
+            monkeypatch.setattr(chat_api_module, "batch_max_prompts", 1)
+            too_many = await client.post("/chat/batch", json={"prompts": ["APT29", "Lazarus"]})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert {line["question"] for line in lines[:-1]} == {"APT29", "Lazarus"}
+    assert lines[-1]["event"] == "complete"
+    assert lines[-1]["count"] == 2 and lines[-1]["errors"] == 0
+    assert "retrieval" in lines[-1]["timing"]["stages_ms"]
+    assert too_many.status_code == 413
+
+
+class SlowBatchVectorDatabase(BatchRecordingVectorDatabase):
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def query_vector_database_batch(self, queries):
+        time.sleep(self.delay)
+        return super().query_vector_database_batch(queries)
+
+
+async def test_batch_retrieval_timeout_scales_and_is_reported():
+    stub, _ = concurrency_tracking_stub()
+    prompts = [f"IOC-{i}" for i in range(4)]
+    with stub:
+        # 单次检索超时 0.1 秒，4 个问题的一批可等待 0.4 秒
+        chain = make_chain(stub, SlowBatchVectorDatabase(0.2))
+        chain.retrieval_timeout = 0.1
+        scaled = [r async for r in chain.abatch(prompts, retrieval_batch_size=4)]
+
+        chain = make_chain(stub, SlowBatchVectorDatabase(1.0))
+        chain.retrieval_timeout = 0.1
+        chain.batch_retrieval_timeout = 0.1
+        timed_out = [r async for r in chain.abatch(prompts, retrieval_batch_size=4)]
+
+    assert all(r["retrieval_error"] is None and r["sources"] for r in scaled)
+    # 检索超时的问题以空上下文生成，并在结果中标明
+    assert all(r["retrieval_error"] and not r["sources"] and r["answer"] for r in timed_out)
+
+
+async def post_batch(monkeypatch, stub, admission, payload):
+    monkeypatch.setattr(chat_api_module, "streaming_conversation", make_chain(stub, BatchRecordingVectorDatabase()))
+    monkeypatch.setattr(chat_api_module, "admission", admission)
+    app = FastAPI()
+    app.include_router(chat_api_module.chat_api)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/chat/batch", json=payload)
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+async def test_batch_takes_admission_slot_per_generation(monkeypatch):
+    stub, state = concurrency_tracking_stub()
+    admission = AdmissionController(max_concurrent=2, client_rate=0)
+    with stub:
+        lines = await post_batch(monkeypatch, stub, admission, {"prompts": [f"IOC-{i}" for i in range(6)]})
+
+    # 批量请求的并发生成数受全局并发上限约束
+    assert lines[-1]["errors"] == 0
+    assert state["max_running"] <= 2
+    assert admission.stats()["admitted"] == 6
+    assert admission.stats()["active"] == 0
+
+
+async def test_batch_charges_rate_limit_per_prompt(monkeypatch):
+    stub, _ = concurrency_tracking_stub()
+    admission = AdmissionController(client_rate=0.001, client_burst=2)
+    with stub:
+        lines = await post_batch(monkeypatch, stub, admission, {"prompts": ["APT29", "Lazarus", "FIN7"]})
+
+    errors = [line["error"] for line in lines[:-1] if line["error"]]
+    assert len(errors) == 1 and "rate_limited" in errors[0]
+    assert admission.stats()["rejected"]["rate_limited"] == 1
+
+
+def test_faiss_batch_query_matches_single_queries():
+    embeddings = DeterministicFakeEmbedding(size=16)
+    database = FaissVectorDatabase.__new__(FaissVectorDatabase)
+    database.embeddings = embeddings
+    database.index_lock = threading.RLock()
+    database.vector_store = FAISS.from_texts(
+        [f"report {i}" for i in range(10)], embeddings, metadatas=[{"source": f"{i}.pdf"} for i in range(10)]
+    )
+    queries = ["report 3", "report 7", "unrelated"]
+
+    batch = database.query_vector_database_batch(queries)
+    single = [database.query_vector_database(query) for query in queries]
+    assert [[d.metadata["source"] for d in docs] for docs in batch] == \
+        [[d.metadata["source"] for d in docs] for docs in single]
+    assert all(len(docs) == 4 for docs in batch)
@@ -0,0 +1,77 @@
+"""MMR检索基准测试：向量化实现 vs LangChain FAISS 实现
+
+使用随机向量构建FAISS向量库，比较不同 fetch_k 下两种实现的平均耗时，
+并校验两者选出的文档是否一致。
+
+运行方式:
+    python -m rag.test.benchmark.mmr_benchmark --num-docs 20000 --dim 1024
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import FakeEmbeddings
+
+from rag.vector.mmr import mmr_search_by_vector
+
+
+def build_store(num_docs: int, dim: int, seed: int = 0) -> FAISS:
+    """构建包含随机向量的FAISS向量库"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((num_docs, dim)).astype(np.float32)
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    ids = [str(i) for i in range(num_docs)]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=f"chunk {doc_id}", metadata={"source": doc_id}) for doc_id in ids
+    })
+    return FAISS(
+        embedding_function=FakeEmbeddings(size=dim),
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids))
+    )
+
+
+def time_call(func, repeat: int) -> float:
+    """返回平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def run_benchmark(num_docs: int, dim: int, k: int, fetch_ks, repeat: int):
+    store = build_store(num_docs, dim)
+    query = np.random.default_rng(1).standard_normal(dim).astype(np.float32).tolist()
+
+    print(f"文档数: {num_docs}, 维度: {dim}, k: {k}, 重复次数: {repeat}")
+    print(f"{'fetch_k':>8} {'langchain(ms)':>14} {'vectorized(ms)':>15} {'speedup':>8} {'same':>5}")
+    for fetch_k in fetch_ks:
+        langchain_docs = store.max_marginal_relevance_search_by_vector(query, k=k, fetch_k=fetch_k)
+        vectorized_docs = [doc for doc, _ in mmr_search_by_vector(store, query, k=k, fetch_k=fetch_k)]
+        same = [d.page_content for d in langchain_docs] == [d.page_content for d in vectorized_docs]
+
+        langchain_ms = time_call(
+            lambda: store.max_marginal_relevance_search_by_vector(query, k=k, fetch_k=fetch_k), repeat
+        )
+        vectorized_ms = time_call(
+            lambda: mmr_search_by_vector(store, query, k=k, fetch_k=fetch_k), repeat
+        )
+        print(f"{fetch_k:>8} {langchain_ms:>14.2f} {vectorized_ms:>15.2f} "
+              f"{langchain_ms / vectorized_ms:>7.1f}x {str(same):>5}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MMR检索基准测试")
+    parser.add_argument("--num-docs", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[20, 100, 200, 500])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run_benchmark(args.num_docs, args.dim, args.k, args.fetch_k, args.repeat)
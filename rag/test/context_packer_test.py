@@ -0,0 +1,57 @@
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from rag.chains.context_packer import ContextPacker, TokenCounter, extract_query_terms, split_sentences
+
+
+def make_packer(**kwargs):
+    # 估算模式不依赖下载编码文件
+    return ContextPacker(token_counter=TokenCounter("estimate-only"), **kwargs)
+
+
+def test_split_sentences_keeps_ip_addresses():
+    sentences = split_sentences("C2 server is 10.0.0.1 on port 443. 它使用了鱼叉式钓鱼。\nNew line")
+    assert sentences == ["C2 server is 10.0.0.1 on port 443.", "它使用了鱼叉式钓鱼。", "New line"]
+
+
+def test_extract_query_terms():
+    terms = extract_query_terms("What malware does APT29 use? 钓鱼邮件")
+    assert "apt29" in terms and "malware" in terms and "what" not in terms
+    assert "钓鱼" in terms and "邮件" in terms
+
+
+def test_overlapping_chunks_are_deduplicated():
+    shared = "APT29 delivered WellMess through spear phishing emails."
+    docs = [
+        Document(page_content=f"Intro paragraph about the campaign. {shared}", metadata={"source": "a.pdf"}),
+        Document(page_content=f"{shared} The malware beacons to its C2 every hour.", metadata={"source": "a.pdf"}),
+    ]
+    packed = make_packer(sentence_window=5).pack("APT29 WellMess", docs)
+
+    assert packed.rag_context.count(shared) == 1
+    assert packed.stats["duplicates_removed"] == 1
+    assert "beacons" in packed.rag_context
+
+
+def test_chunks_trimmed_to_query_sentences():
+    filler = " ".join(f"Unrelated sentence number {i} about nothing." for i in range(50))
+    doc = Document(page_content=f"{filler} Lazarus used the AppleJeus backdoor. {filler}", metadata={"source": "b.pdf"})
+    packed = make_packer(sentence_window=1).pack("Lazarus backdoor", [doc])
+
+    assert "AppleJeus" in packed.rag_context
+    assert "number 10 " not in packed.rag_context
+    assert packed.stats["tokens_saved"] > 0
+
+
+def test_budget_is_respected_and_recent_history_kept():
+    history = []
+    for i in range(40):
+        history += [HumanMessage(content=f"question {i} " * 20), AIMessage(content=f"answer {i} " * 20)]
+    docs = [Document(page_content="APT29 phishing. " * 300, metadata={"source": f"{i}.pdf"}) for i in range(5)]
+
+    packer = make_packer(max_tokens=1000)
+    packed = packer.pack("APT29 phishing", docs, history, instructions="system prompt")
+
+    assert packed.stats["prompt_tokens"] <= 1000
+    assert "answer 39" in packed.chat_history
+    assert "question 0 " not in packed.chat_history
@@ -0,0 +1,45 @@
+from langchain_core.documents import Document
+
+from rag.agents.conversation_agent import StreamingConversationalAgent
+from rag.chains.llm_pool import LLMClientPool
+from rag.monitoring.openai_stub import StubServer
+from rag.test.evaluation_test import free_port
+from rag.vector.vector_database import VectorDatabase
+
+
+class RecordingVectorDatabase(VectorDatabase):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def query_vector_database(self, query):
+        self.queries.append(query)
+        return [Document(page_content="APT29 uses spearphishing links for initial access.",
+                         metadata={"source": "apt29.pdf"})]
+
+
+async def test_tool_calling_agent_searches_and_streams_answer():
+    vector_database = RecordingVectorDatabase()
+    with StubServer(port=free_port()) as stub:
+        agent = StreamingConversationalAgent(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=vector_database,
+            agent_mode="tool_calling",
+            llm_pool=LLMClientPool(),
+            title_mode="heuristic",
+        )
+        conversation_id = await agent.get_or_create_conversation("new")
+        tokens = [token async for token in agent.astream("How does APT29 get initial access?", conversation_id)]
+
+    # 模拟服务先返回对 search_documents 的工具调用，再基于检索结果作答
+    assert vector_database.queries == ["How does APT29 get initial access?"]
+    answer = "".join(tokens)
+    assert "生成过程中出错" not in answer
+    assert "spearphishing links" in answer
+    assert len([token for token in tokens if token]) > 1
+    # 本轮问答写回会话记忆
+    history = agent.conversation_store.history(conversation_id)
+    assert history[0].content == "How does APT29 get initial access?"
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from rag.api.chat_api import chat_api as chat_api_module
+from rag.chains.cancellation import cancellation_stats
+from rag.chains.conversation_chain import StreamingConversationChain
+from rag.chains.conversation_store import ConversationStore
+from rag.monitoring.openai_stub import StubServer
+from rag.test.answer_cache_test import FakeVectorDatabase
+from rag.test.evaluation_test import free_port
+
+
+async def test_astream_yields_tokens_as_they_arrive():
+    with StubServer(port=free_port(), tokens_per_second=100) as stub:
+        chain = StreamingConversationChain(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=FakeVectorDatabase(),
+        )
+        conversation_id = await chain.get_or_create_conversation(None)
+
+        arrivals, chunks = [], []
+        async for chunk in chain.astream("who is apt29", conversation_id):
+            arrivals.append(time.perf_counter())
+            chunks.append(chunk)
+
+    assert chunks[0].startswith("[rag_context]:")
+    tokens = [json.loads(c)["data"] for c in chunks[1:]]
+    assert len(tokens) > 3
+    # 以100 tokens/s 输出时，首个token应明显早于最后一个token到达
+    assert arrivals[-1] - arrivals[1] > 0.02
+
+    messages = chain._get_memory(conversation_id).chat_memory.messages
+    assert messages[-1].content == "".join(tokens)
+
+
+async def test_astream_stops_when_client_disconnects():
+    with StubServer(port=free_port(), tokens_per_second=5) as stub:
+        chain = StreamingConversationChain(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=FakeVectorDatabase(),
+            max_tokens=100,
+        )
+        conversation_id = await chain.get_or_create_conversation(None)
+        before = cancellation_stats()
+
+        start = time.perf_counter()
+
+        async def is_disconnected():
+            return time.perf_counter() - start > 0.15
+
+        chain_stream = chain.astream("who is apt29", conversation_id, is_disconnected=is_disconnected)
+        chunks = [chunk async for chunk in chain_stream]
+        elapsed = time.perf_counter() - start
+
+    after = cancellation_stats()
+    # 完整回答约需 2 秒，断开在下一次轮询（0.5 秒）时被发现，生成随即结束，且不写入会话记忆
+    assert elapsed < 1.0
+    assert 1 <= len(chunks) < 6
+    assert after["canceled_generations"] == before["canceled_generations"] + 1
+    assert after["canceled_tokens"] > before["canceled_tokens"]
+    assert chain._get_memory(conversation_id).chat_memory.messages == []
+
+
+class SlowVectorDatabase(FakeVectorDatabase):
+    def query_vector_database(self, query):
+        time.sleep(1.0)
+        return super().query_vector_database(query)
+
+
+async def test_slow_retrieval_times_out_to_empty_context():
+    with StubServer(port=free_port(), tokens_per_second=200) as stub:
+        chain = StreamingConversationChain(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=SlowVectorDatabase(),
+            retrieval_timeout=0.2,
+        )
+        conversation_id = await chain.get_or_create_conversation(None)
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        chunks = [chunk async for chunk in chain.astream("who is apt29", conversation_id)]
+        elapsed = time.perf_counter() - start
+        ticking.cancel()
+
+    # 检索在线程中执行，事件循环在等待期间仍能调度其他任务
+    assert ticks >= 10
+    assert chunks[0] == "[rag_context]:[]\n\n"
+    assert len(chunks) > 1
+    assert elapsed < 1.0
+
+
+class EmptyVectorDatabase(FakeVectorDatabase):
+    def query_vector_database(self, query):
+        return []
+
+
+async def test_stream_endpoint_sends_empty_rag_context(monkeypatch):
+    with StubServer(port=free_port(), tokens_per_second=200) as stub:
+        chain = StreamingConversationChain(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=EmptyVectorDatabase(),
+            title_mode="heuristic",
+            conversation_store=ConversationStore(),
+        )
+        monkeypatch.setattr(chat_api_module, "streaming_conversation", chain)
+        app = FastAPI()
+        app.include_router(chat_api_module.chat_api)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/chat/stream", json={"message": "who is apt29"})
+
+    # 没有召回文档时也要写出空的检索结果帧
+    assert "data: [rag_context]:[]\n\n" in response.text
+
+
+def test_verbose_keyword_is_still_accepted():
+    # verbose 已废弃，旧的调用方式不报错
+    StreamingConversationChain(verbose=False, conversation_store=ConversationStore())
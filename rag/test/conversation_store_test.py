@@ -0,0 +1,56 @@
+from rag.chains.conversation_store import ConversationStore
+
+
+def test_lru_eviction_spills_and_reloads(tmp_path):
+    store = ConversationStore(max_size=2, spill_dir=str(tmp_path))
+    first = store.create().conversation_id
+    store.save_turn(first, "who is apt29", "a threat group")
+    store.get(first).title = "APT29"
+    second = store.create().conversation_id
+    third = store.create().conversation_id
+
+    assert len(store) == 2
+    assert store.stats()["evictions"] == 1
+    assert (tmp_path / f"{first}.json").exists()
+    assert first in store
+
+    restored = store.get(first)
+    assert [m.content for m in restored.messages] == ["who is apt29", "a threat group"]
+    assert restored.title == "APT29"
+    # 重新加载后 second 成为最久未使用的会话
+    assert second not in store._states
+    assert third in store._states
+
+
+def test_window_mode_keeps_history_constant():
+    store = ConversationStore(memory_mode="window", window_turns=2)
+    conversation_id = store.create().conversation_id
+    for turn in range(10):
+        store.save_turn(conversation_id, f"question {turn}", f"answer {turn}")
+
+    history = store.history(conversation_id)
+    assert [m.content for m in history] == ["question 8", "answer 8", "question 9", "answer 9"]
+    assert len(store.get(conversation_id).messages) == 4
+
+
+async def test_summary_mode_folds_old_turns():
+    calls = []
+
+    async def summarizer(summary, conversation):
+        calls.append(conversation)
+        return f"{summary}|{len(calls)}"
+
+    store = ConversationStore(memory_mode="summary", window_turns=1, summarizer=summarizer)
+    conversation_id = store.create().conversation_id
+    for turn in range(3):
+        store.save_turn(conversation_id, f"question {turn}", f"answer {turn}")
+        task = store.schedule_compaction(conversation_id)
+        if task is not None:
+            await task
+
+    history = store.history(conversation_id)
+    assert history[0].type == "system"
+    assert "|2" in history[0].content
+    assert [m.content for m in history[1:]] == ["question 2", "answer 2"]
+    assert "question 0" in calls[0]
+    assert store.stats()["summaries"] == 2
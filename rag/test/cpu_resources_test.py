@@ -0,0 +1,120 @@
+import asyncio
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+from rag.cpu_resources import (
+    ResourceSettings,
+    apply_process_settings,
+    apply_resource_settings,
+    apply_torch_settings,
+    configure_default_executor,
+    describe_cpu_usage,
+    load_resource_settings,
+)
+from rag.monitoring.cpu_autotune import Split, candidate_splits, format_config, run_split, score_results
+
+
+def test_load_settings_per_role(tmp_path):
+    config = tmp_path / "config.yaml"
+    config.write_text(
+        "resources:\n"
+        "  api:\n"
+        "    torch_threads: 4\n"
+        "    thread_pool: 8\n"
+        "  ingestion_worker:\n"
+        "    faiss_threads: 1\n"
+        "    cpu_affinity: [2, 3]\n"
+    )
+    assert load_resource_settings("api", str(config)) == ResourceSettings(torch_threads=4, thread_pool=8)
+    assert load_resource_settings("ingestion_worker", str(config)) == ResourceSettings(
+        faiss_threads=1, cpu_affinity=[2, 3]
+    )
+    # 没有配置时保持库的默认行为
+    assert load_resource_settings("api", str(tmp_path / "missing.yaml")) == ResourceSettings()
+
+    config.write_text("resources:\n  api:\n    torch_thread: 4\n")
+    with pytest.raises(ValueError, match="torch_thread"):
+        load_resource_settings("api", str(config))
+
+
+def test_apply_sets_openmp_threads_and_executor(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "")
+    applied = apply_resource_settings(ResourceSettings(faiss_threads=1, thread_pool=3))
+    assert applied["configured"]["faiss_threads"] == 1
+    assert os.environ["OMP_NUM_THREADS"] == "1"
+
+    async def executor_threads():
+        configure_default_executor(ResourceSettings(thread_pool=3))
+        names = await asyncio.gather(*(asyncio.to_thread(lambda: threading.current_thread().name) for _ in range(20)))
+        return set(names)
+
+    names = asyncio.run(executor_threads())
+    assert len(names) <= 3
+    assert all(name.startswith("api") for name in names)
+
+
+def test_faiss_threads_do_not_cap_torch_threads(monkeypatch):
+    calls = []
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(set_num_threads=calls.append))
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+    # OMP_NUM_THREADS 按 faiss_threads 设置后，未配置 torch_threads 时 torch 使用全部可用CPU
+    apply_torch_settings(ResourceSettings(faiss_threads=1))
+    apply_torch_settings(ResourceSettings(torch_threads=2, faiss_threads=1))
+    apply_torch_settings(ResourceSettings())
+    assert calls == [cpus, 2]
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="需要 sched_setaffinity")
+def test_affinity_applies_to_whole_process():
+    original = sorted(os.sched_getaffinity(0))
+    settings = ResourceSettings(cpu_affinity=original[:1])
+    idle = threading.Event()
+    existing = threading.Thread(target=idle.wait)
+    existing.start()
+    try:
+        # 在其他线程中应用，主线程与已有线程同样生效
+        applier = threading.Thread(target=apply_process_settings, args=(settings,))
+        applier.start()
+        applier.join()
+        assert sorted(os.sched_getaffinity(0)) == original[:1]
+        assert sorted(os.sched_getaffinity(existing.native_id)) == original[:1]
+        assert describe_cpu_usage(settings)["cpu_affinity"] == original[:1]
+    finally:
+        idle.set()
+        existing.join()
+        apply_process_settings(ResourceSettings(cpu_affinity=original))
+
+
+def test_autotune_candidates_and_scoring(tmp_path):
+    splits = candidate_splits([0, 1, 2, 3])
+    assert splits[0].name == "default"
+    for split in splits[1:]:
+        # 两个进程的核心不重叠且覆盖全部核心
+        assert sorted(split.api.cpu_affinity + split.ingestion_worker.cpu_affinity) == [0, 1, 2, 3]
+        assert split.api.torch_threads == len(split.api.cpu_affinity)
+
+    ranked = score_results([
+        {"name": "a", "qps": 10.0, "chunks_per_second": 1.0},
+        {"name": "b", "qps": 8.0, "chunks_per_second": 4.0},
+    ], weight=0.5)
+    assert [r["name"] for r in ranked] == ["b", "a"]
+    assert [r["name"] for r in score_results(ranked, weight=1.0)] == ["a", "b"]
+
+    # 输出的配置可以直接作为 config.yaml 的 resources 段读取
+    config = tmp_path / "config.yaml"
+    config.write_text(format_config(splits[1]))
+    assert load_resource_settings("api", str(config)) == splits[1].api
+    assert load_resource_settings("ingestion_worker", str(config)) == splits[1].ingestion_worker
+
+
+def test_run_split_reports_crashed_process(tmp_path):
+    # 模型无法加载时子进程退出，不会一直等待测量结果
+    split = Split("default", ResourceSettings(), ResourceSettings())
+    with pytest.raises(RuntimeError, match="exitcode"):
+        run_split(split, str(tmp_path / "missing-model"), duration=1, concurrency=1, num_docs=10,
+                  batch_size=1, chunk_chars=100, startup_timeout=60)
@@ -0,0 +1,73 @@
+import asyncio
+import socket
+
+from langchain_core.documents import Document
+
+from rag.monitoring.evaluation_metrics.evaluation import EvaluationMetrics
+from rag.monitoring.openai_stub import StubServer
+
+
+def fake_retriever(query: str):
+    return [Document(
+        page_content=f"APT29 used spear phishing emails to deliver malware related to {query}.",
+        metadata={"source": "report.pdf"},
+    )]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def test_runner_is_concurrent_and_cached(tmp_path):
+    active, peak, calls = 0, 0, 0
+
+    async def generator(query, context):
+        nonlocal active, peak, calls
+        calls += 1
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+        return f"answer to {query}"
+
+    runner = EvaluationMetrics(
+        retrievers={"text_only": fake_retriever},
+        model_name="test-model",
+        generator=generator,
+        cache_dir=str(tmp_path / "cache"),
+        max_concurrency=4,
+    )
+    queries = [f"query {i}" for i in range(12)]
+    updates = []
+
+    df = await runner.arun_evaluation_comparison(queries, on_update=lambda d: updates.append(len(d)))
+    assert len(df) == 12 and not df["cached"].any()
+    assert peak == 4
+    assert updates == list(range(1, 13))
+
+    df = await runner.arun_evaluation_comparison(queries)
+    assert df["cached"].all()
+    assert calls == 12
+
+
+async def test_runner_with_openai_stub(tmp_path):
+    with StubServer(port=free_port()) as stub:
+        runner = EvaluationMetrics(
+            retrievers={"text_only": fake_retriever, "graph_enhanced": lambda q: fake_retriever(q) * 2},
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            cache_dir=None,
+        )
+        results = await runner.arun_all_metrics({
+            "test_queries": [{"query": "phishing", "reference": "APT29 used spear phishing emails"}],
+        })
+
+    assert set(results) == {"text_only", "graph_enhanced", "summary"}
+    row = results["text_only"].iloc[0]
+    assert row["error"] is None
+    assert "APT29" in row["answer"]
+    assert row["context_overlap"] > 0.9
+    assert row["reference_f1"] > 0
@@ -0,0 +1,165 @@
+import asyncio
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import httpx
+from fastapi import FastAPI, UploadFile
+
+from rag.api.file_api import file_api as file_api_module
+from rag.api.file_api.file_api import UploadStore
+from rag.vector.ingestion import IngestionJobQueue
+
+
+class ChunkCountingFile(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.reads.append(len(chunk))
+        return chunk
+
+
+def test_streamed_hash_and_dedup(tmp_path):
+    store = UploadStore(str(tmp_path / "file_uploads"), str(tmp_path / "file_info.db"), legacy_json=None)
+    data = os.urandom(3 * 1024 * 1024 + 7)
+
+    source = ChunkCountingFile(data)
+    first = store.save(source, "report.PDF")
+    # 按块读取，而不是一次读入整个文件
+    assert max(source.reads) <= 1024 * 1024
+    assert first["saved_name"].endswith(".pdf")
+    assert first["size"] == len(data)
+    assert not first["duplicate"]
+
+    second = store.save(io.BytesIO(data), "copy.pdf")
+    assert second["duplicate"]
+    assert second["saved_name"] == first["saved_name"]
+    assert os.listdir(store.upload_dir) == [first["saved_name"]]
+    assert os.listdir(store.temp_dir) == []
+    assert [u["original_name"] for u in store.uploads(first["hash"])] == ["report.PDF", "copy.pdf"]
+
+
+def test_legacy_json_is_imported(tmp_path):
+    legacy = tmp_path / "file_info.json"
+    legacy.write_text('{"abc": {"original_name": "old.txt", "upload_time": "2024-01-01T00:00:00"}}')
+    store = UploadStore(str(tmp_path / "file_uploads"), str(tmp_path / "file_info.db"), legacy_json=str(legacy))
+    UploadStore(str(tmp_path / "file_uploads"), str(tmp_path / "file_info.db"), legacy_json=str(legacy))
+    assert store.uploads("abc") == [{"original_name": "old.txt", "upload_time": "2024-01-01T00:00:00"}]
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_tar_gz(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def make_app(tmp_path, monkeypatch):
+    store = UploadStore(str(tmp_path / "file_uploads"), str(tmp_path / "file_info.db"), legacy_json=None)
+    monkeypatch.setattr(file_api_module, "upload_store", store)
+    ingested = []
+    queue = IngestionJobQueue(lambda: lambda files, progress: ingested.extend(files) or {}, workers=1)
+    monkeypatch.setattr(file_api_module, "ingestion_queue", queue)
+    app = FastAPI()
+    app.include_router(file_api_module.file_api)
+    return app, store, queue, ingested
+
+
+async def upload(app, files):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/upload/", files=files)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    return events[:-1], events[-1]
+
+
+async def test_parallel_upload_endpoint(tmp_path, monkeypatch):
+    app, store, queue, ingested = make_app(tmp_path, monkeypatch)
+    files = [("files", (f"doc{i}.txt", f"content {i % 2}".encode(), "text/plain")) for i in range(4)]
+    events, complete = await upload(app, files)
+
+    assert len(events) == 4
+    assert len({e["hash"] for e in events}) == 2
+    assert sum(e["duplicate"] for e in events) == 2
+    assert complete["files"] == 4 and complete["duplicates"] == 2
+    assert len(os.listdir(store.upload_dir)) == 2
+
+    # 只有新内容进入入库任务
+    job = await queue.wait(complete["job_id"])
+    await queue.stop()
+    assert job.status == "succeeded"
+    assert sorted(ingested) == sorted(os.listdir(store.upload_dir))
+    # 响应的后台任务不会重复提交
+    assert queue.stats()["jobs"] == {"succeeded": 1}
+
+
+async def test_disconnect_still_submits_saved_files(tmp_path, monkeypatch):
+    _, store, queue, ingested = make_app(tmp_path, monkeypatch)
+    files = [UploadFile(io.BytesIO(f"content {i}".encode()), filename=f"doc{i}.txt") for i in range(3)]
+    response = await file_api_module.upload_files(files=files, priority=10)
+
+    # 客户端读到第一行后断开，不会收到 complete
+    first = json.loads(await response.body_iterator.__anext__())
+    await response.body_iterator.aclose()
+    await response.background()
+    await asyncio.wait_for(queue.wait(next(iter(queue._jobs))), timeout=5)
+    await queue.stop()
+
+    assert first["saved_name"] in ingested
+    assert set(ingested) <= set(os.listdir(store.upload_dir))
+
+
+async def test_archive_upload_is_stream_extracted(tmp_path, monkeypatch):
+    app, store, queue, ingested = make_app(tmp_path, monkeypatch)
+    zipped = make_zip({"reports/a.txt": b"alpha", "reports/b.pdf": b"%PDF-beta", "reports/logo.png": b"png"})
+    tarred = make_tar_gz({"c.json": b'{"c": 1}', "a-copy.txt": b"alpha"})
+    files = [
+        ("files", ("reports.zip", zipped, "application/zip")),
+        ("files", ("more.tar.gz", tarred, "application/gzip")),
+        ("files", ("broken.zip", b"not a zip", "application/zip")),
+    ]
+    events, complete = await upload(app, files)
+
+    saved = {e["original_name"]: e for e in events if e["event"] == "file"}
+    assert set(saved) == {"reports.zip/reports/a.txt", "reports.zip/reports/b.pdf",
+                          "more.tar.gz/c.json", "more.tar.gz/a-copy.txt"}
+    assert saved["reports.zip/reports/b.pdf"]["saved_name"].endswith(".pdf")
+    assert [e["filename"] for e in events if e["event"] == "skipped"] == ["reports.zip/reports/logo.png"]
+    assert [e["filename"] for e in events if e["event"] == "error"] == ["broken.zip"]
+    assert complete == {"event": "complete", "files": 4, "duplicates": 1, "skipped": 1, "errors": 1,
+                        "job_id": complete["job_id"]}
+    # 解压不在上传目录或临时目录留下目录结构
+    assert len(os.listdir(store.upload_dir)) == 3
+    assert os.listdir(store.temp_dir) == []
+
+    await queue.wait(complete["job_id"])
+    await queue.stop()
+    assert len(ingested) == 3
+
+
+async def test_archive_member_limit(tmp_path, monkeypatch):
+    app, store, queue, _ = make_app(tmp_path, monkeypatch)
+    monkeypatch.setattr(file_api_module, "ARCHIVE_MAX_MEMBERS", 2)
+    zipped = make_zip({f"doc{i}.txt": f"doc {i}".encode() for i in range(5)})
+    events, complete = await upload(app, [("files", ("many.zip", zipped, "application/zip"))])
+    await queue.stop()
+
+    assert complete["files"] == 2
+    assert "超出限制" in events[-1]["error"]
@@ -0,0 +1,23 @@
+from rag.monitoring.import_time import IMPORT_BUDGETS, check_budgets, parse_importtime
+
+
+def test_parse_importtime():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     json.decoder\n"
+        "import time:       300 |        420 |   json\n"
+        "import time:      1000 |       1420 | rag.monitoring.runtime_metrics\n"
+    )
+    records = parse_importtime(stderr)
+    assert records[-1] == {
+        "module": "rag.monitoring.runtime_metrics", "self_us": 1000, "cumulative_us": 1420, "depth": 0
+    }
+    assert [r["depth"] for r in records] == [2, 1, 0]
+
+
+def test_server_import_stays_within_budget():
+    budgets = {m: IMPORT_BUDGETS[m] for m in ("rag.api.server", "rag.api.resources")}
+    for report in check_budgets(budgets, top=5):
+        # 向量库、嵌入模型、LLM客户端与 copilotkit 由需要它们的组件在启动阶段加载
+        assert report["heavy_modules"] == [], report
+        assert report["ok"], report
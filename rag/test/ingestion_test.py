@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from rag.api.file_api import file_api as file_api_module
+from rag.vector.ingestion import IngestionJobQueue
+
+
+class FakeIngest:
+    """按阶段报告进度的入库函数，记录执行顺序与最大并发数"""
+
+    def __init__(self, delay=0.02, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.order = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, files, progress):
+        with self._lock:
+            self.order.append(files[0])
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            for stage in ("parsed", "chunked", "embedded", "indexed"):
+                time.sleep(self.delay)
+                if stage == self.fail_on:
+                    raise RuntimeError("embedding failed")
+                progress(stage, len(files))
+            return {"files": len(files)}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+async def test_priority_order_and_bounded_workers():
+    ingest = FakeIngest()
+    queue = IngestionJobQueue(lambda: ingest, workers=2)
+    await queue.start()
+    # 提交期间工作协程尚未运行，全部任务按优先级、同优先级按提交顺序执行
+    jobs = [await queue.submit([name], priority=p) for name, p in
+            [("a", 5), ("b", 5), ("low", 20), ("high", 0), ("mid", 10)]]
+    for job in jobs:
+        await queue.wait(job.job_id)
+    await queue.stop()
+
+    assert ingest.order == ["high", "a", "b", "mid", "low"]
+    assert ingest.max_running == 2
+    status = jobs[0].as_dict()
+    assert status["status"] == "succeeded"
+    assert status["result"] == {"files": 1}
+    assert [s["count"] for s in status["stages"].values()] == [1, 1, 1, 1]
+    assert all(s["seconds"] >= 0.015 for s in status["stages"].values())
+
+
+async def test_waiting_jobs_do_not_hold_workers():
+    published = asyncio.Event()
+    ingest = FakeIngest(delay=0)
+
+    async def await_published(files, progress):
+        await published.wait()
+        progress("indexed", len(files))
+        return {"files": len(files)}
+
+    # 第一个任务等待其他进程入库，不占用唯一的工作协程
+    ingest_funcs = iter([await_published, ingest])
+    queue = IngestionJobQueue(lambda: next(ingest_funcs), workers=1)
+    waiting = await queue.submit(["remote.pdf"])
+    while waiting.status != "running":
+        await asyncio.sleep(0.01)
+    local = await asyncio.wait_for(queue.wait((await queue.submit(["local.pdf"])).job_id), timeout=5)
+    assert local.status == "succeeded"
+    assert waiting.status == "running"
+    assert queue.stats()["waiting"] == 1
+
+    published.set()
+    await asyncio.wait_for(queue.wait(waiting.job_id), timeout=5)
+    await queue.stop()
+    assert waiting.as_dict()["stages"]["indexed"]["count"] == 1
+    assert queue.stats()["waiting"] == 0
+
+
+async def test_failed_job_reports_stage_and_error():
+    queue = IngestionJobQueue(lambda: FakeIngest(delay=0, fail_on="embedded"), workers=1)
+    job = await queue.wait((await queue.submit(["doc.pdf"])).job_id)
+    await queue.stop()
+
+    status = job.as_dict()
+    assert status["status"] == "failed"
+    assert "embedding failed" in status["error"]
+    assert status["stages"]["chunked"]["status"] == "done"
+    assert status["stages"]["embedded"] == {"status": "pending"}
+
+
+async def test_job_status_endpoint(monkeypatch):
+    release = threading.Event()
+
+    def ingest(files, progress):
+        progress("parsed", 3)
+        release.wait(5)
+        return {}
+
+    queue = IngestionJobQueue(lambda: ingest, workers=1)
+    monkeypatch.setattr(file_api_module, "ingestion_queue", queue)
+    app = FastAPI()
+    app.include_router(file_api_module.file_api)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        job = await queue.submit(["doc.pdf"])
+        while "parsed" not in job.stages:
+            await asyncio.sleep(0.01)
+        running = (await client.get(f"/ingest/jobs/{job.job_id}")).json()
+        release.set()
+        await queue.wait(job.job_id)
+        missing = await client.get("/ingest/jobs/unknown")
+    await queue.stop()
+
+    assert running["status"] == "running"
+    assert running["stages"]["parsed"]["count"] == 3
+    assert running["stages"]["chunked"] == {"status": "running"}
+    assert missing.status_code == 404
@@ -0,0 +1,53 @@
+from rag.chains.conversation_chain import StreamingConversationChain
+from rag.chains.llm_pool import LLMClientPool
+from rag.monitoring.openai_stub import StubServer
+from rag.test.answer_cache_test import FakeVectorDatabase
+from rag.test.evaluation_test import free_port
+
+
+def test_clients_are_reused_by_key():
+    pool = LLMClientPool()
+    first = pool.get_llm("openai", "m", api_base="http://x/v1", api_key="k", temperature=0.7, max_tokens=10)
+    again = pool.get_llm("openai", "m", api_base="http://x/v1", api_key="k", temperature=0.7, max_tokens=10)
+    other = pool.get_llm("openai", "m", api_base="http://x/v1", api_key="k", temperature=0.3, max_tokens=10)
+
+    assert first is again
+    assert other is not first
+    # 同一 api_base 共享同一个异步HTTP客户端
+    assert other.async_client._client._client is first.async_client._client._client
+    assert pool.stats()["clients_created"] == 2
+    assert pool.stats()["client_reuses"] == 1
+
+
+async def test_chains_share_pooled_connections():
+    pool = LLMClientPool()
+    with StubServer(port=free_port()) as stub:
+        chains = [
+            StreamingConversationChain(
+                model_name="stub-model",
+                api_base=stub.api_base,
+                api_key="stub",
+                use_rag=True,
+                vector_database=FakeVectorDatabase(),
+                llm_pool=pool,
+            )
+            for _ in range(2)
+        ]
+        for chain in chains * 2:
+            conversation_id = await chain.get_or_create_conversation(None)
+            chunks = [chunk async for chunk in chain.astream("who is apt29", conversation_id)]
+            assert len(chunks) > 1
+        assert pool.stats()["clients_created"] == 1
+        assert pool.stats()["http_requests"] == 4
+
+        # 流式响应在 [DONE] 后即被SDK关闭，连接复用用非流式请求验证
+        llm = pool.get_llm("openai", "stub-model", stub.api_base, "stub", temperature=0.3, streaming=False)
+        before = pool.stats()["http_new_connections"]
+        for _ in range(3):
+            await llm.ainvoke("APT29 is a threat group.\nwho is apt29")
+        stats = pool.stats()
+        await pool.aclose()
+
+    assert stats["http_requests"] == 7
+    assert stats["http_new_connections"] - before == 1
+    assert stats["http_connection_reuses"] >= 2
@@ -0,0 +1,51 @@
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from rag.monitoring.load_test.load_test import percentiles, run_load_test
+from rag.monitoring.openai_stub import StubServer
+from rag.test.evaluation_test import free_port
+
+
+def fake_chat_app() -> FastAPI:
+    """按 /chat/stream 的SSE格式输出固定token的模拟对话服务"""
+    app = FastAPI()
+
+    @app.post("/chat/stream")
+    async def chat_stream():
+        async def frames():
+            yield "data:[conversation_id]:c1\n\n"
+            yield "data: [rag_context]:[]\n\n"
+            for token in ["APT29 ", "uses ", "phishing."]:
+                await asyncio.sleep(0.01)
+                yield f"data: {json.dumps({'type': 'conversation', 'data': token})}\n\n"
+            yield "data:[conversation_title]:APT29\n\n"
+            yield "event: complete\ndata: {}\n\n"
+
+        return StreamingResponse(frames(), media_type="text/event-stream")
+
+    return app
+
+
+def test_percentiles_nearest_rank():
+    assert percentiles([0.001 * i for i in range(1, 101)]) == {"p50": 50.0, "p90": 90.0, "p99": 99.0}
+    assert percentiles([]) == {"p50": 0.0, "p90": 0.0, "p99": 0.0}
+
+
+async def test_run_load_test_reports_streaming_metrics():
+    port = free_port()
+    with StubServer(port=port, app=fake_chat_app()):
+        report = await run_load_test(
+            f"http://127.0.0.1:{port}", concurrency=4, requests=12, server_pid=os.getpid()
+        )
+
+    assert report["succeeded"] == 12
+    assert report["errors"] == {}
+    assert report["requests_per_second"] > 0
+    assert report["tokens_per_second"] > 0
+    assert report["ttft_ms"]["p50"] >= 10
+    assert report["inter_token_ms"]["p50"] >= 5
+    assert report["server"]["peak_rss_mb"] > 0
@@ -0,0 +1,62 @@
+import faiss
+import numpy as np
+import pytest
+from langchain_community.vectorstores.utils import maximal_marginal_relevance as langchain_mmr
+
+from rag.test.benchmark.mmr_benchmark import build_store
+from rag.vector.mmr import _fetch_candidates, maximal_marginal_relevance, mmr_search_by_vector
+
+
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.5, 1.0])
+def test_mmr_matches_langchain(lambda_mult):
+    rng = np.random.default_rng(42)
+    query = rng.standard_normal(64).astype(np.float32)
+    candidates = rng.standard_normal((200, 64)).astype(np.float32)
+
+    selected, _ = maximal_marginal_relevance(query, candidates, k=8, lambda_mult=lambda_mult)
+    expected = langchain_mmr(query, list(candidates), k=8, lambda_mult=lambda_mult)
+
+    assert selected == expected
+
+
+def test_mmr_handles_empty_and_small_candidates():
+    query = np.ones(4, dtype=np.float32)
+    assert maximal_marginal_relevance(query, np.empty((0, 4)), k=3)[0] == []
+
+    selected, _ = maximal_marginal_relevance(query, np.eye(4)[:2], k=5)
+    assert sorted(selected) == [0, 1]
+
+
+def test_mmr_search_by_vector():
+    store = build_store(num_docs=500, dim=32)
+    query = np.random.default_rng(7).standard_normal(32).tolist()
+
+    results = mmr_search_by_vector(store, query, k=5, fetch_k=50)
+    expected = store.max_marginal_relevance_search_by_vector(query, k=5, fetch_k=50)
+
+    assert [doc.page_content for doc, _ in results] == [doc.page_content for doc in expected]
+    # 相似度阈值过高时没有候选
+    assert mmr_search_by_vector(store, query, k=5, fetch_k=50, score_threshold=1.1) == []
+
+
+def test_fetch_candidates_on_ivf_without_direct_map():
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((400, 16)).astype(np.float32)
+    index = faiss.IndexIVFFlat(faiss.IndexFlatL2(16), 16, 4)
+    index.train(vectors)
+    index.add(vectors)
+    index.nprobe = 4
+
+    class NoSearchAndReconstruct:
+        """模拟不支持 search_and_reconstruct 的索引，走 reconstruct_batch 回退路径"""
+        d = index.d
+
+        def search_and_reconstruct(self, *_):
+            raise RuntimeError("search_and_reconstruct not implemented")
+
+        def __getattr__(self, name):
+            return getattr(index, name)
+
+    positions, candidates = _fetch_candidates(NoSearchAndReconstruct(), vectors[:1], 10)
+    assert positions.size == 10
+    np.testing.assert_allclose(candidates, vectors[positions])
@@ -0,0 +1,77 @@
+import numpy as np
+from langchain_core.documents import Document
+
+from rag.monitoring.retrieval_metrics.recall_calculator import (
+    RetrievalBenchmark,
+    compare_reports,
+    recall_and_mrr,
+)
+from rag.test.benchmark.mmr_benchmark import build_store
+
+
+def make_benchmark(num_docs=300, dim=16):
+    store = build_store(num_docs=num_docs, dim=dim)
+    vectors = store.index.reconstruct_n(0, num_docs)
+    rng = np.random.default_rng(3)
+
+    def embed_query(query: str):
+        position = int(query.split()[-1])
+        return (vectors[position] + rng.normal(scale=0.01, size=dim)).tolist()
+
+    return store, RetrievalBenchmark(store, embed_query)
+
+
+def test_recall_and_mrr():
+    metrics = recall_and_mrr([[1, 2, 3], [9, 8, 7]], [[1, 2, 4], [7, 8, 9]], k=3)
+    assert metrics["recall@3"] == (2 / 3 + 1) / 2
+    assert metrics["mrr"] == (1.0 + 1 / 3) / 2
+
+
+def test_flat_index_and_retriever_have_full_recall():
+    store, benchmark = make_benchmark()
+    queries = [f"chunk {i}" for i in range(0, 300, 10)]
+    report = benchmark.run(
+        queries=queries,
+        k=5,
+        index_specs=["Flat"],
+        retrievers={
+            "similarity": lambda query, k: store.similarity_search_by_vector(benchmark.embed_query(query), k=k)
+        },
+    )
+
+    assert report["num_queries"] == len(queries)
+    for result in report["results"]:
+        assert result["recall@5"] == 1.0
+        assert result["mrr"] == 1.0
+        assert result["qps"] > 0
+        assert result["p50_ms"] <= result["p99_ms"]
+
+
+def test_generate_queries_uses_entities():
+    store, benchmark = make_benchmark(num_docs=3)
+    store.docstore.delete([store.index_to_docstore_id[0]])
+    store.docstore.add({store.index_to_docstore_id[0]: Document(
+        page_content="APT29 exploited CVE-2023-23397 from 10.0.0.1",
+        metadata={"source": "reports/cozy_bear.pdf"},
+    )})
+
+    queries = benchmark.generate_queries(max_queries=10)
+    assert any(q.startswith("cozy_bear") for q in queries)
+
+
+def test_compare_reports_flags_regressions():
+    baseline = {"results": [{"name": "HNSW32", "recall@5": 0.95, "mrr": 0.9, "p95_ms": 1.0}]}
+    current = {"results": [{"name": "HNSW32", "recall@5": 0.80, "mrr": 0.9, "p95_ms": 2.0}]}
+
+    regressions = compare_reports(baseline, current)
+    assert len(regressions) == 2
+    assert compare_reports(baseline, baseline) == []
+
+
+def test_positions_ignore_missing_documents():
+    store, benchmark = make_benchmark(num_docs=5)
+    third = store.docstore.search(store.index_to_docstore_id[3])
+    store.docstore.delete([store.index_to_docstore_id[1]])
+
+    # 按内容映射时（检索结果没有id），缺失的文档不影响后面文档的索引位置
+    assert benchmark._position_of(Document(page_content=third.page_content)) == 3
@@ -0,0 +1,50 @@
+from rag.chains.conversation_chain import StreamingConversationChain
+from rag.monitoring.openai_stub import StubServer
+from rag.monitoring.request_timing import stage, start_request_timing
+from rag.monitoring.runtime_metrics import MetricsRegistry, REGISTRY, render_prometheus
+from rag.test.answer_cache_test import FakeVectorDatabase
+from rag.test.evaluation_test import free_port
+
+
+class TimedVectorDatabase(FakeVectorDatabase):
+    def query_vector_database(self, query):
+        with stage("faiss_search"):
+            return super().query_vector_database(query)
+
+
+def test_render_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "请求数").inc(3)
+    registry.gauge("in_flight").set(2)
+    histogram = registry.histogram("latency_seconds", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+
+    text = render_prometheus(registry)
+    assert "# HELP requests_total 请求数\n# TYPE requests_total counter\nrequests_total 3\n" in text
+    assert "# TYPE in_flight gauge\nin_flight 2\n" in text
+    assert 'latency_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'latency_seconds_bucket{le="1"} 2\n' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2\n' in text
+    assert "latency_seconds_sum 0.55\nlatency_seconds_count 2\n" in text
+
+
+async def test_chain_stages_are_recorded_per_request():
+    with StubServer(port=free_port(), tokens_per_second=200) as stub:
+        chain = StreamingConversationChain(
+            model_name="stub-model",
+            api_base=stub.api_base,
+            api_key="stub",
+            use_rag=True,
+            vector_database=TimedVectorDatabase(),
+        )
+        conversation_id = await chain.get_or_create_conversation(None)
+        timing = start_request_timing()
+        chunks = [chunk async for chunk in chain.astream("who is apt29", conversation_id)]
+
+    # 检索线程中记录的阶段同样汇总到当前请求
+    assert {"retrieval", "faiss_search", "prompt_build", "ttft", "generation"} <= set(timing.stages)
+    assert timing.counts["tokens"] == len(chunks) - 1
+    assert timing.stages["ttft"] <= timing.stages["generation"]
+    assert "faiss_search;dur=" in timing.server_timing()
+    assert "chat_stage_generation_seconds_count" in render_prometheus(REGISTRY)
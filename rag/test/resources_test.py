@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+
+from rag.api.resources import ResourceManager
+
+
+class FakeIndex:
+    def __init__(self):
+        self.startup_times = {"embedding_model": 0.1, "faiss_index": 0.05}
+
+
+async def test_components_start_once_in_parallel_and_stop_in_reverse():
+    calls, stopped = [], []
+
+    def slow(name, result):
+        def start():
+            calls.append(name)
+            time.sleep(0.2)
+            return result
+        return start
+
+    async def async_start():
+        calls.append("llm_pool")
+        await asyncio.sleep(0.2)
+        return "pool"
+
+    resources = ResourceManager()
+    resources.register("vector_database", slow("vector_database", FakeIndex()), stopped.append)
+    resources.register("llm_pool", async_start, stopped.append)
+
+    start = time.perf_counter()
+    await asyncio.gather(resources.startup(), resources.startup())
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.35
+    assert sorted(calls) == ["llm_pool", "vector_database"]
+    assert resources.get("llm_pool") == "pool"
+    stats = resources.stats()
+    assert stats["ready"]
+    assert stats["components"]["vector_database"]["startup_seconds"] >= 0.2
+    assert stats["components"]["vector_database"]["breakdown"]["faiss_index"] == 0.05
+
+    await resources.shutdown()
+    assert len(stopped) == 2 and "pool" in stopped
+    assert resources.get("llm_pool") is None
+
+
+async def test_required_failure_stops_started_components():
+    stopped = []
+
+    def broken():
+        time.sleep(0.05)
+        raise RuntimeError("无法初始化嵌入模型")
+
+    resources = ResourceManager()
+    resources.register("llm_pool", lambda: "pool", stopped.append)
+    resources.register("neo4j", broken, required=False)
+    resources.register("vector_database", broken)
+
+    with pytest.raises(RuntimeError):
+        await resources.startup()
+    assert stopped == ["pool"]
+    assert not resources.ready
+    assert resources.stats()["components"]["neo4j"]["error"] == "RuntimeError: 无法初始化嵌入模型"
+
+
+async def test_optional_failure_is_skipped():
+    resources = ResourceManager()
+    resources.register("llm_pool", lambda: "pool")
+    resources.register("neo4j", lambda: 1 / 0, required=False)
+
+    await resources.startup()
+    assert resources.ready
+    assert resources.get("neo4j") is None
+    assert resources.stats()["components"]["neo4j"]["started"] is False
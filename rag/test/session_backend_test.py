@@ -0,0 +1,79 @@
+import pytest
+
+from rag.chains.conversation_store import ConversationStore
+from rag.chains.session_backend import RedisSessionBackend, SQLiteSessionBackend, create_session_backend
+
+
+def assert_workers_share_conversations(worker_a: ConversationStore, worker_b: ConversationStore):
+    conversation_id = worker_a.create().conversation_id
+    worker_a.save_turn(conversation_id, "who is apt29", "a threat group")
+
+    assert conversation_id in worker_b
+    assert [m.content for m in worker_b.history(conversation_id)] == ["who is apt29", "a threat group"]
+
+    # B 写入新一轮后，A 的进程内缓存按版本号失效并重新加载
+    worker_b.save_turn(conversation_id, "what malware", "several families")
+    worker_b.set_title(conversation_id, "APT29")
+    state = worker_a.get(conversation_id)
+    assert len(state.messages) == 4
+    assert state.title == "APT29"
+
+
+def test_sqlite_backend_shared_between_workers(tmp_path):
+    url = f"sqlite:///{tmp_path}/sessions.db"
+    worker_a = ConversationStore(backend=create_session_backend(url))
+    worker_b = ConversationStore(backend=create_session_backend(url))
+    assert isinstance(worker_a.backend, SQLiteSessionBackend)
+    assert worker_a.write_through
+
+    assert_workers_share_conversations(worker_a, worker_b)
+
+
+def test_redis_backend_shared_between_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    worker_a = ConversationStore(backend=RedisSessionBackend(fakeredis.FakeRedis(server=server)))
+    worker_b = ConversationStore(backend=RedisSessionBackend(fakeredis.FakeRedis(server=server)))
+
+    assert_workers_share_conversations(worker_a, worker_b)
+
+
+class InterleavingBackend(SQLiteSessionBackend):
+    """第一次写入前先执行 before_first_write，模拟另一个worker在读取与写入之间抢先写入"""
+
+    def __init__(self, path, before_first_write):
+        super().__init__(path)
+        self.before_first_write = before_first_write
+
+    def save_if_version(self, conversation_id, data, expected_version):
+        hook, self.before_first_write = self.before_first_write, None
+        if hook is not None:
+            hook()
+        return super().save_if_version(conversation_id, data, expected_version)
+
+
+def test_concurrent_writes_are_not_lost(tmp_path):
+    path = f"{tmp_path}/sessions.db"
+    worker_b = ConversationStore(backend=SQLiteSessionBackend(path))
+    conversation_id = worker_b.create().conversation_id
+    worker_a = ConversationStore(backend=InterleavingBackend(
+        path, lambda: worker_b.save_turn(conversation_id, "what malware", "several families")
+    ))
+
+    # A 的写入因版本冲突失败后重新加载会话并重放，B 的一轮对话不会被覆盖
+    worker_a.save_turn(conversation_id, "who is apt29", "a threat group")
+
+    state = worker_b.get(conversation_id)
+    assert [m.content for m in state.messages] == [
+        "what malware", "several families", "who is apt29", "a threat group"
+    ]
+    assert state.version == 2
+
+
+def test_fakeredis_url_is_not_shared():
+    pytest.importorskip("fakeredis")
+    backend = create_session_backend("fakeredis://")
+
+    # fakeredis 的数据只在当前进程内，不能启用写穿
+    assert not backend.shared
+    assert not ConversationStore(backend=backend).write_through
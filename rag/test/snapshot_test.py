@@ -0,0 +1,84 @@
+import os
+import threading
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from rag.vector.faiss import FaissVectorDatabase
+from rag.vector.snapshot import SnapshotWatcher, publish_snapshot, read_manifest
+
+embeddings = DeterministicFakeEmbedding(size=16)
+
+
+def make_store(texts):
+    return FAISS.from_texts(texts, embeddings)
+
+
+def test_publish_is_atomic_and_prunes_old_snapshots(tmp_path):
+    root = str(tmp_path / "snapshots")
+    assert read_manifest(root) is None
+
+    for version in range(1, 5):
+        manifest = publish_snapshot(make_store([f"doc {i}" for i in range(version)]), root, version, [f"{version}.pdf"])
+
+    assert read_manifest(root) == manifest
+    assert manifest["snapshot"] == "v000004"
+    assert manifest["ntotal"] == 4
+    # 只保留最近3个快照，没有遗留临时目录或临时清单
+    assert sorted(os.listdir(root)) == ["manifest.json", "v000002", "v000003", "v000004"]
+
+
+def test_watcher_loads_new_versions_only(tmp_path):
+    root = str(tmp_path / "snapshots")
+    loaded = []
+    watcher = SnapshotWatcher(root, lambda manifest: loaded.append(manifest["version"]), interval=0.01)
+    assert not watcher.check()
+
+    publish_snapshot(make_store(["a"]), root, 1, ["a.pdf"])
+    assert watcher.check()
+    # 清单未变化时只做一次 stat
+    assert not watcher.check()
+
+    watcher.start()
+    try:
+        threading.Timer(0.05, lambda: publish_snapshot(make_store(["a", "b"]), root, 2, ["a.pdf", "b.pdf"])).start()
+        manifest = watcher.wait_for(lambda m: "b.pdf" in m["files"], timeout=5)
+        with pytest.raises(TimeoutError):
+            watcher.wait_for(lambda m: "c.pdf" in m["files"], timeout=0.05)
+    finally:
+        watcher.stop()
+    assert manifest["version"] == 2
+    assert loaded == [1, 2]
+
+
+async def test_watcher_await_for_polls_without_threads(tmp_path):
+    root = str(tmp_path / "snapshots")
+    watcher = SnapshotWatcher(root, lambda manifest: None, interval=0.01).start()
+    try:
+        threading.Timer(0.05, lambda: publish_snapshot(make_store(["a"]), root, 1, ["a.pdf"])).start()
+        manifest = await watcher.await_for(lambda m: "a.pdf" in m["files"], timeout=5)
+        with pytest.raises(TimeoutError):
+            await watcher.await_for(lambda m: "b.pdf" in m["files"], timeout=0.05)
+    finally:
+        watcher.stop()
+    assert manifest["version"] == 1
+
+
+def test_reader_swaps_in_published_snapshot(tmp_path):
+    root = str(tmp_path / "snapshots")
+    reader = FaissVectorDatabase.__new__(FaissVectorDatabase)
+    reader.embeddings = embeddings
+    reader.snapshot_dir = root
+    reader.index_lock = threading.RLock()
+    reader.index_version = 0
+    reader.vector_store = make_store(["初始化"])
+
+    publish_snapshot(make_store(["apt29 uses spearphishing", "lazarus targets banks"]), root, 3, ["r.pdf"])
+    reader.load_snapshot(read_manifest(root))
+    assert reader.index_version == 3
+    assert reader.vector_store.index.ntotal == 2
+
+    # 旧版本的清单不会覆盖已加载的快照
+    reader.load_snapshot({**read_manifest(root), "version": 2, "ntotal": 0})
+    assert reader.vector_store.index.ntotal == 2
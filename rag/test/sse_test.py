@@ -0,0 +1,52 @@
+import asyncio
+import json
+import time
+
+from rag.chains.sse import SSEStats, TokenCoalescer, encode_event
+
+
+async def fake_events(delays):
+    yield "rag_context", [{"source": "apt29.pdf"}]
+    for i, delay in enumerate(delays):
+        await asyncio.sleep(delay)
+        yield "token", f"t{i} "
+    yield "error", "boom"
+
+
+async def test_tokens_are_coalesced_by_time_and_size():
+    stats = SSEStats()
+    coalescer = TokenCoalescer(flush_interval=0.02, max_bytes=64)
+    # 10个token几乎同时到达，随后停顿，再到达最后一个token
+    delays = [0.0] * 10 + [0.1]
+    events = [event async for event in coalescer.coalesce(fake_events(delays), stats)]
+
+    assert events[0] == ("rag_context", [{"source": "apt29.pdf"}])
+    assert events[-1] == ("error", "boom")
+    tokens = [payload for kind, payload in events if kind == "token"]
+    assert "".join(tokens) == "".join(f"t{i} " for i in range(11))
+    # 停顿前的token合并为一帧，停顿后的token单独成帧
+    assert tokens == ["".join(f"t{i} " for i in range(10)), "t10 "]
+    assert stats.tokens == 11
+
+    small = TokenCoalescer(flush_interval=10, max_bytes=8)
+    sized = [p async for k, p in small.coalesce(fake_events([0.0] * 6)) if k == "token"]
+    assert all(len(chunk.encode()) >= 8 for chunk in sized[:-1])
+
+
+async def test_stalled_buffer_is_flushed_on_timer():
+    coalescer = TokenCoalescer(flush_interval=0.02, max_bytes=1024)
+    arrivals = {}
+    start = time.perf_counter()
+    async for kind, payload in coalescer.coalesce(fake_events([0.0, 0.3])):
+        arrivals.setdefault(payload if kind == "token" else kind, time.perf_counter() - start)
+
+    # 第一个token不必等到下一个token（0.3秒后）才写出
+    assert arrivals["t0 "] < 0.15
+
+
+def test_frames_are_counted():
+    stats = SSEStats()
+    frame = stats.frame(encode_event("token", "威胁"))
+    assert frame.startswith("data: ")
+    assert json.loads(frame[len("data: "):])["data"] == "威胁"
+    assert stats.as_dict() == {"bytes": len(frame.encode("utf-8")), "frames": 1, "tokens": 0}
@@ -0,0 +1,48 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+from rag.chains.title_generator import TitleGenerator, heuristic_title
+
+
+class FakeTitleLLM:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return AIMessage(content='{"title": "APT29分析"}')
+
+
+def test_heuristic_title_extracts_keywords():
+    assert heuristic_title("什么是威胁情报分析？") == "威胁情报分析"
+    assert heuristic_title("How does APT29 use spearphishing?").startswith("APT29")
+
+
+async def test_title_generated_once_per_conversation():
+    llm = FakeTitleLLM(delay=0.05)
+    generator = TitleGenerator(mode="llm", llm_factory=lambda: llm)
+
+    task = generator.schedule("c1", "who is apt29")
+    assert task is not None
+    # 生成进行中时不会重复调度
+    assert generator.schedule("c1", "who is apt29") is None
+    assert await task == "APT29分析"
+
+    assert generator.schedule("c1", "what malware does apt29 use") is None
+    assert generator.get("c1") == "APT29分析"
+    assert llm.calls == 1
+
+
+async def test_title_regenerated_on_topic_change():
+    generator = TitleGenerator(mode="heuristic", topic_overlap_threshold=0.5)
+
+    await generator.schedule("c1", "apt29 spearphishing campaigns")
+    assert generator.schedule("c1", "apt29 campaigns timeline") is None
+
+    task = generator.schedule("c1", "ransomware encryption keys")
+    assert task is not None
+    assert "ransomware" in await task
+    assert generator.stats()["generated"] == 2
@@ -5,16 +5,38 @@ from langchain_core.prompts import ChatPromptTemplate
 
 # 如果用本地embedding模型（推荐）：
 from langchain_community.embeddings import HuggingFaceEmbeddings
+import faiss
+import numpy as np
 import os
 import time
 import threading
-from typing import List, Tuple, Set
+from typing import Callable, List, Optional, Tuple, Set
 from rag.vector.vector_database import VectorDatabase
 import json
 from langchain_core.documents import Document
+from rag.vector.mmr import mmr_search_by_vector, FaissMMRRetriever
+from rag.vector.snapshot import SnapshotWatcher, publish_snapshot, read_manifest, snapshot_path
+from rag.monitoring.request_timing import stage
+
+# 入库方式
+# inline: 本进程的自动更新线程扫描上传目录并入库（默认）
+# reader: 不在本进程入库，只加载入库进程发布的索引快照（API进程在 INGESTION_MODE=worker 时使用）
+# writer: 入库进程，每次更新索引后发布快照，由 rag.vector.ingestion_worker 驱动
+INGESTION_MODES = ("inline", "reader", "writer")
+
+
 class FaissVectorDatabase(VectorDatabase):
-    def __init__(self, path: str = "../data/faiss_index"):
+    def __init__(
+        self,
+        path: str = "../data/faiss_index",
+        ingestion_mode: str = "inline",
+        snapshot_dir: Optional[str] = None,
+        snapshot_interval: float = 1.0
+    ):
         super().__init__(path)
+        if ingestion_mode not in INGESTION_MODES:
+            raise ValueError(f"不支持的入库方式: {ingestion_mode}，可选 {', '.join(INGESTION_MODES)}")
+        self.ingestion_mode = ingestion_mode
         
         # 设置路径
         base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -23,6 +45,7 @@ class FaissVectorDatabase(VectorDatabase):
         self.file_chunks_dir = os.path.join(self.data_dir, "file_chunks")
         self.index_path = os.path.join(self.data_dir, "faiss_index")
         self.exist_file_path = os.path.join(self.data_dir, "file_exist.json")
+        self.snapshot_dir = snapshot_dir or os.getenv("FAISS_SNAPSHOT_DIR", os.path.join(self.data_dir, "faiss_snapshots"))
         
         # 确保目录存在
         os.makedirs(self.file_uploads_dir, exist_ok=True)
@@ -33,6 +56,10 @@ class FaissVectorDatabase(VectorDatabase):
         model_path = os.path.abspath(os.path.join(base_dir, "../../models/embedding_model/bge-m3"))
         print(f"尝试加载嵌入模型：{model_path}")
         
+        # 嵌入模型与索引的加载耗时，供启动耗时统计
+        self.startup_times = {}
+        load_start = time.perf_counter()
+        
         # 测试嵌入模型
         try:
             self.embeddings = HuggingFaceEmbeddings(
@@ -56,37 +83,142 @@ class FaissVectorDatabase(VectorDatabase):
                 print(f"在线嵌入模型也失败: {str(e)}")
                 raise ValueError("无法初始化嵌入模型，请检查网络连接和模型安装。")
         
-        # 创建或加载向量存储
-        self.vector_store = self.load_or_create_vector_store(self.index_path)
+        self.startup_times["embedding_model"] = time.perf_counter() - load_start
         
-        # 启动自动更新线程
+        # 索引版本号，每次更新向量库后递增，用于使依赖检索结果的缓存失效
+        self.index_version = 0
+        # 保护已入库文件列表与索引写入，自动更新线程与上传触发的入库任务共用
+        self.index_lock = threading.RLock()
         self.stop_update_thread = False
-        self.update_thread = threading.Thread(target=self._auto_update_vector_store)
-        self.update_thread.daemon = True
-        self.update_thread.start()
-        print("已启动自动更新线程，每分钟检查一次新文档")
+        self.update_thread = None
+        self.snapshot_watcher = None
+        
+        # 创建或加载向量存储
+        load_start = time.perf_counter()
+        if ingestion_mode == "reader":
+            self.vector_store = self._load_published_snapshot(snapshot_interval)
+        else:
+            self.vector_store = self.load_or_create_vector_store(self.index_path)
+        self.startup_times["faiss_index"] = time.perf_counter() - load_start
+        
+        if ingestion_mode == "writer":
+            # 版本号接着已发布的快照递增，入库进程重启后API仍能识别新快照
+            manifest = read_manifest(self.snapshot_dir)
+            self.index_version = manifest["version"] if manifest else 0
+            if manifest is None:
+                self.publish_snapshot()
+        elif ingestion_mode == "inline":
+            # 启动自动更新线程
+            self.update_thread = threading.Thread(target=self._auto_update_vector_store)
+            self.update_thread.daemon = True
+            self.update_thread.start()
+            print("已启动自动更新线程，每分钟检查一次新文档")
     def query_vector_database(self, query: str)->List[Document]:
         """查询向量数据库
            使用相似度搜索获取文档列表
-           默认的嵌入模型是bge-m3
+           默认的嵌入模型是bge-m3，嵌入与检索耗时记录到请求分阶段耗时
         参数:
             query: 查询文本
         返回:
             docs: 文档列表
         """
-        return self.vector_store.similarity_search(query)
+        # 分别统计查询嵌入与FAISS检索的耗时，等价于 similarity_search
+        with stage("embedding"):
+            embedding = self.embeddings.embed_query(query)
+        return self.query_vector_database_by_vector(embedding)
+
+    def query_vector_database_by_vector(self, embedding: List[float]) -> List[Document]:
+        """按已计算的查询嵌入检索，跳过嵌入（如语义缓存已嵌入过该问题）
+        参数:
+            embedding: self.embeddings.embed_query 计算的查询嵌入
+        返回:
+            docs: 文档列表
+        """
+        with stage("faiss_search"):
+            return self.vector_store.similarity_search_by_vector(embedding)
+
+    def query_vector_database_batch(self, queries: List[str], k: int = 4) -> List[List[Document]]:
+        """批量查询向量数据库
+           所有查询一次批量嵌入、一次FAISS检索，结果与逐条调用 query_vector_database 相同
+        参数:
+            queries: 查询文本列表
+            k: 每个查询返回的文档数
+        返回:
+            docs: 每个查询的文档列表
+        """
+        if not queries:
+            return []
+        with stage("embedding"):
+            embeddings = self.embeddings.embed_documents(queries)
+        # 快照替换时整体替换 vector_store，这里只读取一次
+        vector_store = self.vector_store
+        with stage("faiss_search"):
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            if vector_store._normalize_L2:
+                faiss.normalize_L2(vectors)
+            _, indices = vector_store.index.search(vectors, k)
+        results = []
+        for row in indices:
+            docs = []
+            for i in row:
+                # 索引中的向量少于 k 时以 -1 填充
+                if i == -1:
+                    continue
+                doc = vector_store.docstore.search(vector_store.index_to_docstore_id[i])
+                if isinstance(doc, Document):
+                    docs.append(doc)
+            results.append(docs)
+        return results
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        score_threshold: float = None
+    ) -> List[Document]:
+        """最大边际相关性检索
+           候选向量直接从FAISS索引重建，只对查询做一次嵌入
+        参数:
+            query: 查询文本
+            k: 返回的文档数
+            fetch_k: 参与MMR的候选数
+            lambda_mult: 相关性与多样性的权衡系数
+            score_threshold: 可选的余弦相似度下限
+        返回:
+            docs: 文档列表
+        """
+        embedding = self.embeddings.embed_query(query)
+        docs_and_scores = mmr_search_by_vector(
+            self.vector_store,
+            embedding,
+            k=k,
+            fetch_k=fetch_k,
+            lambda_mult=lambda_mult,
+            score_threshold=score_threshold
+        )
+        return [doc for doc, _ in docs_and_scores]
+
+    def as_retriever(self, search_type: str = "similarity", search_kwargs: dict = None):
+        """获取检索器，search_type为mmr时使用向量化MMR实现"""
+        search_kwargs = search_kwargs or {}
+        if search_type == "mmr":
+            return FaissMMRRetriever(vector_database=self, **search_kwargs)
+        return self.vector_store.as_retriever(search_type=search_type, search_kwargs=search_kwargs)
     # 自动更新向量库的线程函数
     def _auto_update_vector_store(self):
         """每分钟自动检查并更新向量数据库"""
         while not self.stop_update_thread:
             try:
                 print("自动检查新文档...")
-                new_files, deleted_files = self.check_file_changes()
-                if new_files or deleted_files:
-                    print(f"检测到文件变化，新增: {len(new_files)}个，删除: {len(deleted_files)}个")
-                    if new_files:
-                        self.process_and_update_documents(new_files)
-                    # TODO: 处理已删除文件的向量数据
+                with self.index_lock:
+                    new_files, deleted_files = self.check_file_changes()
+                    if new_files or deleted_files:
+                        print(f"检测到文件变化，新增: {len(new_files)}个，删除: {len(deleted_files)}个")
+                        if new_files:
+                            self.process_and_update_documents(new_files)
+                        # TODO: 处理已删除文件的向量数据
                 # 等待60s
                 time.sleep(60)
             except Exception as e:
@@ -96,11 +228,66 @@ class FaissVectorDatabase(VectorDatabase):
     
     # 停止更新线程的方法
     def stop_auto_update(self):
-        """停止自动更新线程"""
+        """停止自动更新线程与快照监听线程"""
         self.stop_update_thread = True
-        if self.update_thread.is_alive():
+        if self.update_thread is not None and self.update_thread.is_alive():
             self.update_thread.join(timeout=2)
             print("自动更新线程已停止")
+        if self.snapshot_watcher is not None:
+            self.snapshot_watcher.stop()
+    
+    def _load_published_snapshot(self, interval: float):
+        """reader模式：加载最新发布的快照并启动清单监听线程"""
+        manifest = read_manifest(self.snapshot_dir)
+        if manifest is not None:
+            vector_store = self._load_snapshot_store(manifest)
+            self.index_version = manifest["version"]
+        elif self.faiss_index_exists(self.index_path):
+            # 入库进程尚未发布快照时只读加载已有索引，不在本进程创建或写入索引
+            print("尚未发布索引快照，加载已有向量数据库...")
+            vector_store = FAISS.load_local(
+                folder_path=self.index_path,
+                embeddings=self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+        else:
+            print("尚未发布索引快照，使用空向量数据库等待入库进程发布")
+            vector_store = FAISS.from_documents(
+                documents=[Document(page_content="初始化", metadata={"source": "faiss数据库初始化"})],
+                embedding=self.embeddings
+            )
+        self.snapshot_watcher = SnapshotWatcher(self.snapshot_dir, self.load_snapshot, interval, manifest=manifest)
+        self.snapshot_watcher.start()
+        print(f"已启动索引快照监听，每 {interval}s 检查一次 {self.snapshot_dir}")
+        return vector_store
+    
+    def _load_snapshot_store(self, manifest: dict):
+        return FAISS.load_local(
+            folder_path=snapshot_path(self.snapshot_dir, manifest),
+            embeddings=self.embeddings,
+            allow_dangerous_deserialization=True
+        )
+    
+    def load_snapshot(self, manifest: dict) -> None:
+        """加载已发布的快照并整体替换内存中的索引，查询不会看到部分更新的索引"""
+        if manifest["version"] <= self.index_version:
+            return
+        vector_store = self._load_snapshot_store(manifest)
+        with self.index_lock:
+            self.vector_store = vector_store
+            self.index_version = manifest["version"]
+        print(f"已加载索引快照 {manifest['snapshot']}，共 {manifest['ntotal']} 个向量")
+    
+    def publish_snapshot(self) -> Optional[dict]:
+        """writer模式：发布当前索引为快照，其他模式不发布"""
+        if self.ingestion_mode != "writer":
+            return None
+        with self.index_lock:
+            manifest = publish_snapshot(
+                self.vector_store, self.snapshot_dir, self.index_version, self._read_exist_files()
+            )
+        print(f"已发布索引快照 {manifest['snapshot']}")
+        return manifest
 
     # 1. 扫描本地文档
     def load_documents(self):
@@ -167,7 +354,22 @@ class FaissVectorDatabase(VectorDatabase):
             processed_files: 处理成功的文件列表
             split_docs: 分割后的文本列表
         """
+        processed_files, documents = self.parse_documents(file_list, data_path)
+        if not documents:
+            print(f"未找到有效文档")
+            return processed_files, []
+        return processed_files, self.split_documents(documents)
+    
+    def parse_documents(self, file_list: List[str], data_path: str) -> Tuple[List, List]:
+        """按扩展名选择加载器解析文档
         
+        param:
+            file_list: 文件列表
+            data_path: 文件夹路径
+        return:
+            processed_files: 处理成功的文件列表
+            documents: 解析得到的文档列表
+        """
         documents = []
         processed_files = []
         # 遍历data_path中的文件，检查是否在file_list列表中
@@ -197,21 +399,17 @@ class FaissVectorDatabase(VectorDatabase):
                         print(f"已加载文件: {file}")
                     except Exception as e:
                         print(f"加载文件 {file} 时出错: {str(e)}")
-        
-        if not documents:
-            print(f"未找到有效文档")
-            return processed_files, []
-
-        # 分割文本
+        return processed_files, documents
+    
+    def split_documents(self, documents: List) -> List:
+        """分割文本"""
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=3000,           # 每个文本块的最大字符数
             chunk_overlap=1000,          # 相邻文本块之间重叠的字符数
             length_function=len,       # 用于计算文本长度的函数，这里用的是内置的len函数
             is_separator_regex=False,  # 分隔符是否为正则表达式，False表示不是
         )
-        split_docs = text_splitter.split_documents(documents)
-        
-        return processed_files, split_docs
+        return text_splitter.split_documents(documents)
     
     #保存分块
     def save_split_docs(self, split_docs: List, chunk_path: str):
@@ -239,8 +437,11 @@ class FaissVectorDatabase(VectorDatabase):
             
             # 更新向量数据库
             print(f"正在添加 {len(new_split_docs)} 个新文档块到向量数据库...")
-            self.vector_store.add_documents(new_split_docs)
-            self.vector_store.save_local(self.index_path)
+            with self.index_lock:
+                self.vector_store.add_documents(new_split_docs)
+                self.vector_store.save_local(self.index_path)
+                self.index_version += 1
+                self.publish_snapshot()
             print("数据库更新完成！")
         else:
             print("未处理到有效文档，无需更新")
@@ -294,6 +495,117 @@ class FaissVectorDatabase(VectorDatabase):
             vector_store.save_local(index_path)
             return vector_store
 
+    def _read_exist_files(self) -> Set[str]:
+        if not os.path.exists(self.exist_file_path):
+            return set()
+        try:
+            with open(self.exist_file_path, 'r', encoding='utf-8') as f:
+                return set(json.load(f))
+        except Exception as e:
+            print(f"读取已存在文件列表出错: {str(e)}")
+            return set()
+    
+    def _write_exist_files(self, exist_files: Set[str]) -> None:
+        with open(self.exist_file_path, 'w', encoding='utf-8') as f:
+            json.dump(sorted(exist_files), f, ensure_ascii=False)
+    
+    def pending_files(self) -> List[str]:
+        """上传目录中尚未入库的文件"""
+        return sorted(set(self.load_documents()) - self._read_exist_files())
+    
+    def _wait_for_ingestion_worker(self, file_list: List[str], report: Callable[[str, int], None]) -> dict:
+        """reader模式：由入库进程处理上传目录，等待包含这些文件的快照加载完成"""
+        files = set(file_list)
+        manifest = self.snapshot_watcher.wait_for(
+            lambda m: files <= set(m["files"]),
+            timeout=float(os.getenv("INGEST_WAIT_TIMEOUT", "1800"))
+        )
+        report("indexed", len(files))
+        return {"files": len(files), "snapshot": manifest["snapshot"], "version": manifest["version"]}
+    
+    async def await_ingested(
+        self,
+        file_list: List[str],
+        progress: Optional[Callable[[str, int], None]] = None
+    ) -> dict:
+        """reader模式下 ingest_files 的异步版本：在事件循环中等待包含这些文件的快照加载完成，不占用线程
+        
+        param:
+            file_list: 上传目录中的文件名列表
+            progress: 进度回调，快照加载后报告 indexed 阶段
+        return:
+            dict: 文件数与已加载快照的版本
+        """
+        files = set(file_list)
+        manifest = await self.snapshot_watcher.await_for(
+            lambda m: files <= set(m["files"]),
+            timeout=float(os.getenv("INGEST_WAIT_TIMEOUT", "1800"))
+        )
+        if progress is not None:
+            progress("indexed", len(files))
+        return {"files": len(files), "snapshot": manifest["snapshot"], "version": manifest["version"]}
+    
+    def ingest_files(
+        self,
+        file_list: List[str],
+        progress: Optional[Callable[[str, int], None]] = None
+    ) -> dict:
+        """分阶段入库指定的上传文件：解析、分块、嵌入、写入索引
+        
+        文件在开始时登记到已入库列表，自动更新线程不会重复处理；入库失败时撤销登记
+        
+        param:
+            file_list: 上传目录中的文件名列表
+            progress: 进度回调，参数为 (阶段名, 数量)，阶段依次为 parsed / chunked / embedded / indexed
+        return:
+            dict: 各阶段处理的数量
+        """
+        report = progress or (lambda stage, count: None)
+        if self.ingestion_mode == "reader":
+            return self._wait_for_ingestion_worker(file_list, report)
+        with self.index_lock:
+            exist_files = self._read_exist_files()
+            claimed = [f for f in file_list if f not in exist_files]
+            if claimed:
+                self._write_exist_files(exist_files | set(claimed))
+        skipped = len(file_list) - len(claimed)
+        
+        try:
+            processed_files, documents = self.parse_documents(claimed, self.file_uploads_dir)
+            report("parsed", len(documents))
+            split_docs = self.split_documents(documents) if documents else []
+            if split_docs:
+                self.save_split_docs(split_docs, self.file_chunks_dir)
+            report("chunked", len(split_docs))
+            
+            texts = [doc.page_content for doc in split_docs]
+            embeddings = self.embeddings.embed_documents(texts) if texts else []
+            report("embedded", len(embeddings))
+            
+            # writer模式下没有有效内容也发布快照：已入库文件列表随快照发布，等待这些文件的API进程据此确认完成
+            if embeddings or (claimed and self.ingestion_mode == "writer"):
+                with self.index_lock:
+                    if embeddings:
+                        self.vector_store.add_embeddings(
+                            list(zip(texts, embeddings)),
+                            metadatas=[doc.metadata for doc in split_docs]
+                        )
+                        self.vector_store.save_local(self.index_path)
+                    self.index_version += 1
+                    self.publish_snapshot()
+            report("indexed", len(embeddings))
+        except BaseException:
+            with self.index_lock:
+                self._write_exist_files(self._read_exist_files() - set(claimed))
+            raise
+        
+        return {
+            "files": len(processed_files),
+            "skipped_files": skipped,
+            "documents": len(documents),
+            "chunks": len(split_docs)
+        }
+
     # 更新向量数据库
     def update_vector_store(self, file_list: List[str]):
         """动态更新现有向量数据库"""
@@ -0,0 +1,207 @@
+"""上传触发的入库任务队列
+
+上传接口保存文件后直接提交入库任务，不再等待向量库的60秒轮询：
+
+- 任务按优先级（数值越小越优先）、同优先级按提交顺序执行，最多 workers 个任务同时执行
+- 入库在线程池中分阶段执行（parsed / chunked / embedded / indexed），每个阶段记录数量与耗时
+- 入库函数为协程函数时（向量库为 reader 模式，由独立的入库进程入库），任务只等待快照发布，
+  在单独的等待任务中执行，不占用工作协程与线程池
+- 保留最近 max_finished 个已结束的任务供查询
+"""
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from rag.monitoring.runtime_metrics import REGISTRY
+
+INGESTION_STAGES = ("parsed", "chunked", "embedded", "indexed")
+
+# 入库函数：(文件列表, 进度回调) -> 结果统计，通常为向量库的 ingest_files，也可以是返回结果的协程函数
+IngestFunc = Callable[[List[str], Callable[[str, int], None]], Dict[str, Any]]
+
+
+@dataclass
+class IngestionJob:
+    """入库任务"""
+    job_id: str
+    files: List[str]
+    priority: int
+    status: str = "queued"
+    stages: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    result: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _stage_start: float = field(default=0.0, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def progress(self, stage: str, count: int) -> None:
+        """记录一个阶段完成，耗时为距上一个阶段完成（或任务开始）的时间"""
+        now = time.perf_counter()
+        self.stages[stage] = {"status": "done", "count": count, "seconds": round(now - self._stage_start, 3)}
+        self._stage_start = now
+
+    def as_dict(self) -> Dict[str, Any]:
+        stages = {
+            stage: self.stages.get(stage, {"status": "pending"})
+            for stage in INGESTION_STAGES
+        }
+        if self.status == "running":
+            current = next((s for s in INGESTION_STAGES if s not in self.stages), None)
+            if current is not None:
+                stages[current] = {"status": "running"}
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "files": self.files,
+            "stages": stages,
+            "result": self.result,
+            "error": self.error,
+            "queued_seconds": round((self.started_at or time.time()) - self.created_at, 3),
+            "run_seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class IngestionJobQueue:
+    """带优先级与并发上限的进程内入库任务队列
+
+    Args:
+        ingest_factory: 返回入库函数的工厂，在任务执行时调用（向量库在服务启动后才就绪）
+        workers: 同时执行的任务数
+        max_finished: 保留的已结束任务数
+    """
+
+    def __init__(self, ingest_factory: Callable[[], IngestFunc], workers: int = 2, max_finished: int = 1000):
+        self.ingest_factory = ingest_factory
+        self.workers = workers
+        self.max_finished = max_finished
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._waiters: Set[asyncio.Task] = set()
+        self._sequence = itertools.count()
+        self._queued_gauge = REGISTRY.gauge("ingest_jobs_queued", "等待执行的入库任务数")
+        self._running_gauge = REGISTRY.gauge("ingest_jobs_running", "执行中的入库任务数")
+        self._finished_counters = {
+            status: REGISTRY.counter(f"ingest_jobs_{status}_total", f"{status} 的入库任务数")
+            for status in ("succeeded", "failed")
+        }
+        self._duration = REGISTRY.histogram("ingest_job_seconds", "入库任务执行耗时")
+
+    async def start(self) -> "IngestionJobQueue":
+        """启动工作协程（重复调用无副作用）"""
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return self
+
+    async def stop(self, *_) -> None:
+        """停止工作协程与等待任务，执行中的入库线程会运行到结束，未执行的任务保留为 queued"""
+        tasks = self._tasks + list(self._waiters)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, files: List[str], priority: int = 10) -> IngestionJob:
+        """提交入库任务
+
+        Args:
+            files: 上传目录中的文件名列表
+            priority: 优先级，数值越小越先执行
+
+        Returns:
+            IngestionJob: 已入队的任务
+        """
+        await self.start()
+        job = IngestionJob(job_id=uuid.uuid4().hex, files=list(files), priority=priority)
+        self._jobs[job.job_id] = job
+        self._queued_gauge.inc()
+        self._queue.put_nowait((priority, next(self._sequence), job.job_id))
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, poll_interval: float = 0.05) -> IngestionJob:
+        """等待任务结束"""
+        job = self._jobs[job_id]
+        while not job.done:
+            await asyncio.sleep(poll_interval)
+        return job
+
+    def _evict_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            self._queued_gauge.dec()
+            if job is None:
+                continue
+            await self._run(job)
+
+    async def _run(self, job: IngestionJob) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        job._stage_start = time.perf_counter()
+        self._running_gauge.inc()
+        try:
+            ingest = self.ingest_factory()
+        except Exception as e:
+            self._fail(job, e)
+            self._finish(job)
+            return
+        if asyncio.iscoroutinefunction(ingest):
+            # 入库由其他进程执行，等待可能长达数十分钟：另起任务等待，立即释放工作协程
+            waiter = asyncio.create_task(self._complete(job, ingest(job.files, job.progress)))
+            self._waiters.add(waiter)
+            waiter.add_done_callback(self._waiters.discard)
+            return
+        await self._complete(job, asyncio.to_thread(ingest, job.files, job.progress))
+
+    async def _complete(self, job: IngestionJob, pending: Awaitable[Optional[Dict[str, Any]]]) -> None:
+        try:
+            job.result = await pending or {}
+            job.status = "succeeded"
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self._finish(job)
+
+    def _fail(self, job: IngestionJob, error: Exception) -> None:
+        job.status = "failed"
+        job.error = f"{type(error).__name__}: {error}"
+        print(f"入库任务 {job.job_id} 失败: {job.error}")
+
+    def _finish(self, job: IngestionJob) -> None:
+        job.finished_at = time.time()
+        self._running_gauge.dec()
+        self._duration.observe(job.finished_at - job.started_at)
+        if job.status in self._finished_counters:
+            self._finished_counters[job.status].inc()
+        self._evict_finished()
+
+    def stats(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "waiting": len(self._waiters),
+            "jobs": statuses,
+        }
@@ -0,0 +1,75 @@
+"""独立的入库进程
+
+PDF解析与嵌入计算在API进程中执行时会与请求处理争抢GIL与CPU，入库期间对话延迟明显升高。
+INGESTION_MODE=worker 时API进程不再入库（向量库以 reader 模式只加载快照），由本进程：
+
+1. 定期扫描上传目录，对新文件分阶段入库（解析、分块、嵌入、写入索引）
+2. 每次更新索引后发布不可变快照并原子替换 manifest.json（见 rag.vector.snapshot）
+3. API进程轮询清单文件，发现新版本后加载快照
+
+运行方式:
+    python -m rag.vector.ingestion_worker                 # 常驻，每5秒扫描一次
+    python -m rag.vector.ingestion_worker --once          # 处理一次后退出
+"""
+import argparse
+import os
+import signal
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from rag.vector.faiss import FaissVectorDatabase
+
+
+def run_once(vector_database: "FaissVectorDatabase") -> Optional[dict]:
+    """入库上传目录中尚未入库的文件，没有新文件时返回 None"""
+    new_files = vector_database.pending_files()
+    if not new_files:
+        return None
+    print(f"入库进程检测到 {len(new_files)} 个新文件")
+    result = vector_database.ingest_files(new_files)
+    print(f"入库完成: {result}")
+    return result
+
+
+def run_forever(vector_database: "FaissVectorDatabase", interval: float, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            run_once(vector_database)
+        except Exception as e:
+            print(f"入库过程中出错: {str(e)}")
+        stop.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="独立的入库进程，发布索引快照供API进程加载")
+    parser.add_argument("--interval", type=float, default=float(os.getenv("INGEST_POLL_INTERVAL", "5")),
+                        help="扫描上传目录的间隔（秒）")
+    parser.add_argument("--nice", type=int, default=int(os.getenv("INGEST_WORKER_NICE", "10")),
+                        help="降低本进程的调度优先级，与API进程同机部署时让出CPU")
+    parser.add_argument("--once", action="store_true", help="处理一次后退出")
+    args = parser.parse_args()
+
+    if args.nice and hasattr(os, "nice"):
+        os.nice(args.nice)
+    # 线程数与CPU亲和性需在导入 torch / faiss 之前设置
+    from rag.cpu_resources import apply_resource_settings, load_resource_settings
+
+    apply_resource_settings(load_resource_settings("ingestion_worker"))
+    from rag.vector.faiss import FaissVectorDatabase
+
+    vector_database = FaissVectorDatabase(ingestion_mode="writer")
+    if args.once:
+        run_once(vector_database)
+        return
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    print(f"入库进程已启动，每 {args.interval}s 扫描一次上传目录")
+    run_forever(vector_database, args.interval, stop)
+    print("入库进程已退出")
+
+
+if __name__ == "__main__":
+    main()
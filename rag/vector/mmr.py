@@ -0,0 +1,164 @@
+"""基于FAISS已存储向量的最大边际相关性（MMR）检索
+
+与LangChain的实现相比：
+1. 候选向量通过 search_and_reconstruct / reconstruct_batch 一次性从索引中重建，
+   不重新嵌入候选文本，也不逐条调用 index.reconstruct
+2. 多样性选择使用NumPy矩阵运算，每轮只计算新选中向量与全部候选的相似度，
+   复杂度为 O(k * fetch_k * d)，fetch_k 取数百时开销可以忽略
+"""
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行做L2归一化，零向量保持为零"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def maximal_marginal_relevance(
+    query_embedding: np.ndarray,
+    candidate_embeddings: np.ndarray,
+    k: int = 4,
+    lambda_mult: float = 0.5,
+) -> Tuple[List[int], np.ndarray]:
+    """向量化的MMR选择
+
+    Args:
+        query_embedding: 查询向量，形状 (d,) 或 (1, d)
+        candidate_embeddings: 候选向量矩阵，形状 (n, d)
+        k: 需要选出的数量
+        lambda_mult: 相关性与多样性的权衡系数，1 表示只看相关性，0 表示只看多样性
+
+    Returns:
+        Tuple[List[int], np.ndarray]: 选中候选的下标（按选择顺序）以及全部候选与查询的余弦相似度
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    if candidates.ndim != 2 or candidates.shape[0] == 0 or k <= 0:
+        return [], np.empty(0, dtype=np.float32)
+
+    query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+    candidates = _normalize_rows(candidates)
+
+    relevance = candidates @ query
+    k = min(k, candidates.shape[0])
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    # 每个候选与已选集合的最大相似度，增量维护
+    max_similarity = candidates @ candidates[first]
+    available = np.ones(candidates.shape[0], dtype=bool)
+    available[first] = False
+
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, candidates @ candidates[best], out=max_similarity)
+
+    return selected, relevance
+
+
+def _fetch_candidates(index: Any, query: np.ndarray, fetch_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """一次检索并重建候选向量，返回 (索引位置, 候选向量)"""
+    try:
+        _, positions, vectors = index.search_and_reconstruct(query, fetch_k)
+        positions, vectors = positions[0], vectors[0]
+        valid = positions != -1
+        return positions[valid], vectors[valid]
+    except RuntimeError:
+        # 部分索引类型（如未设置direct map的IVF）不支持search_and_reconstruct，
+        # reconstruct_batch 同样需要direct map，先建立后再按位置重建
+        _ensure_direct_map(index)
+        _, positions = index.search(query, fetch_k)
+        positions = positions[0]
+        positions = positions[positions != -1]
+        if positions.size == 0:
+            return positions, np.empty((0, index.d), dtype=np.float32)
+        return positions, index.reconstruct_batch(positions.astype(np.int64))
+
+
+def _ensure_direct_map(index: Any) -> None:
+    """IVF索引（含外层包装）没有direct map时建立，其他索引类型不做处理"""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def mmr_search_by_vector(
+    vector_store: Any,
+    embedding: List[float],
+    k: int = 4,
+    fetch_k: int = 20,
+    lambda_mult: float = 0.5,
+    score_threshold: Optional[float] = None,
+) -> List[Tuple[Document, float]]:
+    """在LangChain FAISS向量库上执行向量化MMR检索
+
+    Args:
+        vector_store: langchain_community 的 FAISS 向量库
+        embedding: 查询向量
+        k: 返回的文档数
+        fetch_k: 参与MMR的候选数
+        lambda_mult: 相关性与多样性的权衡系数
+        score_threshold: 可选的余弦相似度下限，低于该值的候选不参与选择
+
+    Returns:
+        List[Tuple[Document, float]]: 文档及其与查询的余弦相似度
+    """
+    index = vector_store.index
+    if index.ntotal == 0:
+        return []
+
+    query = np.asarray([embedding], dtype=np.float32)
+    positions, vectors = _fetch_candidates(index, query, min(fetch_k, index.ntotal))
+    if positions.size == 0:
+        return []
+
+    if score_threshold is not None:
+        relevance = _normalize_rows(vectors) @ _normalize_rows(query)[0]
+        keep = relevance >= score_threshold
+        positions, vectors = positions[keep], vectors[keep]
+        if positions.size == 0:
+            return []
+
+    selected, relevance = maximal_marginal_relevance(query, vectors, k=k, lambda_mult=lambda_mult)
+
+    results = []
+    for i in selected:
+        doc_id = vector_store.index_to_docstore_id[int(positions[i])]
+        doc = vector_store.docstore.search(doc_id)
+        if not isinstance(doc, Document):
+            raise ValueError(f"找不到文档 {doc_id}，得到 {doc}")
+        results.append((doc, float(relevance[i])))
+    return results
+
+
+class FaissMMRRetriever(BaseRetriever):
+    """使用向量化MMR的检索器，可直接用于RetrievalQA等链"""
+
+    vector_database: Any
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    score_threshold: Optional[float] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.vector_database.max_marginal_relevance_search(
+            query,
+            k=self.k,
+            fetch_k=self.fetch_k,
+            lambda_mult=self.lambda_mult,
+            score_threshold=self.score_threshold,
+        )
@@ -0,0 +1,185 @@
+"""向量索引快照的发布与加载
+
+入库进程（rag.vector.ingestion_worker）每次更新索引后把索引保存为一个不可变的快照目录，
+再原子替换清单文件 manifest.json；API进程只轮询清单文件的状态（一次 stat），
+版本号变化时加载清单指向的快照并整体替换内存中的索引，不会读到写了一半的索引。
+
+目录结构:
+    faiss_snapshots/
+        manifest.json     {"version", "snapshot", "files", "ntotal", "published_at"}
+        v000012/          index.faiss, index.pkl
+        v000013/
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+MANIFEST_NAME = "manifest.json"
+
+
+def read_manifest(snapshot_dir: str) -> Optional[Dict]:
+    """读取清单，不存在或内容不完整时返回 None"""
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"读取索引清单失败: {str(e)}")
+        return None
+    if not os.path.isdir(snapshot_path(snapshot_dir, manifest)):
+        return None
+    return manifest
+
+
+def snapshot_path(snapshot_dir: str, manifest: Dict) -> str:
+    return os.path.join(snapshot_dir, manifest["snapshot"])
+
+
+def publish_snapshot(vector_store, snapshot_dir: str, version: int, files: List[str], keep: int = 3) -> Dict:
+    """保存索引快照并原子更新清单
+
+    Args:
+        vector_store: langchain FAISS 向量存储
+        snapshot_dir: 快照根目录
+        version: 快照版本号，需单调递增
+        files: 快照中已入库的文件名
+        keep: 保留的快照个数，更早的快照在清单更新后删除
+
+    Returns:
+        dict: 新的清单
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"v{version:06d}"
+    # 先写入临时目录再重命名，读取方不会看到不完整的快照
+    temp_dir = tempfile.mkdtemp(dir=snapshot_dir, prefix=".tmp-")
+    try:
+        vector_store.save_local(temp_dir)
+        target = os.path.join(snapshot_dir, name)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(temp_dir, target)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    manifest = {
+        "version": version,
+        "snapshot": name,
+        "files": sorted(files),
+        "ntotal": vector_store.index.ntotal,
+        "published_at": time.time(),
+    }
+    fd, temp_manifest = tempfile.mkstemp(dir=snapshot_dir, prefix=".manifest-", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(temp_manifest, os.path.join(snapshot_dir, MANIFEST_NAME))
+
+    snapshots = sorted(d for d in os.listdir(snapshot_dir) if d.startswith("v") and d != name)
+    for old in snapshots[:max(0, len(snapshots) - (keep - 1))]:
+        shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+    return manifest
+
+
+class SnapshotWatcher:
+    """轮询清单文件，版本变化时回调加载新快照
+
+    Args:
+        snapshot_dir: 快照根目录
+        on_snapshot: 加载快照的回调，参数为清单
+        interval: 轮询间隔（秒），每次只对清单文件做一次 stat
+        manifest: 已经加载的清单
+    """
+
+    def __init__(
+        self,
+        snapshot_dir: str,
+        on_snapshot: Callable[[Dict], None],
+        interval: float = 1.0,
+        manifest: Optional[Dict] = None,
+    ):
+        self.snapshot_dir = snapshot_dir
+        self.on_snapshot = on_snapshot
+        self.interval = interval
+        self.manifest = manifest
+        self._signature = None
+        self._stop = threading.Event()
+        self._changed = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def version(self) -> int:
+        return self.manifest["version"] if self.manifest else 0
+
+    def check(self) -> bool:
+        """检查清单是否更新，有新版本时加载并返回 True"""
+        try:
+            stat = os.stat(os.path.join(self.snapshot_dir, MANIFEST_NAME))
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature == self._signature:
+            return False
+        manifest = read_manifest(self.snapshot_dir)
+        if manifest is None or manifest["version"] <= self.version:
+            self._signature = signature
+            return False
+        self.on_snapshot(manifest)
+        self._signature = signature
+        with self._changed:
+            self.manifest = manifest
+            self._changed.notify_all()
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"加载索引快照失败: {str(e)}")
+
+    def start(self) -> "SnapshotWatcher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def wait_for(self, predicate: Callable[[Dict], bool], timeout: Optional[float] = None) -> Dict:
+        """等待已加载的清单满足条件
+
+        Raises:
+            TimeoutError: 超时仍未满足
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while self.manifest is None or not predicate(self.manifest):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"等待索引快照超时（{timeout}s）")
+                self._changed.wait(remaining)
+            return self.manifest
+
+    async def await_for(self, predicate: Callable[[Dict], bool], timeout: Optional[float] = None) -> Dict:
+        """wait_for 的异步版本：按轮询间隔检查已加载的清单，等待期间不占用线程
+
+        Raises:
+            TimeoutError: 超时仍未满足
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.manifest is None or not predicate(self.manifest):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError(f"等待索引快照超时（{timeout}s）")
+            await asyncio.sleep(self.interval if remaining is None else min(self.interval, remaining))
+        return self.manifest
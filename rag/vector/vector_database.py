@@ -1,15 +1,36 @@
-from typing import List
-from pydantic import BaseModel
+import asyncio
+import os
+import threading
+from typing import Callable, List, Optional
 from langchain_core.documents import Document
 # 将VectorDatabase类定义放在最前面，避免循环导入
 class VectorDatabase:
     def __init__(self, path = None):
         self.vector_database = {}
         self.path = path
+        self.index_version = 0
 
     def query_vector_database(self, query: str)->List[Document]:
         """query vector database"""
         pass
+    async def aquery_vector_database(self, query: str)->List[Document]:
+        """query vector database in a worker thread without blocking the event loop"""
+        return await asyncio.to_thread(self.query_vector_database, query)
+    def query_vector_database_by_vector(self, embedding: List[float])->List[Document]:
+        """query vector database with an already computed query embedding"""
+        pass
+    async def aquery_vector_database_by_vector(self, embedding: List[float])->List[Document]:
+        """query by embedding in a worker thread without blocking the event loop"""
+        return await asyncio.to_thread(self.query_vector_database_by_vector, embedding)
+    def query_vector_database_batch(self, queries: List[str])->List[List[Document]]:
+        """query vector database for several queries, one document list per query"""
+        return [self.query_vector_database(query) for query in queries]
+    async def aquery_vector_database_batch(self, queries: List[str])->List[List[Document]]:
+        """batch query in a worker thread without blocking the event loop"""
+        return await asyncio.to_thread(self.query_vector_database_batch, queries)
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5)->List[Document]:
+        """query vector database with maximal marginal relevance"""
+        pass
     def load_or_create_vector_store(self, split_docs: List, index_path: str):
         """create or load vector database"""
         pass
@@ -18,18 +39,28 @@ class VectorDatabase:
         """update vector database"""
         pass
 
+    def ingest_files(self, file_list: List[str], progress: Optional[Callable[[str, int], None]] = None) -> dict:
+        """ingest uploaded files stage by stage, reporting (stage, count) to progress"""
+        pass
+
 # 延迟导入FaissVectorDatabase，避免循环依赖
 vector_database_instance = None
+# 保证多线程同时获取时只初始化一次（嵌入模型只加载一次）
+_instance_lock = threading.Lock()
 
 def create_vector_database_instance(path = None):
     global vector_database_instance
-    if vector_database_instance is None:
-        from rag.vector.faiss import FaissVectorDatabase
-        vector_database_instance = FaissVectorDatabase()
+    with _instance_lock:
+        if vector_database_instance is None:
+            from rag.vector.faiss import FaissVectorDatabase
+            # INGESTION_MODE=worker 时由独立的入库进程（rag.vector.ingestion_worker）入库，本进程只加载其发布的快照
+            if os.getenv("INGESTION_MODE", "inline") == "worker":
+                vector_database_instance = FaissVectorDatabase(ingestion_mode="reader")
+            else:
+                vector_database_instance = FaissVectorDatabase()
     return vector_database_instance
 
 def get_vector_database_instance():
-    global vector_database_instance
     if vector_database_instance is None:
-        vector_database_instance = create_vector_database_instance()
+        return create_vector_database_instance()
     return vector_database_instance